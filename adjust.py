@@ -0,0 +1,233 @@
+# -*-coding:utf-8 -*-
+
+'''
+复权计算
+将每日行情和除权系数整理为 代码×日期 的稠密NumPy数组, 一次计算前复权(qfq)和后复权(hfq)价格
+    * 前复权: 价格 * 除权系数 / 最新除权系数
+    * 后复权: 价格 * 除权系数
+复权结果按截止日期缓存, 新增交易日或除权事件时只重算受影响的股票
+缓存同时记录行情的来源目录和覆盖区间的开始日期, 来源不同的缓存不会被使用
+
+Usage:
+    engine = AdjustEngine(cache_fp='./data/adjusted/', source='./data/daily/')
+    panel = engine.adjust(datas, adj_factors, start_date='20180101')   # 全量计算
+    panel = engine.update(new_datas, new_adj_factors)         # 增量追加新交易日
+    qfq_close = panel['qfq'][:, :, FIELDS.index('close')]
+    window = AdjustEngine.window(panel, '20210101', '20211231')   # 区间内的结果, 前复权以区间内最新的除权系数为基准
+'''
+
+import os
+import numpy as np
+import pandas as pd
+
+# 需要复权的价格字段
+FIELDS = ['open', 'high', 'low', 'close']
+
+# 将长表转换为 代码×日期 的稠密数组
+def to_dense(df, columns, codes=None, dates=None, code_col='ts_code', date_col='trade_date'):
+    """
+    Arguments:
+        df 	DataFrame 	Y 	长表, 每行一个(代码, 日期)
+        columns 	list 	Y 	需要转换的字段
+        codes 	Index 	N 	代码索引, 默认取df中全部代码并排序
+        dates 	Index 	N 	日期索引, 默认取df中全部日期并排序
+
+    Returns:
+        values 	ndarray 	Y 	形状为 (代码数, 日期数, 字段数), 缺失值为NaN
+        codes 	Index 	Y 	代码索引
+        dates 	Index 	Y 	日期索引
+    """
+    codes = pd.Index(np.sort(df[code_col].unique())) if codes is None else codes
+    dates = pd.Index(np.sort(df[date_col].unique())) if dates is None else dates
+    ci = codes.get_indexer(df[code_col])
+    di = dates.get_indexer(df[date_col])
+    keep = (ci >= 0) & (di >= 0)
+
+    values = np.full((len(codes), len(dates), len(columns)), np.nan)
+    values[ci[keep], di[keep]] = df[columns].to_numpy(dtype='float64')[keep]
+    return values, codes, dates
+
+# 每个股票最后一个有效的除权系数
+def last_valid(factor):
+    valid = ~np.isnan(factor)
+    idx = factor.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    last = factor[np.arange(factor.shape[0]), idx]
+    last[~valid.any(axis=1)] = np.nan
+    return last
+
+# 按长表逐行复权, 不做MultiIndex对齐
+def adjust_frame(datas, adj_factors, how='qfq', fields=FIELDS, code_col='code', date_col='datetime'):
+    """
+    Arguments:
+        datas 	DataFrame 	Y 	行情长表, 包含 code_col, date_col 和价格字段
+        adj_factors 	DataFrame 	Y 	除权系数, 包含 ts_code, trade_date, adj_factor
+        how 	str 	N 	qfq 前复权, hfq 后复权
+
+    Returns:
+        datas 	DataFrame 	Y 	复权后的行情, 缺少除权系数的价格为NaN
+    """
+    factor, codes, dates = to_dense(adj_factors, ['adj_factor'])
+    factor = factor[:, :, 0]
+    ci = codes.get_indexer(datas[code_col])
+    di = dates.get_indexer(datas[date_col])
+    found = (ci >= 0) & (di >= 0)
+
+    ratio = np.full(len(datas), np.nan)
+    ratio[found] = factor[ci[found], di[found]]
+    if how == 'qfq':
+        ratio[found] = ratio[found] / last_valid(factor)[ci[found]]
+
+    datas = datas.copy()
+    for field in fields:
+        datas[field] = datas[field].to_numpy() * ratio
+    return datas
+
+# 复权引擎, 按截止日期缓存复权后的稠密价格数组
+class AdjustEngine(object):
+    """
+    Arguments:
+        cache_fp 	str 	N 	缓存目录, 默认只缓存在内存中
+        source 	str 	N 	行情的来源目录, 记录在缓存中, 只使用来源相同的缓存
+    """
+    def __init__(self, cache_fp=None, source=None):
+        self.cache_fp = cache_fp
+        self.source = os.path.abspath(source) if source else ''
+        self.panels = {}
+
+    # 全量计算复权价格
+    def adjust(self, datas, adj_factors, start_date=None):
+        """
+        Arguments:
+            datas 	DataFrame 	Y 	Tushare每日行情, 包含 ts_code, trade_date, open, high, low, close
+            adj_factors 	DataFrame 	Y 	除权系数, 包含 ts_code, trade_date, adj_factor
+            start_date 	str 	N 	读取行情的开始日期, 即缓存覆盖区间的开始, 默认为第一个交易日
+
+        Returns:
+            panel 	dict 	Y 	codes, dates, raw, volume, factor, last_factor, qfq, hfq, source, start_date
+                raw/qfq/hfq 形状为 (代码数, 日期数, 4), volume/factor 形状为 (代码数, 日期数)
+        """
+        codes = pd.Index(np.union1d(datas['ts_code'].unique(), adj_factors['ts_code'].unique()))
+        dates = pd.Index(np.union1d(datas['trade_date'].unique(), adj_factors['trade_date'].unique()))
+        raw, _, _ = to_dense(datas, FIELDS, codes, dates)
+        volume, _, _ = to_dense(datas, ['vol'], codes, dates)
+        factor, _, _ = to_dense(adj_factors, ['adj_factor'], codes, dates)
+        factor = factor[:, :, 0]
+
+        hfq = raw * factor[:, :, None]
+        last_factor = last_valid(factor)
+        qfq = hfq / last_factor[:, None, None]
+
+        panel = dict(codes=codes, dates=dates, raw=raw, volume=volume[:, :, 0], factor=factor, last_factor=last_factor, qfq=qfq, hfq=hfq,
+                     source=self.source, start_date=min(start_date, dates[0]) if start_date else dates[0])
+        self.save(panel)
+        return panel
+
+    # 追加新交易日, 只重算最新除权系数发生变化的股票的前复权价格
+    def update(self, datas, adj_factors, end_date=None):
+        """
+        Arguments:
+            datas 	DataFrame 	Y 	新增交易日的行情
+            adj_factors 	DataFrame 	Y 	新增交易日的除权系数
+            end_date 	str 	N 	作为基础的缓存截止日期, 默认取最近的缓存
+
+        Returns:
+            panel 	dict 	Y 	截止到新交易日的复权结果
+        """
+        base = self.get(end_date) if end_date else self.latest()
+        if base is None:
+            return self.adjust(datas, adj_factors)
+
+        new_dates = np.union1d(datas['trade_date'].unique(), adj_factors['trade_date'].unique())
+        new_dates = pd.Index(new_dates[new_dates > base['dates'][-1]])
+        codes = pd.Index(np.union1d(base['codes'], np.union1d(datas['ts_code'].unique(), adj_factors['ts_code'].unique())))
+        dates = base['dates'].append(new_dates)
+
+        # 已有股票的历史部分直接沿用, 新股票补NaN
+        rows = codes.get_indexer(base['codes'])
+        raw = np.full((len(codes), len(dates), len(FIELDS)), np.nan)
+        volume = np.full((len(codes), len(dates)), np.nan)
+        factor = np.full((len(codes), len(dates)), np.nan)
+        hfq = np.full((len(codes), len(dates), len(FIELDS)), np.nan)
+        qfq = np.full((len(codes), len(dates), len(FIELDS)), np.nan)
+        n = len(base['dates'])
+        raw[rows, :n] = base['raw']
+        volume[rows, :n] = base['volume']
+        factor[rows, :n] = base['factor']
+        hfq[rows, :n] = base['hfq']
+        qfq[rows, :n] = base['qfq']
+
+        new_raw, _, _ = to_dense(datas, FIELDS, codes, new_dates)
+        new_factor, _, _ = to_dense(adj_factors, ['adj_factor'], codes, new_dates)
+        raw[:, n:] = new_raw
+        volume[:, n:] = to_dense(datas, ['vol'], codes, new_dates)[0][:, :, 0]
+        factor[:, n:] = new_factor[:, :, 0]
+        hfq[:, n:] = new_raw * new_factor
+
+        old_last = np.full(len(codes), np.nan)
+        old_last[rows] = base['last_factor']
+        last_factor = last_valid(factor)
+        qfq[:, n:] = hfq[:, n:] / last_factor[:, None, None]
+
+        # 最新除权系数变化的股票, 历史前复权价格按比例整体缩放
+        changed = np.flatnonzero(~np.isclose(last_factor, old_last) & ~np.isnan(old_last))
+        qfq[changed, :n] = qfq[changed, :n] * (old_last[changed] / last_factor[changed])[:, None, None]
+        # 新上市或此前没有除权系数的股票, 直接由后复权价格计算
+        fresh = np.flatnonzero(np.isnan(old_last) & ~np.isnan(last_factor))
+        qfq[fresh, :n] = hfq[fresh, :n] / last_factor[fresh, None, None]
+
+        panel = dict(codes=codes, dates=dates, raw=raw, volume=volume, factor=factor, last_factor=last_factor, qfq=qfq, hfq=hfq,
+                     source=self.source, start_date=base['start_date'])
+        self.save(panel)
+        return panel
+
+    # 截取 [start_date, end_date] 区间, 前复权价格以区间内最新的除权系数为基准, 与对区间内数据调用 adjust_frame 相同
+    @staticmethod
+    def window(panel, start_date, end_date):
+        dates = panel['dates']
+        i, j = dates.searchsorted(start_date, side='left'), dates.searchsorted(end_date, side='right')
+        factor = panel['factor'][:, i:j]
+        hfq = panel['hfq'][:, i:j]
+        last_factor = last_valid(factor)
+        return dict(codes=panel['codes'], dates=dates[i:j], raw=panel['raw'][:, i:j], volume=panel['volume'][:, i:j],
+                    factor=factor, last_factor=last_factor, qfq=hfq / last_factor[:, None, None], hfq=hfq,
+                    source=panel['source'], start_date=max(panel['start_date'], start_date))
+
+    # 最近的来源相同的缓存
+    def latest(self):
+        end_dates = set(self.panels.keys())
+        if self.cache_fp and os.path.exists(self.cache_fp):
+            end_dates.update(f[9:17] for f in os.listdir(self.cache_fp) if f.startswith('adjusted_') and f.endswith('.npz'))
+        for end_date in sorted(end_dates, reverse=True):
+            panel = self.get(end_date)
+            if panel is not None:
+                return panel
+        return None
+
+    # 按截止日期读取缓存, 来源不同或没有记录来源的旧缓存返回None
+    def get(self, end_date):
+        if end_date in self.panels:
+            return self.panels[end_date]
+        fname = os.path.join(self.cache_fp, 'adjusted_%s.npz' % end_date) if self.cache_fp else None
+        if not fname or not os.path.exists(fname):
+            return None
+        with np.load(fname) as f:
+            if 'source' not in f.files or str(f['source']) != self.source:
+                return None
+            panel = {k: f[k] for k in f.files}
+        panel['codes'] = pd.Index(panel['codes'])
+        panel['dates'] = pd.Index(panel['dates'])
+        panel['source'] = str(panel['source'])
+        panel['start_date'] = str(panel['start_date'])
+        self.panels[end_date] = panel
+        return panel
+
+    # 按截止日期缓存到内存, 设置了cache_fp时同时写入磁盘
+    def save(self, panel):
+        end_date = panel['dates'][-1]
+        self.panels[end_date] = panel
+        if self.cache_fp:
+            os.makedirs(self.cache_fp, exist_ok=True)
+            fname = os.path.join(self.cache_fp, 'adjusted_%s.npz' % end_date)
+            arrays = {k: v for k, v in panel.items() if k not in ('codes', 'dates', 'source', 'start_date')}
+            np.savez(fname, codes=panel['codes'].to_numpy(dtype='str'), dates=panel['dates'].to_numpy(dtype='str'),
+                     source=np.str_(panel['source']), start_date=np.str_(panel['start_date']), **arrays)
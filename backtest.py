@@ -1,10 +1,12 @@
 import backtrader as bt
 from datetime import datetime
 import os, time
+from concurrent.futures import ProcessPoolExecutor
 import math
 import argparse
 import numpy as np
 import dataloader
+from bt_batch import BatchBroker, isolate
 import pandas as pd
 from oversell import OversellStrategy
 
@@ -49,6 +51,127 @@ def generate_report(res):
             tradings['lost']['pnl']['average'],
             tradings['lost']['pnl']['max']))
 
+# 单个股票回测, 只返回分析结果, 可在子进程中运行
+def run_backtest(code, stock, plot=False):
+    # Variable for our starting cash
+    startcash = 10000
+
+    # Create an instance of cerebro
+    cerebro = bt.Cerebro()
+
+    # Add strategy
+    cerebro.addstrategy(eval(strategy['classname'])) 
+
+    data = bt.feeds.PandasData(dataname=stock)
+    cerebro.adddata(data)
+
+    # Add a sizer
+    cerebro.addsizer(AllInOut)
+
+    # Set our desired cash start
+    cerebro.broker.setcash(startcash)
+    cerebro.broker.setcommission(0.00075)
+
+    # Add analyzers
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio_A)
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio)
+    cerebro.addanalyzer(bt.analyzers.DrawDown)
+    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer)
+
+    # Run over everything
+    res = cerebro.run()
+    res = res[0]
+
+    # Get final portfolio Value
+    portvalue = cerebro.broker.getvalue()
+    result = collect_result(code, res, portvalue, startcash)
+
+    if (plot):
+        # Finally plot the end results
+        cerebro.plot(style='candlestick',
+                    bardown='green',
+                    barup='red',
+                    barupfill=False,
+                    bardownfill=True)
+
+    return result
+
+# 整理单个策略实例的分析结果
+def collect_result(code, res, portvalue, startcash):
+    pnl = portvalue - startcash
+
+    drawdown = res.analyzers.drawdown.get_analysis()
+    result = dict(code=code, portvalue=portvalue, pnl=pnl, row=None,
+                  sharpe=res.analyzers.sharperatio_a.get_analysis()['sharperatio'],
+                  drawdown=drawdown['max']['drawdown'],
+                  moneydown=drawdown['max']['moneydown'])
+
+    tradings = res.analyzers.tradeanalyzer.get_analysis()
+    if tradings['total']['total']==0: 
+        pass
+    else:
+        try: 
+            result['row'] = dict(
+                        code=[code],
+                        PnL=[pnl], 
+                        Trades=[tradings['won']['total'] + tradings['lost']['total']], 
+                        Wins=[tradings['won']['total']],
+                        Win_Ratio=[tradings['won']['total'] / float(tradings['won']['total'] + tradings['lost']['total'])], 
+                        Losts = [tradings['lost']['total']], 
+                        Lost_Ratio = [tradings['lost']['total'] / float(tradings['won']['total'] + tradings['lost']['total'])], 
+                        Win_Value = [tradings['won']['pnl']['total']], 
+                        Win_Avg = [tradings['won']['pnl']['average']], 
+                        Win_Max = [tradings['won']['pnl']['max']], 
+                        Lost_Value = [tradings['lost']['pnl']['total']], 
+                        Lost_Avg = [tradings['lost']['pnl']['average']], 
+                        Lost_Max = [tradings['lost']['pnl']['max']]
+            )
+        except:
+            pass
+
+    return result
+
+# 多个股票在同一个Cerebro中回测, 每个股票有独立的资金和分析器, 结果与逐个回测一致
+def run_batch(codes, stocks):
+    startcash = 10000
+
+    # 每批只创建一次Cerebro, 不需要整体的资金曲线观察器
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.broker = BatchBroker()
+
+    # 每个股票一个数据源, 由一个只使用该数据源和独立资金的策略实例负责
+    for i, (code, stock) in enumerate(zip(codes, stocks)):
+        cerebro.adddata(bt.feeds.PandasData(dataname=stock), name=code)
+        cerebro.addstrategy(isolate(eval(strategy['classname']), i, cash=startcash))
+
+    cerebro.addsizer(AllInOut)
+
+    # 总资金为各股票资金之和, 每个策略只能使用自己的部分
+    cerebro.broker.setcash(startcash * len(codes))
+    cerebro.broker.setcommission(0.00075)
+
+    # 分析器按策略实例添加, 使用的是各自的资金账户
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio_A)
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio)
+    cerebro.addanalyzer(bt.analyzers.DrawDown)
+    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer)
+
+    res = cerebro.run()
+    return [collect_result(code, strat, strat.broker.getvalue(), startcash) for code, strat in zip(codes, res)]
+
+# 子进程中的行情面板, 内存映射的面板只传路径
+_panel = None
+
+def _init_worker(panel):
+    global _panel
+    _panel = panel
+
+def _run_backtest_worker(code):
+    return run_backtest(code, _panel.to_frame(code))
+
+def _run_batch_worker(codes):
+    return run_batch(codes, [_panel.to_frame(code) for code in codes])
+
 def get_args():
     parser = argparse.ArgumentParser()
 
@@ -57,6 +180,10 @@ def get_args():
     parser.add_argument('--fp', help='File Path Prefix for daily prices')
     parser.add_argument('--scope', help='Back test data scope: RANDOM, HS300, ZZ500, ZZ1000')
     parser.add_argument('--plot', help='Plot the result: True or False')
+    parser.add_argument('--panel_cache', help='Directory to cache the adjusted market panel as a memory-mapped file')
+    parser.add_argument('--adjust_cache', help='Directory to cache forward-adjusted prices by end date, extended incrementally')
+    parser.add_argument('--workers', type=int, help='Number of processes running per-symbol backtests')
+    parser.add_argument('--batch', type=int, help='Number of symbols simulated together in one Cerebro run')
 
     return parser.parse_args()
 
@@ -69,92 +196,49 @@ if __name__ == '__main__':
     end_date = args.end_date if args.end_date else '20220128'
     fp = args.fp if args.fp else './data/daily/'
     method = args.scope if args.scope else 'RANDOM'
-    dataset = dataloader.get_daily_from_local(start_date=start_date, end_date=end_date, fp=fp)
-    dataset = dataloader.filter_stock(dataset=dataset, method=method, n=100)
-    dataset.sort_values(by='datetime', ascending=True, inplace=True)
+    # 行情面板可缓存为内存映射文件, 再次运行或多个进程时直接映射, 不再解析CSV
+    panel = dataloader.get_panel_from_local(start_date=start_date, end_date=end_date, fp=fp, cache_fp=args.panel_cache, adjust_fp=args.adjust_cache)
+    # 只在股票基本信息上筛选样本, 不复制整个行情
+    stock_basic = pd.read_csv(os.path.join(fp, 'stock_basic.csv'), dtype={'list_date':'str'})
+    stock_basic = stock_basic.rename(columns={'ts_code':'code'})
+    stock_basic = stock_basic[stock_basic['code'].isin(panel.codes)]
+    # 主板、非ST、上市满一年按回测第一个交易日查表, ST以当天的名称判断; filter_stock只负责按范围抽样
+    universe = dataloader.get_universe_from_local(start_date=start_date, end_date=end_date, fp=fp, cache_fp=args.panel_cache)
+    stock_basic = stock_basic[stock_basic['code'].isin(universe.members(universe.dates[0]))]
+    selected = dataloader.filter_stock(dataset=stock_basic, method=method, n=100, ignore_ST=False, ignore_IPO=False, market=None)
+    stocks = np.sort(selected['code'].dropna().unique())
+    if args.panel_cache is None: # 没有内存映射文件时, 只把选中的股票传给子进程
+        panel = panel.select(stocks)
+
+    plot = args.plot if args.plot else False
+    if args.batch and args.batch > 1 and not plot:
+        # 按批回测, 每批共用一个Cerebro, 批内按股票顺序返回结果
+        batches = [stocks[i:i + args.batch] for i in range(0, len(stocks), args.batch)]
+        if args.workers and args.workers > 1:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(panel,)) as executor:
+                results = [result for batch in executor.map(_run_batch_worker, batches) for result in batch]
+        else:
+            results = [result for batch in batches for result in run_batch(batch, [panel.to_frame(code) for code in batch])]
+    elif args.workers and args.workers > 1 and not plot:
+        # 每个子进程只接收一次面板, map按股票顺序返回结果, 汇总结果与单进程一致
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(panel,)) as executor:
+            results = list(executor.map(_run_backtest_worker, stocks))
+    else:
+        results = (run_backtest(code, panel.to_frame(code), plot=plot) for code in stocks)
 
     accumulated_pnl = 0.0
     summary = pd.DataFrame(columns=['code', 'PnL', 'Trades', 'Wins', 'Win_Ratio', 'Losts', 'Lost_Ratio', 'Win_Value', 'Win_Avg', 'Win_Max', 'Lost_Value', 'Lost_Avg', 'Lost_Max'])
-    stocks = dataset.groupby('code')
-    for code, stock in stocks:
-        stock = stock[['datetime','open','high','low','close','volume']].copy()
-        stock['datetime'] = pd.to_datetime(stock['datetime'], format='%Y%m%d')
-        stock['openinterest'] = 0.0
-        stock.set_index('datetime', inplace=True)
-
-        # Variable for our starting cash
-        startcash = 10000
-
-        # Create an instance of cerebro
-        cerebro = bt.Cerebro()
-
-        # Add strategy
-        cerebro.addstrategy(eval(strategy['classname'])) 
-
-        data = bt.feeds.PandasData(dataname=stock)
-        cerebro.adddata(data)
-
-        # Add a sizer
-        cerebro.addsizer(AllInOut)
-
-        # Set our desired cash start
-        cerebro.broker.setcash(startcash)
-        cerebro.broker.setcommission(0.00075)
-
-        # Add analyzers
-        cerebro.addanalyzer(bt.analyzers.SharpeRatio_A)
-        cerebro.addanalyzer(bt.analyzers.SharpeRatio)
-        cerebro.addanalyzer(bt.analyzers.DrawDown)
-        cerebro.addanalyzer(bt.analyzers.TradeAnalyzer)
-
-        # Run over everything
-        res = cerebro.run()
-        res = res[0]
-
-        # Get final portfolio Value
-        portvalue = cerebro.broker.getvalue()
-        pnl = portvalue - startcash
-
-        accumulated_pnl += pnl
+    for result in results:
+        accumulated_pnl += result['pnl']
 
         # Print out the final result
-        print(f'Symbol: {code}')
-        print('Final Portfolio Value: ${}'.format(round(portvalue, 2)))
-        print('P/L: ${}'.format(round(pnl, 2)))
+        print(f"Symbol: {result['code']}")
+        print('Final Portfolio Value: ${}'.format(round(result['portvalue'], 2)))
+        print('P/L: ${}'.format(round(result['pnl'], 2)))
         print('==============================================')
 
-        tradings = res.analyzers.tradeanalyzer.get_analysis()
-        if tradings['total']['total']==0: 
-            pass
-        else:
-            try: 
-                row = pd.DataFrame(dict(
-                            code=[code],
-                            PnL=[pnl], 
-                            Trades=[tradings['won']['total'] + tradings['lost']['total']], 
-                            Wins=[tradings['won']['total']],
-                            Win_Ratio=[tradings['won']['total'] / float(tradings['won']['total'] + tradings['lost']['total'])], 
-                            Losts = [tradings['lost']['total']], 
-                            Lost_Ratio = [tradings['lost']['total'] / float(tradings['won']['total'] + tradings['lost']['total'])], 
-                            Win_Value = [tradings['won']['pnl']['total']], 
-                            Win_Avg = [tradings['won']['pnl']['average']], 
-                            Win_Max = [tradings['won']['pnl']['max']], 
-                            Lost_Value = [tradings['lost']['pnl']['total']], 
-                            Lost_Avg = [tradings['lost']['pnl']['average']], 
-                            Lost_Max = [tradings['lost']['pnl']['max']]
-                ))
-                summary = summary.append(row, ignore_index=True)
-            except:
-                pass
-
-        plot = args.plot if args.plot else False
-        if (plot):
-            # Finally plot the end results
-            cerebro.plot(style='candlestick',
-                        bardown='green',
-                        barup='red',
-                        barupfill=False,
-                        bardownfill=True)
+        if result['row'] is not None:
+            summary = summary.append(pd.DataFrame(result['row']), ignore_index=True)
 
     print(f"Accumulated Profit & Loss: {accumulated_pnl :.2f}.")
 
@@ -0,0 +1,175 @@
+# -*-coding:utf-8 -*-
+
+'''
+最近K个bar的环形缓冲区
+每个股票保存最近K个bar的行情和指标值, 每个交易日只写入当天的bar, 不需要保留或排序全部历史
+收盘后的信号判断直接在缓冲区上按数组计算, 每个股票的最近一个bar在 window 的最后一行
+
+Usage:
+    buffer = BarBuffer(codes, fields=['close', 'ADX_14', 'DMP_14', 'DMN_14'], size=2)
+    buffer.push(20220128, values)                    # values 形状为 (代码数, 字段数), 停牌的股票为NaN时不写入
+    mask = buffer.evaluate(lambda bars: bars['DMP_14'][-1] < 10)
+    buffer.save('./data/cache/buffer.npz')
+    buffer = BarBuffer.load('./data/cache/buffer.npz')
+    buffer.merge(today)                              # 下一个交易日只写入比缓冲区更新的bar
+'''
+
+import os
+import numpy as np
+import pandas as pd
+
+class BarBuffer(object):
+    """
+    Arguments:
+        codes 	array 	Y 	股票代码
+        fields 	list 	Y 	字段名
+        size 	int 	N 	每个股票保存的bar数K
+    """
+    def __init__(self, codes, fields, size=2):
+        self.codes = np.asarray(codes)
+        self.fields = list(fields)
+        self.size = size
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.values = np.full((size, len(self.codes), len(self.fields)), np.nan)
+        self.dates = np.zeros((size, len(self.codes)), dtype='int32')
+        # 每个股票下一个写入的位置和已有的bar数
+        self.pos = np.zeros(len(self.codes), dtype='int64')
+        self.count = np.zeros(len(self.codes), dtype='int64')
+
+    # 由靠下对齐的宽表(如 indicators.stack_bars 的结果)的最后size行构建
+    @classmethod
+    def from_frames(cls, frames, dates, size=2):
+        """
+        Arguments:
+            frames 	dict 	Y 	字段名到宽表的映射, 列为code, 最后一行是每个股票最近的bar
+            dates 	DataFrame 	Y 	与frames对齐的日期, int, 没有bar时为0
+            size 	int 	N 	每个股票保存的bar数K
+
+        Returns:
+            buffer 	BarBuffer 	Y 	环形缓冲区
+        """
+        dates = dates.iloc[-size:]
+        buffer = cls(dates.columns, list(frames.keys()), size)
+        values = np.stack([frame.iloc[-size:].to_numpy(dtype='float64') for frame in frames.values()], axis=2)
+        for date, row in zip(dates.to_numpy(dtype='int32'), values):
+            buffer.push(date, row, valid=date > 0)
+        return buffer
+
+    # 合并字段和大小相同、股票不重复的多个缓冲区, 股票按参数顺序排列, 忽略None
+    @classmethod
+    def concat(cls, buffers, fields=(), size=2):
+        buffers = [b for b in buffers if b is not None]
+        if not buffers:
+            return cls([], fields, size)
+        buffer = cls(np.concatenate([b.codes for b in buffers]), buffers[0].fields, buffers[0].size)
+        buffer.values = np.concatenate([b.values for b in buffers], axis=1)
+        buffer.dates = np.concatenate([b.dates for b in buffers], axis=1)
+        buffer.pos = np.concatenate([b.pos for b in buffers])
+        buffer.count = np.concatenate([b.count for b in buffers])
+        return buffer
+
+    # 写入一个交易日的bar
+    def push(self, date, values, codes=None, valid=None):
+        """
+        Arguments:
+            date 	int/array 	Y 	交易日, 格式20220128, 也可以是每个股票一个日期
+            values 	ndarray 	Y 	形状为 (股票数, 字段数)
+            codes 	array 	N 	values对应的股票代码, 默认为全部股票; 不在缓冲区中的代码会被添加
+            valid 	array 	N 	需要写入的股票, 默认为各字段不全为NaN的股票(停牌的股票不写入)
+        """
+        values = np.asarray(values, dtype='float64')
+        if codes is None:
+            rows = np.arange(len(self.codes))
+        else:
+            self.add_codes([code for code in codes if code not in self.code_index])
+            rows = np.array([self.code_index[code] for code in codes], dtype='int64')
+        if valid is None:
+            valid = ~np.isnan(values).all(axis=1)
+        valid = np.asarray(valid, dtype='bool')
+        date = np.broadcast_to(np.asarray(date, dtype='int32'), len(rows))
+
+        rows, values, date = rows[valid], values[valid], date[valid]
+        slots = self.pos[rows]
+        self.values[slots, rows] = values
+        self.dates[slots, rows] = date
+        self.pos[rows] = (slots + 1) % self.size
+        self.count[rows] = np.minimum(self.count[rows] + 1, self.size)
+
+    # 添加新股票, 没有历史bar
+    def add_codes(self, codes):
+        if not len(codes):
+            return
+        n = len(codes)
+        self.codes = np.concatenate([self.codes, np.asarray(codes)])
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.values = np.concatenate([self.values, np.full((self.size, n, len(self.fields)), np.nan)], axis=1)
+        self.dates = np.concatenate([self.dates, np.zeros((self.size, n), dtype='int32')], axis=1)
+        self.pos = np.concatenate([self.pos, np.zeros(n, dtype='int64')])
+        self.count = np.concatenate([self.count, np.zeros(n, dtype='int64')])
+
+    # 写入另一个缓冲区中比本缓冲区更新的bar, 日期相同的bar用另一个缓冲区的值覆盖(数据修正、复权)
+    def merge(self, other):
+        """
+        Arguments:
+            other 	BarBuffer 	Y 	字段相同的缓冲区, 如当天重新计算的每个股票最后几个bar
+        """
+        self.add_codes([code for code in other.codes if code not in self.code_index])
+        rows = np.array([self.code_index[code] for code in other.codes], dtype='int64')
+        bars = other.window()
+        # 从最早的bar开始写入, 最后一行是最近的bar
+        for k in range(other.size):
+            date = bars['datetime'][k]
+            values = np.stack([bars[field][k] for field in self.fields], axis=1)
+            latest = np.where(self.count[rows] > 0, self.dates[(self.pos[rows] - 1) % self.size, rows], 0)
+            same = (self.dates[:, rows] == date[None, :]) & (date > 0)[None, :]
+            slot, found = same.argmax(axis=0), same.any(axis=0)
+            self.values[slot[found], rows[found]] = values[found]
+            self.push(date, values, codes=other.codes, valid=(date > latest) & (date > 0))
+
+    # 清空部分股票的bar, 之后重新写入
+    def clear(self, codes):
+        rows = np.array([self.code_index[code] for code in codes if code in self.code_index], dtype='int64')
+        self.values[:, rows] = np.nan
+        self.dates[:, rows] = 0
+        self.pos[rows] = 0
+        self.count[rows] = 0
+
+    # 每个股票最近n个bar在环形数组中的位置, 形状为 (n, 股票数), 最后一行是最近的bar
+    def _slots(self, n):
+        return (self.pos[None, :] - n + np.arange(n)[:, None]) % self.size
+
+    # 最近n个bar, 字段名到 (n, 股票数) 数组的映射, 不足n个bar的部分为NaN, 日期为0
+    def window(self, n=None):
+        n = self.size if n is None else n
+        slots = self._slots(n)
+        missing = np.arange(n)[:, None] < (n - self.count[None, :])
+        cols = np.arange(len(self.codes))[None, :]
+        values = np.where(missing[:, :, None], np.nan, self.values[slots, cols])
+        bars = {field: values[:, :, i] for i, field in enumerate(self.fields)}
+        bars['datetime'] = np.where(missing, 0, self.dates[slots, cols])
+        return bars
+
+    # 在缓冲区上计算信号, predicate接收 window() 的结果, 返回每个股票一个布尔值
+    def evaluate(self, predicate, n=None):
+        return np.asarray(predicate(self.window(n)), dtype='bool')
+
+    # 每个股票最近的bar, 以code为索引的DataFrame
+    def last(self):
+        bars = self.window(1)
+        frame = pd.DataFrame({field: values[-1] for field, values in bars.items()}, index=pd.Index(self.codes, name='code'))
+        frame['datetime'] = frame['datetime'].astype('str')
+        return frame
+
+    def save(self, fname):
+        os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+        tmp = fname + '.tmp.npz'
+        np.savez(tmp, codes=self.codes.astype('str'), fields=np.asarray(self.fields, dtype='str'),
+                 values=self.values, dates=self.dates, pos=self.pos, count=self.count)
+        os.replace(tmp, fname)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname, allow_pickle=False) as f:
+            buffer = cls(f['codes'], list(f['fields']), f['values'].shape[0])
+            buffer.values, buffer.dates, buffer.pos, buffer.count = f['values'], f['dates'], f['pos'], f['count']
+        return buffer
@@ -2,6 +2,7 @@ import backtrader as bt
 from datetime import datetime
 import os
 import math
+import precomputed
 
 
 class AllInOut(bt.Sizer):
@@ -36,11 +37,14 @@ class BOLLStrat(bt.Strategy):
                 debug=False, 
                 take_profit=30.0,
                 stop_loss=0.95,
-                trail_percent=0.05,)
+                trail_percent=0.05,
+                precomputed=False,)
 
     def __init__(self):
-        self.boll = bt.indicators.BollingerBands(period=self.p.period,
-                                                 devfactor=self.p.devfactor)
+        # precomputed=True 时读取 precomputed.IndicatorData 中预先计算的布林线
+        indicators = precomputed if self.p.precomputed else bt.indicators
+        self.boll = indicators.BollingerBands(period=self.p.period,
+                                              devfactor=self.p.devfactor)
         self.stop_orders = []
         self.buy_orders = []
         self.order = None
@@ -57,7 +61,7 @@ class BOLLStrat(bt.Strategy):
         if not self.position:
             if (self.data.close < self.boll.bot):
                 size = math.floor(
-                    (self.broker.getcash() / data.close[0] / 100)) * 100
+                    (self.broker.getcash() / self.data.close[0] / 100)) * 100
                 if (size > 0):
                     buy_order = self.buy(size=size)
                     stop_order = self.sell(size=size, exectype=bt.Order.StopTrail, trailpercent=self.p.trail_percent)
@@ -73,7 +77,7 @@ class BOLLStrat(bt.Strategy):
                     self.boll.bot) and (self.broker.get_cash() >=
                                         self.p.size * self.boll.lines.bot):
                 size = math.floor(
-                    (self.broker.getcash() / data.close[0] / 100)) * 100
+                    (self.broker.getcash() / self.data.close[0] / 100)) * 100
                 if (size > 0):
                     buy_order = self.buy(size=size)
                     stop_order = self.sell(size=size, exectype=bt.Order.StopTrail, trailpercent=self.p.trail_percent)
@@ -135,82 +139,83 @@ class BOLLStrat(bt.Strategy):
             # )
 
 
-# Variable for our starting cash
-startcash = 10000
-
-# Create an instance of cerebro
-cerebro = bt.Cerebro()
-
-# Add our strategy
-cerebro.addstrategy(BOLLStrat)
-
-data = bt.feeds.GenericCSVData(dataname=os.path.join('.','data','601318_SH.csv'),
-                               dtformat=('%Y-%m-%d'),
-                               datetime=0,
-                               open=1,
-                               high=2,
-                               low=3,
-                               close=4,
-                               volumn=5,
-                               openinterest=6)
-
-# Add the data to Cerebro
-cerebro.adddata(data)
-
-# Add a sizer
-cerebro.addsizer(AllInOut)
-
-# Set our desired cash start
-cerebro.broker.set_cash(startcash)
-
-# Add analyzers
-cerebro.addanalyzer(bt.analyzers.SharpeRatio_A)
-cerebro.addanalyzer(bt.analyzers.SharpeRatio)
-cerebro.addanalyzer(bt.analyzers.DrawDown)
-cerebro.addanalyzer(bt.analyzers.TradeAnalyzer)
-
-# Run over everything
-res = cerebro.run()
-res = res[0]
-
-# Get final portfolio Value
-portvalue = cerebro.broker.getvalue()
-pnl = portvalue - startcash
-
-# Print out the final result
-print('Final Portfolio Value: ${}'.format(round(portvalue, 2)))
-print('P/L: ${}'.format(round(pnl, 2)))
-
-# Analyzer results
-sharpe = res.analyzers.sharperatio_a.get_analysis()
-print('Sharpe Ratio: %.2f' % sharpe['sharperatio'])
-
-drawdown = res.analyzers.drawdown.get_analysis()
-print('Max drawdown percent: %.2f' % drawdown['max']['drawdown'])
-print('Max drawdown money: %.0f' % drawdown['max']['moneydown'])
-
-tradings = res.analyzers.tradeanalyzer.get_analysis()
-print('=================Trading Analysis=================')
-print('========won=========')
-print('won ratio: %.2f' % (tradings['won']['total'] / float(tradings['won']['total'] + tradings['lost']['total'])))
-print('won hits: %.0f' % tradings['won']['total'])
-print('won pnl total: %.0f, avg: %.0f, max: %.0f' % 
-        (tradings['won']['pnl']['total'],
-        tradings['won']['pnl']['average'],
-        tradings['won']['pnl']['max']))
-
-print('========lost========')
-print('lost ratio: %.2f' % (tradings['lost']['total'] / float(tradings['won']['total'] + tradings['lost']['total'])))
-print('lost hits: %.0f' % tradings['lost']['total'])
-print('lost pnl total: %.0f, avg: %.0f, max: %.0f' % 
-        (tradings['lost']['pnl']['total'],
-        tradings['lost']['pnl']['average'],
-        tradings['lost']['pnl']['max']))
-
-
-# Finally plot the end results
-cerebro.plot(style='candlestick',
-             bardown='green',
-             barup='red',
-             barupfill=False,
-             bardownfill=True)
+if __name__ == '__main__':
+    # Variable for our starting cash
+    startcash = 10000
+
+    # Create an instance of cerebro
+    cerebro = bt.Cerebro()
+
+    # Add our strategy
+    cerebro.addstrategy(BOLLStrat)
+
+    data = bt.feeds.GenericCSVData(dataname=os.path.join('.','data','601318_SH.csv'),
+                                   dtformat=('%Y-%m-%d'),
+                                   datetime=0,
+                                   open=1,
+                                   high=2,
+                                   low=3,
+                                   close=4,
+                                   volumn=5,
+                                   openinterest=6)
+
+    # Add the data to Cerebro
+    cerebro.adddata(data)
+
+    # Add a sizer
+    cerebro.addsizer(AllInOut)
+
+    # Set our desired cash start
+    cerebro.broker.set_cash(startcash)
+
+    # Add analyzers
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio_A)
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio)
+    cerebro.addanalyzer(bt.analyzers.DrawDown)
+    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer)
+
+    # Run over everything
+    res = cerebro.run()
+    res = res[0]
+
+    # Get final portfolio Value
+    portvalue = cerebro.broker.getvalue()
+    pnl = portvalue - startcash
+
+    # Print out the final result
+    print('Final Portfolio Value: ${}'.format(round(portvalue, 2)))
+    print('P/L: ${}'.format(round(pnl, 2)))
+
+    # Analyzer results
+    sharpe = res.analyzers.sharperatio_a.get_analysis()
+    print('Sharpe Ratio: %.2f' % sharpe['sharperatio'])
+
+    drawdown = res.analyzers.drawdown.get_analysis()
+    print('Max drawdown percent: %.2f' % drawdown['max']['drawdown'])
+    print('Max drawdown money: %.0f' % drawdown['max']['moneydown'])
+
+    tradings = res.analyzers.tradeanalyzer.get_analysis()
+    print('=================Trading Analysis=================')
+    print('========won=========')
+    print('won ratio: %.2f' % (tradings['won']['total'] / float(tradings['won']['total'] + tradings['lost']['total'])))
+    print('won hits: %.0f' % tradings['won']['total'])
+    print('won pnl total: %.0f, avg: %.0f, max: %.0f' % 
+            (tradings['won']['pnl']['total'],
+            tradings['won']['pnl']['average'],
+            tradings['won']['pnl']['max']))
+
+    print('========lost========')
+    print('lost ratio: %.2f' % (tradings['lost']['total'] / float(tradings['won']['total'] + tradings['lost']['total'])))
+    print('lost hits: %.0f' % tradings['lost']['total'])
+    print('lost pnl total: %.0f, avg: %.0f, max: %.0f' % 
+            (tradings['lost']['pnl']['total'],
+            tradings['lost']['pnl']['average'],
+            tradings['lost']['pnl']['max']))
+
+
+    # Finally plot the end results
+    cerebro.plot(style='candlestick',
+                 bardown='green',
+                 barup='red',
+                 barupfill=False,
+                 bardownfill=True)
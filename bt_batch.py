@@ -0,0 +1,148 @@
+# -*-coding:utf-8 -*-
+
+'''
+批量回测
+把N个股票作为N个数据源放进同一个Cerebro运行, Cerebro创建和数据转换的开销每批只付一次
+每个股票由一个独立的策略实例负责:
+    * 策略只绑定自己的数据源, self.data / self.position 与单股票回测相同
+    * 策略看到的 broker 是独立的资金账户, getcash()/getvalue() 只包含自己的现金和持仓
+    * 下单检查和成交(包括部分成交)都使用该股票自己的现金, 现金不足时与单独回测一样以 Margin 拒绝
+    * 分析器按策略实例添加, TradeAnalyzer 只统计自己的交易
+    * 股票停牌(当天没有数据)时策略不运行, 未成交的订单也不会按停牌前的价格成交
+因此每个股票的结果与单独回测一致
+
+Usage:
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.broker = BatchBroker()
+    for i, (code, stock) in enumerate(stocks):
+        cerebro.adddata(bt.feeds.PandasData(dataname=stock), name=code)
+        cerebro.addstrategy(isolate(OversellStrategy, i, cash=10000))
+    cerebro.broker.setcash(10000 * len(stocks))
+'''
+
+import backtrader as bt
+
+# 单个股票的独立资金账户, 现金保存在BatchBroker中, 未覆盖的方法都交给真正的broker
+class CashBucket(object):
+    def __init__(self, broker, data, cash):
+        if not isinstance(broker, BatchBroker):
+            raise TypeError('CashBucket requires a BatchBroker, got %s' % type(broker).__name__)
+        self._broker = broker
+        self._data = data
+        self.startingcash = cash
+        broker.add_bucket(data, cash)
+
+    @property
+    def cash(self):
+        return self._broker.buckets[self._data]
+
+    def getcash(self):
+        return self.cash
+
+    get_cash = getcash
+
+    def getvalue(self, datas=None, mkt=False, lever=False):
+        position = self._broker.getposition(self._data)
+        return self.cash + position.size * self._data.close[0]
+
+    get_value = getvalue
+
+    def __getattr__(self, name):
+        return getattr(self._broker, name)
+
+# 只处理当前bar有新数据的股票的订单, 停牌股票的订单留到复牌后处理
+# 有独立资金账户的股票, 下单检查和成交都只使用自己账户中的现金
+class BatchBroker(bt.brokers.BackBroker):
+    def __init__(self):
+        super(BatchBroker, self).__init__()
+        self.buckets = dict()
+
+    # 为数据源设置独立资金, 这部分现金仍包含在总资金中
+    def add_bucket(self, data, cash):
+        self.buckets[data] = cash
+
+    # 与BackBroker相同, 但每个资金账户分别累计预执行后剩余的现金
+    def check_submitted(self):
+        cash = dict()
+        positions = dict()
+
+        while self.submitted:
+            order = self.submitted.popleft()
+
+            if self._take_children(order) is None:
+                continue
+
+            key = order.data if order.data in self.buckets else None
+            if key not in cash:
+                cash[key] = self.cash if key is None else self.buckets[key]
+
+            position = positions.setdefault(order.data, self.positions[order.data].clone())
+
+            cash[key] = self._execute(order, cash=cash[key], position=position)
+
+            if cash[key] >= 0.0:
+                self.submit_accept(order)
+                continue
+
+            order.margin()
+            self.notify(order)
+            self._ococheck(order)
+            self._bracketize(order, cancel=True)
+
+    def _try_exec(self, order):
+        # 数据的日期没有超过下单时或上次检查时的日期, 说明当天停牌
+        last = getattr(order, '_batch_dt', order.created.dt)
+        if order.data.datetime[0] <= last:
+            return
+        order._batch_dt = order.data.datetime[0]
+
+        if order.data not in self.buckets:
+            super(BatchBroker, self)._try_exec(order)
+            return
+
+        # 成交时把self.cash换成该股票的现金, BackBroker的现金检查和部分成交都作用在独立账户上
+        pooled = self.cash
+        self.cash = self.buckets[order.data]
+        try:
+            super(BatchBroker, self)._try_exec(order)
+        finally:
+            delta = self.cash - self.buckets[order.data]
+            self.buckets[order.data] = self.cash
+            self.cash = pooled + delta
+
+# 生成只使用第idx个数据源和独立资金账户的策略类
+def isolate(stratcls, idx, cash=10000):
+    class IsolatedStrategy(stratcls):
+        _bucket_idx = idx
+        _bucket_cash = cash
+
+        # cerebro会把所有数据源传给每个策略, 这里只保留自己的
+        @classmethod
+        def donew(cls, *args, **kwargs):
+            datas = [arg for arg in args if isinstance(arg, bt.AbstractDataBase)]
+            args = (datas[cls._bucket_idx],) + tuple(args[len(datas):])
+            return type(cls).donew(cls, *args, **kwargs)
+
+        # 在策略__init__之前替换broker, 之后添加的sizer也会使用独立账户
+        @classmethod
+        def dopreinit(cls, _obj, *args, **kwargs):
+            _obj, args, kwargs = type(cls).dopreinit(cls, _obj, *args, **kwargs)
+            _obj.broker = CashBucket(_obj.broker, _obj.data, cls._bucket_cash)
+            _obj._bucket_len = 0
+            return _obj, args, kwargs
+
+        # 自己的数据源没有新bar时(停牌或尚未上市)不运行
+        def _next(self):
+            if len(self.data) == self._bucket_len:
+                return
+            self._bucket_len = len(self.data)
+            super(IsolatedStrategy, self)._next()
+
+        def _oncepost(self, dt):
+            if len(self.data) == self._bucket_len:
+                return
+            self._bucket_len = len(self.data)
+            super(IsolatedStrategy, self)._oncepost(dt)
+
+    IsolatedStrategy.__name__ = stratcls.__name__
+    return IsolatedStrategy
@@ -1,17 +1,24 @@
 from datetime import datetime
-import random
-import argparse
+import argparse, os, time
 import numpy as np
 import dataloader
+import ranking
+from universe import Universe
 import pandas as pd
 
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-import seaborn as sb
+# 观察期和持有期的起点, [start_date, end_date] 内的每周一
+def mondays(start_date, end_date):
+    return list(pd.date_range(start_date, end_date, freq='W-MON').strftime('%Y%m%d'))
 
-def contrarian_strategy(start_week, s, h, loser=True):
-    weeks = pd.date_range("20210101","20221231", freq='W-MON')
-    weeks = list(weeks.strftime('%Y%m%d'))
+# 默认的起点, 2021-2022年的每周一
+WEEKS = mondays('20210101', '20221231')
+
+def contrarian_strategy(start_week, s, h, loser=True, prices=None, stock_basic=None, calendar=None, universe=None, weeks=None):
+    # 有对数价格矩阵时按单个格子的批量计算
+    if prices is not None:
+        return contrarian_grid(prices, stock_basic, [(start_week, s, h)], calendar=calendar, loser=loser, universe=universe, weeks=weeks)[0]
+
+    weeks = WEEKS if weeks is None else weeks
     scan_start_date = weeks[start_week]
     scan_end_date = weeks[start_week+s]
     hold_start_date = weeks[start_week+s]
@@ -20,12 +27,13 @@ def contrarian_strategy(start_week, s, h, loser=True):
 
     try:
         scan = dataloader.calc_growth_from_local(start_date=scan_start_date, end_date=scan_end_date)
-        scan = dataloader.filter_stock(dataset=scan, method='ALL')
-        scan.sort_values(by='total_growth', ascending=loser, inplace=True)
-        selected = scan.head(20)
+        # 在观察期结束的那一周查表筛选, 没有 universe 时由合并进来的股票基本信息构建, ST按当前名称判断
+        universe = universe if universe is not None else Universe.build(scan, [scan_end_date])
+        scan = scan[universe.at(scan_end_date, scan['ts_code'])]
+        selected = ranking.top_rows(scan, 'total_growth', 20, largest=not loser)
 
         hold = dataloader.calc_growth_from_local(start_date=hold_start_date, end_date=hold_end_date)
-        hold = dataloader.filter_stock(dataset=hold, method='ALL')
+        hold = hold[universe.at(hold_start_date, hold['ts_code'])]
 
         result = pd.merge(selected[['ts_code']], hold, on='ts_code', how='left')
         rtn = np.average(result['total_growth'])
@@ -34,6 +42,93 @@ def contrarian_strategy(start_week, s, h, loser=True):
         
     return rtn
 
+# 基本信息完整的股票, 与 calc_growth_from_local 中合并基本信息后dropna的结果相同, 其余筛选条件按选股日由 Universe 判断
+def eligible_codes(stock_basic, codes):
+    basic = stock_basic[stock_basic.notna().all(axis=1)]
+    return np.isin(np.asarray(codes), basic['ts_code'].to_numpy())
+
+# 一次计算多个 (start_week, s, h) 格子的逆向策略收益, 结果与逐个调用 contrarian_strategy 相同
+def contrarian_grid(prices, stock_basic, cells, calendar=None, n=20, loser=True, missing=1.0, chunk=256, universe=None, weeks=None):
+    """
+    Arguments:
+        prices 	LogPrices 	Y 	复权对数价格矩阵
+        stock_basic 	DataFrame 	Y 	股票基本信息
+        cells 	list 	Y 	(start_week, s, h) 的列表, s为观察周数, h为持有周数
+        calendar 	array 	N 	交易日历中的交易日, 默认为矩阵中的交易日
+        n 	int 	N 	每期选出的股票数
+        loser 	bool 	N 	True选观察期跌幅最大的股票, False选涨幅最大的股票
+        missing 	float 	N 	观察期或持有期没有行情、没有入选股票的格子的取值
+        chunk 	int 	N 	每批计算的观察期数, 每批占用 chunk×代码数 的数组
+        universe 	Universe 	N 	按日期的股票池, 在观察期结束的那一周判断ST和上市时间, 默认按当前名称判断ST
+        weeks 	list 	N 	观察期和持有期的起点, 默认为 WEEKS
+
+    Returns:
+        rtn 	ndarray 	Y 	每个格子入选股票持有期的平均涨幅, 入选股票持有期停牌时为NaN
+    """
+    cells = np.asarray(cells, dtype='int64').reshape(-1, 3)
+    start, s, h = cells[:, 0], cells[:, 1], cells[:, 2]
+    weeks = np.asarray(WEEKS if weeks is None else weeks)
+    in_range = start + s + h < len(weeks)
+    week = lambda k: weeks[np.minimum(k, len(weeks) - 1)]
+
+    i1, j1 = prices.locate(week(start), week(start + s), calendar)
+    i2, j2 = prices.locate(week(start + s), week(start + s + h), calendar)
+
+    # 观察期相同的格子入选的股票相同, 每个不同的观察期只选一次股
+    decision = np.minimum(start + s, len(weeks) - 1)
+    scans, inverse = np.unique(np.stack([i1, j1, decision], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    eligible = eligible_codes(stock_basic, prices.codes)[None, :]
+    # 与 contrarian_strategy 逐个区间计算时的筛选相同
+    universe = universe if universe is not None else Universe.build(stock_basic, weeks)
+    m = min(n, len(prices.codes))
+    order = np.zeros((len(scans), m), dtype='int64')
+    chosen = np.zeros((len(scans), m), dtype='bool')
+    for k in range(0, len(scans), chunk):
+        si, sj = scans[k:k + chunk, 0], scans[k:k + chunk, 1]
+        # 观察期的涨幅, 形状为 (观察期数, 代码数), 每个区间只是矩阵两列之差
+        scan = prices.growth_between(si, sj)
+        valid = eligible & (si != sj)[:, None] & universe.at(weeks[scans[k:k + chunk, 2]], prices.codes)
+        order[k:k + chunk], chosen[k:k + chunk] = ranking.top_n(scan, m, largest=not loser, valid=valid)
+    order, chosen = order[inverse], chosen[inverse]
+
+    # 持有期只取入选股票的两列之差, 形状为 (格子数, n)
+    held = np.exp(prices.values[order, j2[:, None]] - prices.values[order, i2[:, None]])
+    # 开始和结束为同一个交易日时年化涨幅无法计算, 原实现中这些行被dropna去掉
+    held[i2 == j2] = np.nan
+
+    count = chosen.sum(axis=1)
+    total = np.where(chosen, held, 0.0).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rtn = total / count
+    # 原实现中读取不到行情文件或没有入选股票时抛出异常, 记为1.0
+    rtn[(count == 0) | ~in_range | (i1 < 0) | (i2 < 0)] = missing
+    return rtn
+
+# 遍历每个 (s, h) 的全部起始周, 统计收益的均值、中位数和标准差
+def contrarian_surface(prices, stock_basic, calendar=None, n=20, loser=True, max_week=50, universe=None, weeks=None):
+    """
+    Arguments:
+        prices 	LogPrices 	Y 	复权对数价格矩阵
+        stock_basic 	DataFrame 	Y 	股票基本信息
+        calendar 	array 	N 	交易日历中的交易日
+        n 	int 	N 	每期选出的股票数
+        loser 	bool 	N 	True选跌幅最大的股票(逆向), False选涨幅最大的股票(动量)
+        max_week 	int 	N 	start_week+s+h 的上限, 与原来的随机抽样范围相同
+        universe 	Universe 	N 	按日期的股票池
+        weeks 	list 	N 	观察期和持有期的起点, 默认为 WEEKS
+
+    Returns:
+        surface 	DataFrame 	Y 	以 (s, h) 为索引的 mean, median, std, count, 没有行情的起始周不计入
+    """
+    cells = [(start_week, s, h) for s in range(1, max_week - 1)
+                                for h in range(1, max_week - s)
+                                for start_week in range(0, max_week - s - h)]
+    cells = pd.DataFrame(cells, columns=['start_week', 's', 'h'])
+    cells['rtn'] = contrarian_grid(prices, stock_basic, cells[['start_week', 's', 'h']].to_numpy(),
+                                   calendar=calendar, n=n, loser=loser, missing=np.nan, universe=universe, weeks=weeks)
+    return cells.groupby(['s', 'h'])['rtn'].agg(['mean', 'median', 'std', 'count'])
+
 def get_args():
     parser = argparse.ArgumentParser()
 
@@ -42,34 +137,53 @@ def get_args():
     parser.add_argument('--fp', help='File Path Prefix for daily prices')
     parser.add_argument('--scope', help='Back test data scope: RANDOM, HS300, ZZ500, ZZ1000')
     parser.add_argument('--plot', help='Plot the result: True or False')
+    parser.add_argument('--cache', help='Directory to cache the adjusted log-price matrix')
+    parser.add_argument('--top', type=int, help='Number of stocks held in each portfolio')
+    parser.add_argument('--winner', help='Hold the top winners instead of the top losers: True or False')
+    parser.add_argument('--stat', help='Statistic across start weeks shown in the heatmap: mean, median or std')
 
     return parser.parse_args()
     
 if __name__ == '__main__':
     args = get_args()
 
-    start_date = args.start_date if args.start_date else '20210101'
-    end_date = args.end_date if args.end_date else '20220128'
+    start_date = args.start_date if args.start_date else WEEKS[0]
+    end_date = args.end_date if args.end_date else WEEKS[-1]
     fp = args.fp if args.fp else './data/daily/'
     method = args.scope if args.scope else 'ALL'
+    # 观察期和持有期的起点取命令行区间内的每周一
+    weeks = mondays(start_date, end_date)
+
+    # 对数价格矩阵只构建一次, 之后每个格子的涨幅都是矩阵两列之差
+    prices = dataloader.get_log_prices_from_local(start_date=start_date, end_date=end_date, fp=fp, cache_fp=args.cache)
+    calendar = dataloader.get_trade_dates_from_local(start_date=weeks[0], end_date=weeks[-1], fp=fp)
+    stock_basic = pd.read_csv(os.path.join(fp, 'stock_basic.csv'), dtype={'list_date':'str'})
+    # 每个选股日按当天的名称和上市时间筛选
+    universe = dataloader.get_universe_from_local(start_date=weeks[0], end_date=weeks[-1], fp=fp, cache_fp=args.cache)
 
+    top = args.top if args.top else 20
+    loser = not args.winner
+    stat = args.stat if args.stat else 'mean'
 
-    results = np.ones([52,52])
-    i = 0
-    l = 49*50*0.5
-    for s in np.arange(1,49):
-        for h in np.arange(1,50-s):
-            start_week = random.choice(np.arange(0, 50-s-h))
-            results[s][h] = contrarian_strategy(start_week,s,h)
+    # 每个 (s, h) 遍历全部起始周
+    t1 = time.time()
+    surface = contrarian_surface(prices, stock_basic, calendar=calendar, n=top, loser=loser, universe=universe, weeks=weeks)
+    print(np.round(surface, 4))
+    print('共计算%.0f个格子，耗时:%.2f 秒' % (surface['count'].sum(), time.time() - t1))
 
-            i += 1
-            dataloader.progress_bar(i, l, prefix='Progress:', suffix='Complete', barLength=50)
+    results = np.ones([52,52]) if stat != 'std' else np.zeros([52,52])
+    for (s, h), value in surface[stat].items():
+        results[s][h] = value
 
-    results = np.nan_to_num(results, nan=1.0)
+    results = np.nan_to_num(results, nan=1.0 if stat != 'std' else 0.0)
     vmin = np.min(results)
     vmax = np.max(results)
 
-    # 画图
+    # 画图, 只在命令行运行时需要绘图库
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+    import seaborn as sb
+
     mpl.rcParams['font.family']= 'Microsoft YaHei UI' # 指定字体，实际上相当于修改 matplotlibrc 文件　只不过这样做是暂时的　下次失效
     mpl.rcParams['axes.unicode_minus']=False # 正确显示负号，防止变成方框
 
@@ -79,8 +193,8 @@ if __name__ == '__main__':
     ax.set_xlabel('Holding Period (Weeks)')
     ax.set_ylabel('Watch Period (Weeks)')
     cmap = sb.diverging_palette(220,20,sep=3, as_cmap=True)
-    sb.heatmap(results, cmap=cmap, center=1.0, vmin=vmin, vmax=vmax,
+    sb.heatmap(results, cmap=cmap, center=1.0 if stat != 'std' else None, vmin=vmin, vmax=vmax,
                 linewidth=0.3, ax=ax, square=True,
                 cbar_kws={"shrink": .8})
-    plt.title('Contrarian Strategy', loc='left')
+    plt.title('%s Strategy (%s over start weeks)' % ('Contrarian' if loser else 'Momentum', stat), loc='left')
     plt.show()
\ No newline at end of file
@@ -20,7 +20,16 @@ import numpy as np
 import tushare as ts
 from datetime import datetime, timedelta
 import os, time
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 import pandas_ta as ta
+from panel import MarketPanel
+from indicator_cache import IndicatorCache
+from indicator_state import IndicatorState
+import indicators
+import ranking
+from barbuffer import BarBuffer
+from trade_calendar import TradeCalendar
 
 settings = dict(
             freq = '1D',
@@ -28,6 +37,9 @@ settings = dict(
             index_codes = ['000001.SH','000016.SH','000300.SH','000905.SH','000688.SH','399001.SZ','399006.SZ'],
             ignore_newly_IPO = True,
             ignore_ST = True,
+            vectorized = True,          # 在宽表上一次计算全部股票的指标, False时逐个股票用pandas_ta计算
+            indicator_cache = './data/cache/indicators/',   # 指标缓存目录, 每次只计算缓存之后的交易日, None时不使用缓存
+            workers = None,             # 逐个股票计算时的进程数
             )
 
 def get_pro():
@@ -92,25 +104,18 @@ def nearest_date(dates, pivot, direction='backward', date_format='%Y%m%d'):
         date_formate 	str 	N 	日期格式，默认20201124
 
     Returns:
-        nearest 	str 	Y 	最近交易日
+        nearest 	str 	Y 	最近交易日, 该方向没有交易日时抛出ValueError
     """
-    dates = pd.to_datetime(dates)
-    pivot = datetime.strptime(pivot, date_format)
-    
-    if(direction=='backward'):
-        dates = dates.where(dates<=pivot).dropna()
-    if(direction=='foreward'):
-        dates = dates.where(dates>=pivot).dropna()
-    
-    nearest = min(dates, key=lambda x: abs(x - pivot))
-    return nearest.strftime(date_format)
+    # 二分查找, 多次查询时直接传入 TradeCalendar, 不必每次重新构建
+    calendar = dates if isinstance(dates, TradeCalendar) else TradeCalendar(dates)
+    nearest = calendar.nearest(datetime.strptime(pivot, date_format).strftime('%Y%m%d'), direction=direction)
+    if nearest is None:
+        raise ValueError('交易日历中没有 %s 的 %s 方向的交易日' % (pivot, direction))
+    return datetime.strptime(nearest, '%Y%m%d').strftime(date_format)
 
 # 涨跌幅最大的前N只
 def get_top_changers(df, direction="up", n=20):
-    if direction=="down":
-        return df.sort_values("change%", ascending=True).head(n)
-    else:
-        return df.sort_values("change%", ascending=False).head(n)
+    return ranking.top_rows(df, "change%", n, largest=direction!="down")
 
 # 计算最大回撤
 def drawdown(timeseries):
@@ -156,9 +161,10 @@ def calc_yearly_stats(df):
 # 获取指数行情
 def get_indexes(index_codes=[], mode='all'):
     indexes = pd.DataFrame()
+    calendar = TradeCalendar.from_frame(trade_cal)
     for index_code in index_codes:
         if mode=='recent_day': # 最近交易日
-            recent_trade_date = nearest_date(dates=trade_cal['cal_date'], pivot=datetime.today().strftime('%Y%m%d'))
+            recent_trade_date = nearest_date(dates=calendar, pivot=datetime.today().strftime('%Y%m%d'))
             indexes = pd.concat([indexes, pro.index_daily(ts_code=index_code, trade_date=recent_trade_date)])
         else: # 所有交易日
             indexes = pd.concat([indexes, pro.index_daily(ts_code=index_code)])
@@ -226,7 +232,60 @@ def analyze_indexes(index_codes):
 def analyze_top_winners_losers(ignore_ST=True, ignore_IPO=True):
     return top_winners, top_losers
 
-def identify_opptunities(ignore_ST=True, ignore_IPO=True):
+# 逐个股票用pandas_ta计算指标, 每个股票最后两个bar写入环形缓冲区
+def scan_symbols(panel, codes, strategy, cache_fp=None):
+    """
+    Arguments:
+        panel 	MarketPanel 	Y 	行情面板
+        codes 	list 	Y 	股票代码
+        strategy 	ta.Strategy 	Y 	pandas_ta指标组合
+        cache_fp 	str 	N 	指标缓存目录
+
+    Returns:
+        buffer 	BarBuffer 	Y 	每个股票最后两个bar的行情和指标, 全部股票都没有行情时为None
+        stats 	dict 	Y 	缓存命中、增量计算、全量计算的股票指标数
+    """
+    cache = IndicatorCache(cache_fp) if cache_fp else None
+    buffer = None
+    for code in codes:
+        stock = panel.to_frame(code, openinterest=False)
+        if stock.empty: # 区间内没有行情
+            continue
+        stock.index = stock.index.strftime('%Y%m%d')
+        if cache is None:
+            # 按股票分块并行, pandas_ta不再为每个股票另开进程池
+            stock.ta.cores = 0
+            stock.ta.strategy(strategy)
+        else:
+            stock = cache.apply(code, stock, strategy.ta)
+        if buffer is None:
+            buffer = BarBuffer(codes, stock.columns, size=2)
+        tail = stock.iloc[-2:]
+        for date, values in zip(tail.index, tail[buffer.fields].to_numpy(dtype='float64')):
+            buffer.push(int(date), values[None, :], codes=[code])
+    stats = cache.stats if cache is not None else dict(hit=0, extended=0, computed=0)
+    return buffer, stats
+
+# DMI逆向信号: 最近一个bar的+DI低于阈值
+def dmi_revert_signal(bars, length=14, level=10.0):
+    return bars['DMP_%d' % length][-1] < level
+
+# DMI趋势信号: 最近一个bar的ADX高于阈值, 且+DI上穿-DI
+def dmi_trend_signal(bars, length=14, level=25.0):
+    dmp, dmn = bars['DMP_%d' % length], bars['DMN_%d' % length]
+    return (bars['ADX_%d' % length][-1] > level) & (dmp[-2] < dmn[-2]) & (dmp[-1] > dmn[-1])
+
+# 子进程中的行情面板
+_panel = None
+
+def _init_worker(panel):
+    global _panel
+    _panel = panel
+
+def _scan_symbols_worker(codes, strategy, cache_fp):
+    return scan_symbols(_panel, codes, strategy, cache_fp)
+
+def identify_opptunities(ignore_ST=True, ignore_IPO=True, vectorized=settings['vectorized'], cache_fp=settings['indicator_cache'], workers=settings['workers']):
     data = pd.read_csv('./Projects/quant/data/20211001_20220131.csv', dtype={'datetime':'str', 'list_date':'str'})
     data=data[['code','datetime','open','high','low','close','volumn','openinterest','name','area','industry','market','list_date']]
     data.set_index(['code','datetime'], inplace=True)
@@ -264,30 +323,58 @@ def identify_opptunities(ignore_ST=True, ignore_IPO=True):
     # idx = pd.IndexSlice
     # data = data.loc[idx['600001.SH':'600100.SH',:]].copy()
 
-    with pd.option_context('mode.chained_assignment', None):
-        start_time = time.time()
-        stocks = pd.DataFrame()
-        codes = df.index.get_level_values('code').unique()
-        for code in codes:
-            stock = df.loc[code]
-            stock['code'] = code
-            stock.ta.strategy(CustomStrategy)
-            stocks = pd.concat([stocks, stock])
-        end_time = time.time()
-        print('共处理%.0f个股票，总计耗时:%.2f 秒, 平均%.2f 秒' % (len(codes), (end_time - start_time), (end_time - start_time)/len(codes)))
-
-    stocks.reset_index(inplace=True)
-    stocks.sort_values(by='datetime', ascending=True, inplace=True)
-    last_two_trades = stocks.groupby('code').tail(2)
-    l1 = last_two_trades.groupby('code').first()
-    l2 = last_two_trades.groupby('code').last()
-
-    dmi_revert = l2[l2['DMP_14']<10]
+    # 构建一次稠密面板, 按股票切片不再经过MultiIndex
+    data.reset_index(inplace=True)
+    panel = MarketPanel.from_frame(data, fields=('open','high','low','close','volumn'))
+    names = data.groupby('code')['name'].last()
+
+    start_time = time.time()
+    codes = panel.codes
+    if not vectorized:
+        # 按股票分块, 多个进程并行计算; map按提交顺序返回, 合并结果与单进程一致
+        if workers and workers > 1:
+            chunks = [chunk for chunk in np.array_split(codes, workers * 4) if len(chunk)]
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(panel,)) as executor:
+                results = list(executor.map(_scan_symbols_worker, chunks, repeat(CustomStrategy), repeat(cache_fp)))
+        else:
+            results = [scan_symbols(panel, codes, CustomStrategy, cache_fp)]
+        buffer = BarBuffer.concat([result[0] for result in results], fields=['ADX_14', 'DMP_14', 'DMN_14'])
+        if cache_fp:
+            stats = {k: sum(result[1][k] for result in results) for k in ('hit', 'extended', 'computed')}
+            print('指标缓存: 命中%(hit)d, 增量计算%(extended)d, 全量计算%(computed)d' % stats)
+            # 读取上次扫描的最后两个bar, 只写入新的交易日
+            fname = os.path.join(cache_fp, 'buffer.npz')
+            previous = BarBuffer.load(fname) if os.path.exists(fname) else None
+            if previous is not None and previous.fields == buffer.fields and previous.size == buffer.size:
+                previous.merge(buffer)
+                buffer = previous
+            buffer.save(fname)
+    elif cache_fp:
+        # 读取上次扫描保存的指标状态和最后两个bar, 只用缓存之后的交易日更新
+        state = IndicatorState.load(cache_fp, CustomStrategy.ta) or IndicatorState(CustomStrategy.ta)
+        stats = state.extend(panel)
+        state.save(cache_fp)
+        buffer = state.buffer
+        print('指标缓存: 新增%(dates)d个交易日, 重新计算%(replayed)d个股票' % stats)
+    else:
+        # 在 bar×代码 的宽表上一次计算全部股票, 只取最后两个bar
+        bars = indicators.stack_bars(panel)
+        result = indicators.strategy(bars, CustomStrategy.ta)
+        buffer = BarBuffer.from_frames(result, bars['datetime'], size=2)
+    end_time = time.time()
+    print('共处理%.0f个股票，总计耗时:%.2f 秒, 平均%.2f 秒' % (len(codes), (end_time - start_time), (end_time - start_time)/len(codes)))
+
+    # 信号只在最后两个bar上计算, 缓存中可能有本次已被过滤掉的股票
+    last = buffer.last()
+    last['name'] = names.reindex(last.index)
+    selected = np.isin(buffer.codes, codes)
+
+    dmi_revert = last[buffer.evaluate(dmi_revert_signal) & selected]
     dmi_revert.reset_index(inplace=True)
     dmi_revert = dmi_revert[['code', 'name', 'datetime','ADX_14','DMP_14','DMN_14']]
     print(dmi_revert)
 
-    dmi_trend = l2[(l2['ADX_14']>25) & (l1['DMP_14']<l1['DMN_14']) & (l2['DMP_14']>l2['DMN_14'])]
+    dmi_trend = last[buffer.evaluate(dmi_trend_signal) & selected]
     dmi_trend.reset_index(inplace=True)
     dmi_trend = dmi_trend[['code', 'name', 'datetime','ADX_14','DMP_14','DMN_14']]
     print(dmi_trend)
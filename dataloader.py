@@ -7,14 +7,28 @@ Usage:
     python get_stock_data.py --code '000333.SZ' --start_date '20180104' --end_date '20211230'
 2. 获取整个市场行情
     python get_stock_data.py --start_date '20211001' --end_date '20211030' --fp './data/daily/'
+3. 将每日CSV压缩为按年/月分区的Parquet列式存储
+    python dataloader.py --compact 1 --fp './data/daily/' --store './data/store/'
+4. 从列式存储加载整个市场行情
+    python dataloader.py --start_date '20180101' --end_date '20211231' --store './data/store/'
+5. 增量同步整个市场行情, 只下载缺失或过期的交易日
+    python dataloader.py --sync 1 --start_date '20180101' --fp './data/daily/'
 '''
 
-import os, sys, time
+import os, sys, time, json, threading
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import repeat
+from collections import deque
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 import tushare as ts
+import adjust
+from panel import MarketPanel
+from growth import LogPrices
+from universe import Universe
+from trade_calendar import TradeCalendar
 
 # 显示命令行进度条
 def progress_bar(iteration, total, prefix='', suffix='', decimals=1, barLength=100):
@@ -48,11 +62,63 @@ def get_pro():
         pro = None
     return pro
 
+# 令牌桶限速器, 多个线程共享同一个接口额度
+class RateLimiter(object):
+    """
+    令牌桶限速, 每 per 秒补充 rate 个令牌, 桶中最多存放 burst 个令牌
+
+    Arguments:
+        rate 	int 	Y 	每个周期允许的请求数, 如Tushare每分钟500次
+        per 	float 	N 	周期长度(秒), 默认60秒
+        burst 	int 	N 	允许的突发请求数, 默认1, 即均匀发出请求
+    """
+    def __init__(self, rate, per=60.0, burst=1):
+        self.interval = per / float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) * self.interval
+            time.sleep(wait)
+
+# 调用Tushare接口, 失败后按指数退避重试, 超过次数后抛出最后一次的异常
+def call_api(func, limiter=None, retries=5, backoff=1.0, **kwargs):
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return func(**kwargs)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print(' 调用接口失败: %s, %.1f秒后重试' % (e, backoff * 2 ** attempt))
+            time.sleep(backoff * 2 ** attempt)
+
+# 下载单个交易日的行情, 除权系数和基本面, 三个请求同时发出
+def fetch_daily(pro, trade_date, executor=None, limiter=None, retries=5, backoff=1.0):
+    funcs = (pro.daily, pro.adj_factor, pro.daily_basic)
+    if executor is None:
+        return tuple(call_api(func, limiter, retries, backoff, trade_date=trade_date) for func in funcs)
+    futures = [executor.submit(call_api, func, limiter, retries, backoff, trade_date=trade_date) for func in funcs]
+    return tuple(future.result() for future in futures)
+
 # 获取交易日历
 def get_trade_cal(exchange="SSE",
                   start_date="20000101",
                   end_date="20211231",
-                  is_open=1
+                  is_open=1,
+                  pro=None,
+                  retries=5
                  ):
     """
     获取各大交易所交易日历数据, 默认提取的是上交所
@@ -61,7 +127,9 @@ def get_trade_cal(exchange="SSE",
         exchange 	str 	N 	交易所 SSE 上交所 SZSE 深交所
         start_date 	str 	N 	开始日期
         end_date 	str 	N 	结束日期
-        is_open 	str 	N 	是否交易 '0' 休市 '1' 交易
+        is_open 	str 	N 	是否交易 '0' 休市 '1' 交易 '' 全部
+        pro 	object 	N 	Tushare接口, 默认 get_pro()
+        retries 	int 	N 	失败后的最大重试次数, 每次等待时间加倍
 
     Returns:
         exchange 	str 	Y 	交易所 SSE 上交所 SZSE 深交所
@@ -70,24 +138,16 @@ def get_trade_cal(exchange="SSE",
         pretrade_date 	str 	N 	上一个交易日
     """
 
-    def _get_trade_cal():
-        print(" 正在下载交易日历...")
-        try:
-            pro = get_pro()
-            data = pro.trade_cal(
-                start_date=start_date,
-                end_date=end_date,
-                exchange=exchange,
-                is_open=is_open,
-                fields="exchange, cal_date, is_open, pretrade_date")
-            print(" 下载交易日历 TRADE_DATE {}-{} 成功 ".format(start_date, end_date))
-        except Exception as e:
-            print(e)
-            time.sleep(1)
-            data = _get_trade_cal()
-        return data
-
-    return _get_trade_cal()
+    print(" 正在下载交易日历...")
+    data = call_api((pro if pro is not None else get_pro()).trade_cal,
+                    retries=retries,
+                    start_date=start_date,
+                    end_date=end_date,
+                    exchange=exchange,
+                    is_open=is_open,
+                    fields="exchange, cal_date, is_open, pretrade_date")
+    print(" 下载交易日历 TRADE_DATE {}-{} 成功 ".format(start_date, end_date))
+    return data
 
 # 找出最近的交易日
 def nearest_date(dates, pivot, direction='backward', date_format='%Y%m%d'):
@@ -100,18 +160,49 @@ def nearest_date(dates, pivot, direction='backward', date_format='%Y%m%d'):
         date_formate 	str 	N 	日期格式，默认20201124
 
     Returns:
-        nearest 	str 	Y 	最近交易日
+        nearest 	str 	Y 	最近交易日, 该方向没有交易日时抛出ValueError
     """
-    dates = pd.to_datetime(dates)
-    pivot = datetime.strptime(pivot, date_format)
-    
-    if(direction=='backward'):
-        dates = dates.where(dates<=pivot).dropna()
-    if(direction=='foreward'):
-        dates = dates.where(dates>=pivot).dropna()
-    
-    nearest = min(dates, key=lambda x: abs(x - pivot))
-    return nearest.strftime(date_format)
+    # 二分查找, 多次查询时直接传入 TradeCalendar, 不必每次重新构建
+    calendar = dates if isinstance(dates, TradeCalendar) else TradeCalendar(dates)
+    nearest = calendar.nearest(datetime.strptime(pivot, date_format).strftime('%Y%m%d'), direction=direction)
+    if nearest is None:
+        raise ValueError('交易日历中没有 %s 的 %s 方向的交易日' % (pivot, direction))
+    return datetime.strptime(nearest, '%Y%m%d').strftime(date_format)
+
+# 获取交易日历, 优先使用本地的 trade_calendar.csv, 只下载本地未覆盖的日期并写回
+def get_trade_calendar(fp=None, start_date=None, end_date=None, exchange='SSE', pro=None, retries=5):
+    """
+    Arguments:
+        fp 	str 	N 	本地存储目录, 为空则全部下载
+        start_date 	str 	N 	需要覆盖的开始日期
+        end_date 	str 	N 	需要覆盖的结束日期
+        exchange 	str 	N 	交易所
+        pro 	object 	N 	Tushare接口, 默认 get_pro()
+        retries 	int 	N 	失败后的最大重试次数
+
+    Returns:
+        calendar 	TradeCalendar 	Y 	交易日历
+    """
+    calendar = TradeCalendar.from_local(fp) if fp else None
+    if calendar is None or calendar.start is None:
+        missing = [(start_date, end_date)] if start_date and end_date else []
+        calendar = TradeCalendar([])
+    else:
+        day = lambda date, n: (datetime.strptime(date, '%Y%m%d') + timedelta(days=n)).strftime('%Y%m%d')
+        missing = []
+        if start_date and start_date < calendar.start:
+            missing.append((start_date, day(calendar.start, -1)))
+        if end_date and end_date > calendar.end:
+            missing.append((day(calendar.end, 1), end_date))
+
+    for start, end in missing:
+        # 同时下载休市日, 记录已覆盖的区间
+        trade_cal = get_trade_cal(exchange=exchange, start_date=start, end_date=end, is_open='', pro=pro, retries=retries)
+        calendar = calendar.merge(TradeCalendar.from_frame(trade_cal))
+    if missing and fp:
+        os.makedirs(fp, exist_ok=True)
+        calendar.save(fp, exchange=exchange)
+    return calendar
 
 # 获取指数行情
 def get_indexes(index_codes=[], trade_date=datetime.today().strftime('%Y%m%d')):
@@ -140,192 +231,618 @@ def get_stock_data(code, start_date, end_date, adj='qfq'):
 
     return data
 
-# 获取整个市场每日行情
-def get_daily(start_date='20180101', end_date='20211231', exchange='SSE', fp=None, combined=True, adjusted=True):
-    trade_cal = get_trade_cal(start_date=start_date, end_date=end_date)
-    trade_cal.sort_values(by='cal_date', ascending=True, inplace=True)
-    start_date = nearest_date(trade_cal['cal_date'], start_date, direction='foreward')
-    end_date = nearest_date(trade_cal['cal_date'], end_date, direction='backward')
+# 逐日下载整个市场行情
+def iter_daily(start_date='20180101', end_date='20211231', exchange='SSE', fp=None, pro=None, workers=1, rate=None, retries=5, backoff=1.0):
+    """
+    逐个交易日下载行情, 每次返回一个交易日的数据, 调用方无需把整个市场保存在内存中
+    请求与 sync_daily 相同: 经过 fetch_daily 和 call_api, 共用限速器, 失败后按指数退避重试
+
+    Arguments:
+        start_date 	str 	N 	开始日期
+        end_date 	str 	N 	结束日期
+        fp 	str 	N 	本地存储目录, 为空则不存储
+        pro 	object 	N 	Tushare接口, 默认 get_pro(), 测试时可传入本地假接口
+        workers 	int 	N 	同时下载的交易日数, 每个交易日的三个请求并行发出
+        rate 	int 	N 	每分钟最多请求次数, 默认不限速
+        retries 	int 	N 	每个请求失败后的最大重试次数, 用完后抛出最后一次的异常
+        backoff 	float 	N 	首次重试的等待秒数, 之后每次加倍
 
-    trade_dates = trade_cal.query(f'cal_date>="{start_date}" and cal_date<="{end_date}" and is_open==1')
-    trade_dates = trade_dates['cal_date']
+    Returns:
+        (trade_date, data, adj_factor, basic) 	tuple 	Y 	交易日, 每日行情, 除权系数, 每日基本面, 按交易日顺序返回
+    """
+    pro = pro if pro is not None else get_pro()
+    trade_dates = get_trade_calendar(fp=fp, start_date=start_date, end_date=end_date, exchange=exchange, pro=pro, retries=retries).range(start_date, end_date)
 
     print('正在下载每日行情数据...')
-    pro = get_pro()
-    datas = pd.DataFrame()
-    adj_factors = pd.DataFrame()
-    basics = pd.DataFrame()
+    limiter = RateLimiter(rate) if rate else None
     i = 0
     l = len(trade_dates)
-    for trade_date in trade_dates:
-        # 获取每日行情
-        data = pro.daily(trade_date=trade_date)
-        if fp: # 存储到本地
-            fname1 = os.path.join(fp,trade_date+'.csv')
-            if not os.path.exists(fname1): 
-                data.to_csv(fname1)
-        datas = pd.concat([datas, data])
-        
-        # 获取除权系数
-        adj_factor = pro.adj_factor(trade_date=trade_date)
-        if fp: # 存储到本地
-            fname2 = os.path.join(fp,'adj_factor_'+trade_date+'.csv')
-            if not os.path.exists(fname2): 
-                adj_factor.to_csv(fname2)
-        adj_factors = pd.concat([adj_factors, adj_factor])
-
-        # 获取股票基本面信息
-        basic = pro.daily_basic(trade_date=trade_date)
-        if fp: # 存储到本地
-            fname3 = os.path.join(fp,'basic_'+trade_date+'.csv')
-            if not os.path.exists(fname3): 
-                basic.to_csv(fname3)
-        basics = pd.concat([basics, basic])
-
-        i += 1
-        progress_bar(i, l, prefix='Progress:', suffix='Complete', barLength=50)
+    # 最多提前提交 2*workers 个交易日, 按提交顺序取结果, 调用方处理较慢时不会堆积整个市场的数据
+    with ThreadPoolExecutor(max_workers=3*workers) as request_pool, ThreadPoolExecutor(max_workers=workers) as day_pool:
+        pending = deque()
+        for trade_date in trade_dates:
+            pending.append((trade_date, day_pool.submit(fetch_daily, pro, trade_date, request_pool, limiter, retries, backoff)))
+            if len(pending) < 2 * workers:
+                continue
+            yield _store_daily(fp, *pending.popleft())
+            i += 1
+            progress_bar(i, l, prefix='Progress:', suffix='Complete', barLength=50)
+        while pending:
+            yield _store_daily(fp, *pending.popleft())
+            i += 1
+            progress_bar(i, l, prefix='Progress:', suffix='Complete', barLength=50)
 
     print('下载完毕')
 
-    datas = datas[['ts_code', 'trade_date', 'open', 'high', 'low', 'close', 'vol']]
-    datas.columns = ['code', 'datetime', 'open', 'high', 'low', 'close', 'volume']
-    # datas['datetime'] = pd.to_datetime(datas['datetime'])
-    datas.sort_values(by='datetime', ascending=True, inplace=True)
-    datas.set_index(['code', 'datetime'], inplace=True)
-    datas['openinterest'] = 0.0
-    datas = datas.dropna().fillna(0)
-
-    if adjusted: # 计算复权数据
-        adj_factors = adj_factors[['ts_code', 'trade_date', 'adj_factor']]
-        adj_factors.columns = ['code', 'datetime', 'adj_factor']
-        adj_factors.sort_values(by='datetime', ascending=True, inplace=True)
-        adj_factors.set_index(['code', 'datetime'], inplace=True)
-        last_adj_factor = adj_factors.groupby('code')['adj_factor'].last()
-        adj_factors['adj_factor'] = adj_factors['adj_factor'] / last_adj_factor
-
-        datas['open'] = datas['open'] * adj_factors['adj_factor']
-        datas['high'] = datas['high'] * adj_factors['adj_factor']
-        datas['low'] = datas['low'] * adj_factors['adj_factor']
-        datas['close'] = datas['close'] * adj_factors['adj_factor']
-        datas = datas.dropna().fillna(0)
+# 取出一个交易日的下载结果, 设置 fp 时写入本地, 已存在的文件不覆盖
+def _store_daily(fp, trade_date, future):
+    data, adj_factor, basic = future.result()
+    if fp: # 存储到本地
+        for df, prefix in ((data, ''), (adj_factor, 'adj_factor_'), (basic, 'basic_')):
+            fname = os.path.join(fp, prefix+trade_date+'.csv')
+            if not os.path.exists(fname):
+                _write_csv(df, fname)
+    return trade_date, data, adj_factor, basic
 
-    datas.reset_index(inplace=True)
+# 获取整个市场每日行情
+def get_daily(start_date='20180101', end_date='20211231', exchange='SSE', fp=None, combined=True, adjusted=True,
+              pro=None, workers=1, rate=None, retries=5, backoff=1.0):
+    pro = pro if pro is not None else get_pro()
+    # 先收集每日数据, 最后只合并一次
+    datas = []
+    adj_factors = []
+    for trade_date, data, adj_factor, basic in iter_daily(start_date=start_date, end_date=end_date, exchange=exchange, fp=fp,
+                                                          pro=pro, workers=workers, rate=rate, retries=retries, backoff=backoff):
+        datas.append(data)
+        adj_factors.append(adj_factor)
+
+    datas = _format_daily(pd.concat(datas), pd.concat(adj_factors), adjusted=adjusted)
     if combined: # 合并股票基本信息
         # 获得股票基本信息
-        stock_basic = pro.stock_basic()
+        stock_basic = call_api(pro.stock_basic, retries=retries, backoff=backoff)
         datas = pd.merge(datas, stock_basic, left_on=['code'], right_on=['ts_code'], how='left')
 
     return datas
 
-# 从本地获取行情
-def get_daily_from_local(start_date='20180101', end_date='20211231', exchange='SSE', fp=None, combined=True, adjusted=True):
-    # 读取交易日历
-    if fp: # 本地文件
-        fname = os.path.join(fp,'trade_calendar.csv')
-        if not os.path.exists(fname):
-            print('文件不存在：%s' % fname) 
+# 读取本地下载清单
+def load_manifest(fp):
+    """
+    读取 fp 目录下的下载清单 manifest.json, 记录已完整下载的交易日
+    清单不存在时, 以目录中三个文件齐全的交易日初始化, 下载时间取文件修改时间
+
+    Returns:
+        manifest 	dict 	Y 	{trade_date: {'fetched_at': '%Y%m%d %H:%M:%S', 'rows': int}}
+    """
+    fname = os.path.join(fp, 'manifest.json')
+    if os.path.exists(fname):
+        with open(fname, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    manifest = {}
+    for f in os.listdir(fp):
+        trade_date = f[:8]
+        if not (len(f) == 12 and trade_date.isdigit() and f.endswith('.csv')):
+            continue
+        fnames = [os.path.join(fp, prefix+trade_date+'.csv') for prefix in ('', 'adj_factor_', 'basic_')]
+        if all(os.path.exists(fname) for fname in fnames):
+            mtime = min(os.path.getmtime(fname) for fname in fnames)
+            manifest[trade_date] = dict(fetched_at=datetime.fromtimestamp(mtime).strftime('%Y%m%d %H:%M:%S'), rows=None)
+    return manifest
+
+# 保存本地下载清单, 先写临时文件再替换, 中途崩溃不会损坏清单
+def save_manifest(fp, manifest):
+    fname = os.path.join(fp, 'manifest.json')
+    with open(fname+'.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(fname+'.tmp', fname)
+
+# 判断已下载的交易日是否过期: 收盘数据发布前下载的数据需要重新下载
+def is_stale(trade_date, entry, publish_hour=18):
+    fetched_at = datetime.strptime(entry['fetched_at'], '%Y%m%d %H:%M:%S')
+    return fetched_at < datetime.strptime(trade_date, '%Y%m%d') + timedelta(hours=publish_hour)
+
+# 原子写入CSV文件
+def _write_csv(df, fname):
+    df.to_csv(fname+'.tmp')
+    os.replace(fname+'.tmp', fname)
+
+# 增量同步整个市场每日行情
+def sync_daily(start_date='20180101', end_date=datetime.today().strftime('%Y%m%d'), exchange='SSE', fp=None, pro=None, publish_hour=18,
+               workers=1, rate=None, retries=5, backoff=1.0):
+    """
+    增量下载每日行情到本地, 只下载清单中缺失或过期的交易日
+    每个交易日的三个文件全部写入后才记入清单, 中断后重新运行会从未完成的交易日继续
+
+    Arguments:
+        start_date 	str 	N 	开始日期
+        end_date 	str 	N 	结束日期, 默认今天
+        fp 	str 	Y 	本地存储目录
+        pro 	object 	N 	Tushare接口, 默认 get_pro(), 测试时可传入本地假接口
+        publish_hour 	int 	N 	当日数据的发布时间, 在此之前下载的数据视为过期
+        workers 	int 	N 	同时下载的交易日数, 每个交易日的三个请求并行发出
+        rate 	int 	N 	每分钟最多请求次数, 默认不限速
+        retries 	int 	N 	每个请求失败后的最大重试次数
+        backoff 	float 	N 	首次重试的等待秒数, 之后每次加倍
+
+    Returns:
+        synced 	list 	Y 	本次下载的交易日
+    """
+    pro = pro if pro is not None else get_pro()
+    os.makedirs(fp, exist_ok=True)
+    manifest = load_manifest(fp)
+
+    # 交易日历同时写入本地, 只下载本地未覆盖的日期
+    trade_dates = list(get_trade_calendar(fp=fp, start_date=start_date, end_date=end_date, exchange=exchange, pro=pro, retries=retries).range(start_date, end_date))
+    pending = [d for d in trade_dates if d not in manifest or is_stale(d, manifest[d], publish_hour)]
+
+    print('正在同步每日行情数据, 共%d个交易日, 需要下载%d个...' % (len(trade_dates), len(pending)))
+    synced = []
+    failed = []
+    limiter = RateLimiter(rate) if rate else None
+    l = len(pending)
+    # 请求线程池供每个交易日的三个请求使用, 交易日线程池控制同时下载的交易日数
+    with ThreadPoolExecutor(max_workers=3*workers) as request_pool, ThreadPoolExecutor(max_workers=workers) as day_pool:
+        futures = {day_pool.submit(fetch_daily, pro, trade_date, request_pool, limiter, retries, backoff): trade_date for trade_date in pending}
+        for i, future in enumerate(as_completed(futures)):
+            trade_date = futures[future]
+            try:
+                data, adj_factor, basic = future.result()
+            except Exception as e: # 重试次数用完, 留待下次同步
+                print('\n下载交易日 %s 失败: %s' % (trade_date, e))
+                failed.append(trade_date)
+                continue
+
+            _write_csv(data, os.path.join(fp, trade_date+'.csv'))
+            _write_csv(adj_factor, os.path.join(fp, 'adj_factor_'+trade_date+'.csv'))
+            _write_csv(basic, os.path.join(fp, 'basic_'+trade_date+'.csv'))
+
+            # 数据为空说明尚未发布, 不记入清单, 下次同步时重新下载
+            if len(data) > 0 and len(adj_factor) > 0 and len(basic) > 0:
+                manifest[trade_date] = dict(fetched_at=datetime.now().strftime('%Y%m%d %H:%M:%S'), rows=len(data))
+                save_manifest(fp, manifest)
+                synced.append(trade_date)
+
+            progress_bar(i+1, l, prefix='Progress:', suffix='Complete', barLength=50)
+
+    if failed:
+        print('以下交易日下载失败, 请重新同步: %s' % ', '.join(sorted(failed)))
+
+    # 同时更新股票基本信息
+    _write_csv(call_api(pro.stock_basic, limiter, retries, backoff), os.path.join(fp, 'stock_basic.csv'))
+    # 更名历史用于按日期判断ST
+    _write_csv(call_api(pro.namechange, limiter, retries, backoff, fields='ts_code,name,start_date,end_date,ann_date,change_reason'),
+               os.path.join(fp, 'namechange.csv'))
+    print('同步完毕')
+
+    return sorted(synced)
+
+# 读取本地交易日历中的交易日
+def get_trade_dates_from_local(start_date='20180101', end_date='20211231', fp=None):
+    # 每个进程只读取一次日历文件
+    calendar = TradeCalendar.from_local(fp)
+    if calendar is None:
+        print('文件不存在：%s' % os.path.join(fp,'trade_calendar.csv'))
+        return pd.Series([], dtype='str')
+
+    return pd.Series(calendar.range(start_date, end_date), dtype='str', name='cal_date')
+
+# 读取本地单个交易日的行情文件, 文件不存在时返回None
+def read_daily_from_local(trade_date, fp, basic=True):
+    frames = []
+    for fname in (os.path.join(fp,trade_date+'.csv'),
+                  os.path.join(fp,'adj_factor_'+trade_date+'.csv'),
+                  os.path.join(fp,'basic_'+trade_date+'.csv')):
+        if not basic and fname.endswith('basic_'+trade_date+'.csv'):
+            frames.append(None)
+        elif not os.path.exists(fname):
+            print('文件不存在：%s' % fname)
+            frames.append(None)
         else:
-            trade_cal = pd.read_csv(fname, dtype={'cal_date':'str'})
-    
-    trade_cal.sort_values(by='cal_date', ascending=True, inplace=True)
-    # start_date = nearest_date(trade_cal['cal_date'], start_date, direction='foreward')
-    # end_date = nearest_date(trade_cal['cal_date'], end_date, direction='backward')
-    # trade_cal['cal_date'] = pd.to_datetime(trade_cal['cal_date'], format="%Y%m%d")
-    trade_dates = trade_cal.query(f'cal_date>="{start_date}" and cal_date<="{end_date}" and is_open==1')
-    trade_dates = trade_dates['cal_date']
+            frames.append(pd.read_csv(fname, dtype={'trade_date':'str'}))
+    return tuple(frames)
 
-    print('正在从本地加载每日行情数据...')
+# 逐日从本地读取行情
+def iter_daily_from_local(start_date='20180101', end_date='20211231', exchange='SSE', fp=None, basic=True, workers=None):
+    """
+    逐个交易日从本地读取行情, 每次返回一个交易日的数据, 调用方无需把整个市场保存在内存中
+
+    Arguments:
+        start_date 	str 	N 	开始日期
+        end_date 	str 	N 	结束日期
+        fp 	str 	Y 	本地存储目录
+        basic 	bool 	N 	是否读取每日基本面文件
+        workers 	int 	N 	并行读取的进程数, 结果仍按交易日顺序返回, 默认单进程
+
+    Returns:
+        (trade_date, data, adj_factor, basic) 	tuple 	Y 	交易日, 每日行情, 除权系数, 每日基本面, 文件缺失时对应项为None
+    """
+    trade_dates = get_trade_dates_from_local(start_date=start_date, end_date=end_date, fp=fp)
 
-    datas = pd.DataFrame()
-    adj_factors = pd.DataFrame()
-    basics = pd.DataFrame()
+    print('正在从本地加载每日行情数据...')
     i = 0
     l = len(trade_dates)
-    for trade_date in trade_dates:
-        # trade_date = trade_date.strftime("%Y%m%d")
-        # 获取每日行情
-        if fp: # 本地文件
-            fname1 = os.path.join(fp,trade_date+'.csv')
-            if not os.path.exists(fname1):
-                print('文件不存在：%s' % fname1) 
-            else:
-                data = pd.read_csv(fname1, dtype={'trade_date':'str'})
-        datas = pd.concat([datas, data])
-        
-        # 获取除权系数
+    if workers and workers > 1: # 多进程读取, map按提交顺序返回结果
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, l // (workers * 4))
+            results = executor.map(read_daily_from_local, trade_dates, repeat(fp), repeat(basic), chunksize=chunksize)
+            for trade_date, (data, adj_factor, basic_) in zip(trade_dates, results):
+                yield trade_date, data, adj_factor, basic_
+
+                i += 1
+                progress_bar(i, l, prefix='Progress:', suffix='Complete', barLength=50)
+    else:
+        for trade_date in trade_dates:
+            data, adj_factor, basic_ = read_daily_from_local(trade_date, fp, basic=basic)
+            yield trade_date, data, adj_factor, basic_
+
+            i += 1
+            progress_bar(i, l, prefix='Progress:', suffix='Complete', barLength=50)
+
+    print('加载完毕')
+
+# 从本地获取行情, 设置 adjust_fp 时前复权价格由 adjust.AdjustEngine 计算并按截止日期缓存
+def get_daily_from_local(start_date='20180101', end_date='20211231', exchange='SSE', fp=None, combined=True, adjusted=True, workers=None, compact=False, adjust_fp=None):
+    if adjusted and adjust_fp:
+        datas = _adjusted_frame(MarketPanel.from_adjusted(get_adjusted_from_local(start_date=start_date, end_date=end_date, fp=fp, adjust_fp=adjust_fp, workers=workers)))
+    else:
+        datas, adj_factors = _read_daily_frames(start_date=start_date, end_date=end_date, fp=fp, workers=workers)
+        datas = _format_daily(datas, adj_factors if adjusted else None, adjusted=adjusted)
+    if combined: # 合并股票基本信息
+        # 获得股票基本信息
+        # stock_basic = pro.stock_basic()
         if fp: # 本地文件
-            fname2 = os.path.join(fp,'adj_factor_'+trade_date+'.csv')
-            if not os.path.exists(fname2): 
-                print('文件不存在：%s' % fname2) 
+            fname4 = os.path.join(fp,'stock_basic.csv')
+            if not os.path.exists(fname4): 
+                print('文件不存在：%s' % fname4) 
             else:
-                adj_factor = pd.read_csv(fname2, dtype={'trade_date':'str'})
-        adj_factors = pd.concat([adj_factors, adj_factor])
+                stock_basic = pd.read_csv(fname4, dtype={'list_date':'str'})
+        if compact: # 股票基本信息作为按代码关联的附表
+            return compact_frame(datas, stock_basic)
+        datas = pd.merge(datas, stock_basic, left_on=['code'], right_on=['ts_code'], how='left')
 
-        # 获取每日股票基本面信息
-        if fp: # 本地文件
-            fname3 = os.path.join(fp,'basic_'+trade_date+'.csv')
-            if not os.path.exists(fname3): 
-                print('文件不存在：%s' % fname3)
-            else: 
-                basic = pd.read_csv(fname3, dtype={'trade_date':'str'})
-        basics = pd.concat([basics, basic])
+    return compact_frame(datas) if compact else datas
+
+# 读取本地的每日行情和除权系数, 先收集每日数据, 最后只合并一次; 行情本身不需要每日基本面文件
+def _read_daily_frames(start_date, end_date, fp, workers=None):
+    datas = []
+    adj_factors = []
+    for trade_date, data, adj_factor, basic in iter_daily_from_local(start_date=start_date, end_date=end_date, fp=fp, basic=False, workers=workers):
+        if data is not None:
+            datas.append(data)
+        if adj_factor is not None:
+            adj_factors.append(adj_factor)
+    if not datas or not adj_factors:
+        return None, None
+    return pd.concat(datas), pd.concat(adj_factors)
+
+# 获取复权结果
+def get_adjusted_from_local(start_date='20180101', end_date='20211231', fp=None, adjust_fp=None, workers=None):
+    """
+    用 adjust.AdjustEngine 计算复权价格, 设置 adjust_fp 时按截止日期缓存:
+        * 缓存来自同一个 fp 且覆盖整个区间: 直接使用, 不再读取CSV
+        * 缓存之后有新的交易日: 只读取新增的交易日, 增量更新, 只重算最新除权系数变化的股票
+        * 没有可用的缓存(来源不同或开始日期晚于 start_date): 全量计算
+
+    Arguments:
+        start_date 	str 	N 	开始日期
+        end_date 	str 	N 	结束日期
+        fp 	str 	Y 	本地存储目录
+        adjust_fp 	str 	N 	复权结果缓存目录
+        workers 	int 	N 	读取CSV时并行的进程数
+
+    Returns:
+        adjusted 	dict 	Y 	AdjustEngine.window 截取的区间结果, 前复权以区间内最新的除权系数为基准; 区间内没有本地行情时抛出ValueError
+    """
+    # 区间内的最后一个交易日, 判断缓存之后是否有新的交易日
+    calendar = TradeCalendar.from_local(fp)
+    last = calendar.prev(end_date) if calendar is not None else end_date
+
+    engine = adjust.AdjustEngine(cache_fp=adjust_fp, source=fp)
+    base = engine.latest()
+    if base is not None and base['start_date'] <= start_date:
+        panel = base
+        if last is not None and base['dates'][-1] < last:
+            next_date = (datetime.strptime(base['dates'][-1], '%Y%m%d') + timedelta(days=1)).strftime('%Y%m%d')
+            datas, adj_factors = _read_daily_frames(start_date=next_date, end_date=end_date, fp=fp, workers=workers)
+            if datas is not None:
+                panel = engine.update(datas, adj_factors)
+    else:
+        datas, adj_factors = _read_daily_frames(start_date=start_date, end_date=end_date, fp=fp, workers=workers)
+        if datas is None:
+            raise ValueError('%s 中没有 %s - %s 的行情和除权系数' % (fp, start_date, end_date))
+        panel = engine.adjust(datas, adj_factors, start_date=start_date)
+    return adjust.AdjustEngine.window(panel, start_date, end_date)
+
+# 面板转为与 _format_daily 相同列的长表, 按日期排序
+def _adjusted_frame(panel):
+    date_idx, code_idx = np.nonzero(~np.isnan(panel.values).any(axis=2).T)
+    datas = pd.DataFrame({'code': panel.codes[code_idx], 'datetime': panel.dates[date_idx].astype('str')})
+    for field in panel.fields:
+        datas[field] = panel.values[code_idx, date_idx, panel.field_loc(field)]
+    datas['openinterest'] = 0.0
+    return datas
+
+# 压缩行情表的内存占用
+def compact_frame(datas, stock_basic=None):
+    """
+    代码和股票基本信息转为分类类型, 日期转为int32(如20211231), 价格和成交量转为float32
+    股票基本信息保存在 attrs['stock_basic'] 附表中, 每行只保存分类编码, 不重复保存字符串
+
+    Arguments:
+        datas 	DataFrame 	Y 	_format_daily整理后的行情
+        stock_basic 	DataFrame 	N 	股票基本信息, 以ts_code关联
+
+    Returns:
+        datas 	DataFrame 	Y 	压缩后的行情
+    """
+    compacted = pd.DataFrame({
+        'code': pd.Categorical(datas['code']),
+        'datetime': datas['datetime'].astype('int32').to_numpy(),
+    })
+    for col in ('open', 'high', 'low', 'close', 'volume', 'openinterest'):
+        compacted[col] = datas[col].to_numpy(dtype='float32')
+
+    if stock_basic is not None:
+        stock_basic = stock_basic.drop(columns=[c for c in stock_basic.columns if c.startswith('Unnamed')])
+        stock_basic = stock_basic.drop_duplicates('ts_code').set_index('ts_code', drop=False)
+        # 每个代码分类对应附表中的行, 找不到时为-1
+        rows = stock_basic.index.get_indexer(compacted['code'].cat.categories)
+        codes = compacted['code'].cat.codes.to_numpy()
+        for col in stock_basic.columns:
+            attr = pd.Categorical(stock_basic[col])
+            attr_codes = np.append(attr.codes, -1)[rows]
+            compacted[col] = pd.Categorical.from_codes(attr_codes[codes], categories=attr.categories)
+        compacted.attrs['stock_basic'] = stock_basic.reset_index(drop=True)
+
+    return compacted
+
+# 在分类的取值上计算条件, 再按编码映射到每一行; 非分类类型直接计算
+def _category_mask(series, func):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = pd.Series(series.cat.categories)
+        mask = np.append(func(categories).to_numpy(dtype='bool'), False)
+        return pd.Series(mask[series.cat.codes.to_numpy()], index=series.index)
+    return func(series)
+
+# 获取稠密行情面板
+def get_panel_from_local(start_date='20180101', end_date='20211231', fp=None, cache_fp=None, workers=None, adjust_fp=None):
+    """
+    从本地加载前复权行情并构建 MarketPanel, 复权由 adjust.AdjustEngine 计算
+    设置 cache_fp 时, 面板保存为内存映射文件, 之后的调用(包括其他进程)直接只读映射, 不再解析CSV
+    本地行情更新后需要删除对应的缓存目录; 设置 adjust_fp 时重建面板只需增量复权新增的交易日
+
+    Arguments:
+        start_date 	str 	N 	开始日期
+        end_date 	str 	N 	结束日期
+        fp 	str 	Y 	本地存储目录
+        cache_fp 	str 	N 	面板缓存目录
+        workers 	int 	N 	首次加载时并行读取的进程数
+        adjust_fp 	str 	N 	复权结果缓存目录
+
+    Returns:
+        panel 	MarketPanel 	Y 	行情面板
+    """
+    path = os.path.join(cache_fp, 'panel_%s_%s' % (start_date, end_date)) if cache_fp else None
+    if path and os.path.exists(path):
+        return MarketPanel.load(path)
+
+    panel = MarketPanel.from_adjusted(get_adjusted_from_local(start_date=start_date, end_date=end_date, fp=fp, adjust_fp=adjust_fp, workers=workers))
+    if path:
+        os.makedirs(cache_fp, exist_ok=True)
+        panel.save(path)
+        panel = MarketPanel.load(path)
+    return panel
+
+# 获取复权对数价格矩阵
+def get_log_prices_from_local(start_date='20180101', end_date='20211231', fp=None, cache_fp=None, workers=None):
+    """
+    从本地加载收盘价和除权系数, 构建 代码×交易日 的后复权对数价格矩阵
+    设置 cache_fp 时矩阵保存为npz文件, 之后的调用直接读取; 本地行情更新后需要删除对应的缓存文件
+
+    Arguments:
+        start_date 	str 	N 	开始日期
+        end_date 	str 	N 	结束日期
+        fp 	str 	Y 	本地存储目录
+        cache_fp 	str 	N 	矩阵缓存目录
+        workers 	int 	N 	首次加载时并行读取的进程数
+
+    Returns:
+        prices 	LogPrices 	Y 	对数价格矩阵
+    """
+    fname = os.path.join(cache_fp, 'log_prices_%s_%s.npz' % (start_date, end_date)) if cache_fp else None
+    if fname and os.path.exists(fname):
+        return LogPrices.load(fname)
+
+    datas = []
+    adj_factors = []
+    for trade_date, data, adj_factor, basic in iter_daily_from_local(start_date=start_date, end_date=end_date, fp=fp, basic=False, workers=workers):
+        # 与 calc_growth_from_local 一致, 行情和除权系数都存在的交易日才计入
+        if data is not None and adj_factor is not None:
+            datas.append(data[['ts_code', 'trade_date', 'close']])
+            adj_factors.append(adj_factor[['ts_code', 'trade_date', 'adj_factor']])
+
+    prices = LogPrices.from_frames(pd.concat(datas), pd.concat(adj_factors))
+    if fname:
+        prices.save(fname)
+    return prices
+
+# 获取按日期的股票池
+def get_universe_from_local(start_date='20180101', end_date='20211231', fp=None, cache_fp=None, ipo_days=365):
+    """
+    由本地的交易日历、股票基本信息和更名历史(namechange.csv, 不存在时按当前名称判断ST)构建 Universe
+    设置 cache_fp 时保存为npz文件, 之后的调用直接读取; 本地数据更新后需要删除对应的缓存文件
+
+    Arguments:
+        start_date 	str 	N 	开始日期
+        end_date 	str 	N 	结束日期
+        fp 	str 	Y 	本地存储目录
+        cache_fp 	str 	N 	股票池缓存目录
+        ipo_days 	int 	N 	上市超过的自然日数
+
+    Returns:
+        universe 	Universe 	Y 	股票池
+    """
+    fname = os.path.join(cache_fp, 'universe_%s_%s_%d.npz' % (start_date, end_date, ipo_days)) if cache_fp else None
+    if fname and os.path.exists(fname):
+        return Universe.load(fname)
+
+    trade_dates = get_trade_dates_from_local(start_date=start_date, end_date=end_date, fp=fp)
+    stock_basic = pd.read_csv(os.path.join(fp, 'stock_basic.csv'), dtype={'list_date':'str'})
+    namechange_fname = os.path.join(fp, 'namechange.csv')
+    namechange = pd.read_csv(namechange_fname, dtype={'start_date':'str', 'end_date':'str'}) if os.path.exists(namechange_fname) else None
+
+    universe = Universe.build(stock_basic, trade_dates, namechange=namechange, ipo_days=ipo_days)
+    if fname:
+        universe.save(fname)
+    return universe
+
+# 列式存储中各类数据的字段类型
+STORE_SCHEMAS = dict(
+    daily=dict(ts_code='str', trade_date='str', open='float64', high='float64', low='float64', close='float64',
+               pre_close='float64', change='float64', pct_chg='float64', vol='float64', amount='float64'),
+    adj_factor=dict(ts_code='str', trade_date='str', adj_factor='float64'),
+    basic=dict(ts_code='str', trade_date='str', close='float64', turnover_rate='float64', turnover_rate_f='float64',
+               volume_ratio='float64', pe='float64', pe_ttm='float64', pb='float64', ps='float64', ps_ttm='float64',
+               dv_ratio='float64', dv_ttm='float64', total_share='float64', float_share='float64', free_share='float64',
+               total_mv='float64', circ_mv='float64'),
+)
+
+# 每类数据对应的本地CSV文件名前缀
+STORE_PREFIXES = dict(daily='', adj_factor='adj_factor_', basic='basic_')
+
+# 将每日CSV文件压缩为按年/月分区的Parquet列式存储
+def compact_daily(fp, store_fp, start_date=None, end_date=None):
+    """
+    将 fp 目录下的每日CSV文件({date}.csv, adj_factor_{date}.csv, basic_{date}.csv)
+    按年/月分区转存为Parquet文件, 每个分区每类数据一个文件, 重复执行会覆盖对应月份
+
+    Arguments:
+        fp 	str 	Y 	每日CSV文件目录
+        store_fp 	str 	Y 	列式存储目录
+        start_date 	str 	N 	开始日期, 默认全部
+        end_date 	str 	N 	结束日期, 默认全部
+
+    Returns:
+        months 	list 	Y 	已写入的月份列表, 如 ['202101', '202102']
+    """
+    trade_dates = sorted(f[:8] for f in os.listdir(fp) if len(f) == 12 and f[:8].isdigit() and f.endswith('.csv'))
+    if start_date:
+        trade_dates = [d for d in trade_dates if d >= start_date]
+    if end_date:
+        trade_dates = [d for d in trade_dates if d <= end_date]
+
+    months = {}
+    for trade_date in trade_dates:
+        months.setdefault(trade_date[:6], []).append(trade_date)
+
+    print('正在压缩每日行情数据...')
+    i = 0
+    l = len(months)
+    for month, dates in months.items():
+        for kind, schema in STORE_SCHEMAS.items():
+            frames = []
+            for trade_date in dates:
+                fname = os.path.join(fp, STORE_PREFIXES[kind]+trade_date+'.csv')
+                if not os.path.exists(fname):
+                    print('文件不存在：%s' % fname)
+                    continue
+                frames.append(pd.read_csv(fname, dtype={'ts_code':'str', 'trade_date':'str'}))
+            if not frames:
+                continue
+            df = pd.concat(frames, ignore_index=True)
+            # 去掉to_csv写入的索引列, 缺失的字段补空值
+            df = df.reindex(columns=list(schema.keys())).astype(schema)
+
+            part_fp = os.path.join(store_fp, kind, 'year=%d' % int(month[:4]), 'month=%d' % int(month[4:]))
+            os.makedirs(part_fp, exist_ok=True)
+            df.to_parquet(os.path.join(part_fp, 'part-0.parquet'), index=False)
 
         i += 1
         progress_bar(i, l, prefix='Progress:', suffix='Complete', barLength=50)
 
+    fname = os.path.join(fp, 'stock_basic.csv')
+    if os.path.exists(fname):
+        stock_basic = pd.read_csv(fname, dtype={'list_date':'str'})
+        stock_basic = stock_basic.drop(columns=[c for c in stock_basic.columns if c.startswith('Unnamed')])
+        stock_basic.to_parquet(os.path.join(store_fp, 'stock_basic.parquet'), index=False)
+
+    print('压缩完毕')
+    return list(months.keys())
+
+# 从列式存储读取指定日期范围和字段的数据
+def read_store(store_fp, kind='daily', start_date='20180101', end_date='20211231', columns=None):
+    """
+    读取按年/月分区的Parquet数据, 只扫描日期范围覆盖的分区和需要的字段
+
+    Arguments:
+        store_fp 	str 	Y 	列式存储目录
+        kind 	str 	N 	数据类型 daily, adj_factor, basic
+        start_date 	str 	N 	开始日期
+        end_date 	str 	N 	结束日期
+        columns 	list 	N 	需要的字段, 默认全部
+
+    Returns:
+        data 	DataFrame 	Y 	数据
+    """
+    if columns is not None:
+        columns = list(dict.fromkeys(['ts_code', 'trade_date'] + list(columns)))
+    filters = [('year', '>=', int(start_date[:4])), ('year', '<=', int(end_date[:4])),
+               ('trade_date', '>=', start_date), ('trade_date', '<=', end_date)]
+    data = pd.read_parquet(os.path.join(store_fp, kind), columns=columns, filters=filters)
+    data = data.drop(columns=[c for c in ('year', 'month') if c in data.columns])
+    return data.reset_index(drop=True)
+
+# 从列式存储获取行情
+def get_daily_from_store(start_date='20180101', end_date='20211231', store_fp=None, combined=True, adjusted=True, compact=False):
+    print('正在从列式存储加载每日行情数据...')
+    datas = read_store(store_fp, 'daily', start_date, end_date, columns=['open', 'high', 'low', 'close', 'vol'])
+    adj_factors = read_store(store_fp, 'adj_factor', start_date, end_date, columns=['adj_factor']) if adjusted else None
     print('加载完毕')
 
+    datas = _format_daily(datas, adj_factors, adjusted=adjusted)
+    if combined: # 合并股票基本信息
+        stock_basic = pd.read_parquet(os.path.join(store_fp, 'stock_basic.parquet'))
+        if compact: # 股票基本信息作为按代码关联的附表
+            return compact_frame(datas, stock_basic)
+        datas = pd.merge(datas, stock_basic, left_on=['code'], right_on=['ts_code'], how='left')
+
+    return compact_frame(datas) if compact else datas
+
+# 整理行情数据并计算前复权价格
+def _format_daily(datas, adj_factors=None, adjusted=True):
     datas = datas[['ts_code', 'trade_date', 'open', 'high', 'low', 'close', 'vol']]
     datas.columns = ['code', 'datetime', 'open', 'high', 'low', 'close', 'volume']
     # datas['datetime'] = pd.to_datetime(datas['datetime'])
-    datas.sort_values(by='datetime', ascending=True, inplace=True)
-    datas.set_index(['code', 'datetime'], inplace=True)
+    datas = datas.sort_values(by='datetime', ascending=True)
     datas['openinterest'] = 0.0
     datas = datas.dropna().fillna(0)
 
-    if adjusted: # 计算复权数据
-        adj_factors = adj_factors[['ts_code', 'trade_date', 'adj_factor']]
-        adj_factors.columns = ['code', 'datetime', 'adj_factor']
-        adj_factors.sort_values(by='datetime', ascending=True, inplace=True)
-        adj_factors.set_index(['code', 'datetime'], inplace=True)
-        last_adj_factor = adj_factors.groupby('code')['adj_factor'].last()
-        adj_factors['adj_factor'] = adj_factors['adj_factor'] / last_adj_factor
-
-        datas['open'] = datas['open'] * adj_factors['adj_factor']
-        datas['high'] = datas['high'] * adj_factors['adj_factor']
-        datas['low'] = datas['low'] * adj_factors['adj_factor']
-        datas['close'] = datas['close'] * adj_factors['adj_factor']
+    if adjusted: # 计算复权数据, 按代码×日期的稠密除权系数数组逐行查找, 避免MultiIndex对齐
+        datas = adjust.adjust_frame(datas, adj_factors, how='qfq')
         datas = datas.dropna().fillna(0)
 
-    datas.reset_index(inplace=True)
-    if combined: # 合并股票基本信息
-        # 获得股票基本信息
-        # stock_basic = pro.stock_basic()
-        if fp: # 本地文件
-            fname4 = os.path.join(fp,'stock_basic.csv')
-            if not os.path.exists(fname4): 
-                print('文件不存在：%s' % fname4) 
-            else:
-                stock_basic = pd.read_csv(fname4, dtype={'list_date':'str'})
-        datas = pd.merge(datas, stock_basic, left_on=['code'], right_on=['ts_code'], how='left')
-
+    datas.reset_index(drop=True, inplace=True)
     return datas
 
 # 筛选样本数据
-def filter_stock(dataset=None, method=None, n=None, watchlist=None, ignore_ST=True, ignore_IPO=True, market='主板'):
+# 按当前名称判断ST, 需要按历史日期判断时使用 universe.Universe
+# as_of 为回测中模拟的日期, 上市不满一年以该日期计算, 默认今天
+def filter_stock(dataset=None, method=None, n=None, watchlist=None, ignore_ST=True, ignore_IPO=True, market='主板', as_of=None):
 
     if isinstance(dataset, pd.DataFrame):
         data = dataset.copy()
                                     
+    # 条件在分类取值上计算, 紧凑模式下只需比较几千个分类, 而不是逐行比较
     if(market):
-        data = data[data['market'].str.contains('主板', na=False)]
+        data = data[_category_mask(data['market'], lambda x: x.str.contains('主板', na=False))]
 
     if(ignore_ST):
-        data = data[~data['name'].str.contains('ST', na=False)]
+        data = data[~_category_mask(data['name'], lambda x: x.str.contains('ST', na=False))]
 
     if(ignore_IPO):
-        cutoff_date = (datetime.today()-timedelta(days=365)).strftime('%Y%m%d')
-        data = data[data['list_date'] < cutoff_date]
+        as_of = datetime.strptime(as_of, '%Y%m%d') if as_of else datetime.today()
+        cutoff_date = (as_of-timedelta(days=365)).strftime('%Y%m%d')
+        data = data[_category_mask(data['list_date'], lambda x: x < cutoff_date)]
 
     if(method=='RANDOM'):
         n = n if n else 100
@@ -354,39 +871,43 @@ def filter_stock(dataset=None, method=None, n=None, watchlist=None, ignore_ST=Tr
 
     return data
 
-def calc_growth_from_local(start_date, end_date):
-    trade_cal = pd.read_csv('./data/daily/trade_calendar.csv', dtype={'cal_date':'str'})
-
-    trade_cal.sort_values(by='cal_date', ascending=True, inplace=True)
-    trade_dates = trade_cal.query(f'cal_date>="{start_date}" and cal_date<="{end_date}" and is_open==1')
-    trade_dates = trade_dates['cal_date']
-    start_date = trade_dates.iloc[0]
-    end_date = trade_dates.iloc[-1]
+# 计算区间涨幅, 设置 prices 时直接用对数价格矩阵计算, 不再读取每日CSV
+def calc_growth_from_local(start_date, end_date, prices=None):
+    calendar = TradeCalendar.from_local('./data/daily/')
+    if calendar is None:
+        raise FileNotFoundError('文件不存在：%s' % os.path.join('./data/daily/', 'trade_calendar.csv'))
+    # 区间内没有交易日时抛出IndexError, 与按行筛选日历时相同
+    trade_dates = calendar.range(start_date, end_date)
+    start_date = trade_dates[0]
+    end_date = trade_dates[-1]
 
-    daily1 = pd.read_csv(f'./data/daily/{start_date}.csv', dtype={'trade_date':'str'})
-    daily2 = pd.read_csv(f'./data/daily/{end_date}.csv', dtype={'trade_date':'str'})
+    if prices is not None:
+        growth = prices.growth_frame(start_date, end_date)
+    else:
+        daily1 = pd.read_csv(f'./data/daily/{start_date}.csv', dtype={'trade_date':'str'})
+        daily2 = pd.read_csv(f'./data/daily/{end_date}.csv', dtype={'trade_date':'str'})
 
-    adj_factor1 = pd.read_csv(f'./data/daily/adj_factor_{start_date}.csv', dtype={'trade_date':'str'})
-    adj_factor2 = pd.read_csv(f'./data/daily/adj_factor_{end_date}.csv', dtype={'trade_date':'str'})
+        adj_factor1 = pd.read_csv(f'./data/daily/adj_factor_{start_date}.csv', dtype={'trade_date':'str'})
+        adj_factor2 = pd.read_csv(f'./data/daily/adj_factor_{end_date}.csv', dtype={'trade_date':'str'})
 
-    daily1 = pd.merge(daily1, adj_factor1, on=['ts_code'], how='left')
-    daily2 = pd.merge(daily2, adj_factor2, on=['ts_code'], how='left')
+        daily1 = pd.merge(daily1, adj_factor1, on=['ts_code'], how='left')
+        daily2 = pd.merge(daily2, adj_factor2, on=['ts_code'], how='left')
 
-    daily1['adj_price1'] = daily1['close'] * daily1['adj_factor']
-    daily2['adj_price2'] = daily2['close'] * daily2['adj_factor']
+        daily1['adj_price1'] = daily1['close'] * daily1['adj_factor']
+        daily2['adj_price2'] = daily2['close'] * daily2['adj_factor']
 
-    growth = pd.merge(daily1[['ts_code','adj_price1']], daily2[['ts_code','adj_price2']], on=['ts_code'], how='left', suffixes=('_1','_2'))
+        growth = pd.merge(daily1[['ts_code','adj_price1']], daily2[['ts_code','adj_price2']], on=['ts_code'], how='left', suffixes=('_1','_2'))
 
-    date1 = datetime.strptime(start_date,'%Y%m%d')
-    date2 = datetime.strptime(end_date,'%Y%m%d')
-    delta = (date2 - date1) 
-    delta_years = delta.days / 365.0 
+        date1 = datetime.strptime(start_date,'%Y%m%d')
+        date2 = datetime.strptime(end_date,'%Y%m%d')
+        delta = (date2 - date1) 
+        delta_years = delta.days / 365.0 
 
-    growth['total_growth'] = growth['adj_price2'] / growth['adj_price1']
+        growth['total_growth'] = growth['adj_price2'] / growth['adj_price1']
 
-    growth['annual_growth'] = np.round((np.power(10, np.log10(growth['total_growth']) / delta_years) - 1.0) * 100, 2)
+        growth['annual_growth'] = np.round((np.power(10, np.log10(growth['total_growth']) / delta_years) - 1.0) * 100, 2)
 
-    growth.sort_values(by='annual_growth', ascending=False, inplace=True)
+        growth.sort_values(by='annual_growth', ascending=False, inplace=True)
 
     # 获得股票基本信息
     stock_basic = pd.read_csv(f'./data/daily/stock_basic.csv', dtype={'list_date':'str'})
@@ -408,6 +929,11 @@ def get_args():
     parser.add_argument('--end_date', help='End Date, example:20201231')
     parser.add_argument('--fp', help='File Path Prefix for daily prices')
     parser.add_argument('--from_local', help='Load data from local disk')
+    parser.add_argument('--store', help='File Path of the columnar (Parquet) store')
+    parser.add_argument('--compact', help='Compact daily CSV files under --fp into --store')
+    parser.add_argument('--workers', type=int, help='Number of processes used to read local daily files, or trade dates fetched concurrently with --sync')
+    parser.add_argument('--sync', help='Incrementally download missing or stale trade dates into --fp')
+    parser.add_argument('--rate', type=int, help='Maximum Tushare requests per minute when downloading')
 
     return parser.parse_args()
 
@@ -418,14 +944,22 @@ if __name__ == '__main__':
         stock_data = get_stock_data(code=args.code, start_date=args.start_date, end_date=args.end_date, adj='qfq')
         fname = os.path.join('.','data',args.code.replace('.','_')+'.csv')
         stock_data.to_csv(fname)
+    elif args.sync: # 增量同步整个市场行情
+        sync_daily(start_date=args.start_date, end_date=args.end_date or datetime.today().strftime('%Y%m%d'), fp=args.fp,
+                   workers=args.workers or 1, rate=args.rate)
+    elif args.compact: # 压缩为列式存储
+        compact_daily(fp=args.fp, store_fp=args.store, start_date=args.start_date, end_date=args.end_date)
+    elif args.store: # 从列式存储加载
+        data = get_daily_from_store(start_date=args.start_date, end_date=args.end_date, store_fp=args.store)
+        print(data)
     else: # 整体市场行情
         if not args.from_local:
-            data = get_daily(start_date=args.start_date, end_date=args.end_date, fp=args.fp)
+            data = get_daily(start_date=args.start_date, end_date=args.end_date, fp=args.fp, workers=args.workers or 1, rate=args.rate)
             print(data)
             fname = os.path.join('.','data',args.start_date+'_'+args.end_date+'.csv')
             data.to_csv(fname)
         else:
-            data = get_daily_from_local(start_date=args.start_date, end_date=args.end_date, fp=args.fp)
+            data = get_daily_from_local(start_date=args.start_date, end_date=args.end_date, fp=args.fp, workers=args.workers)
             print(data)
             fname = os.path.join('.','data',args.start_date+'_'+args.end_date+'.csv')
             data.to_csv(fname)
@@ -2,6 +2,7 @@ import backtrader as bt
 from datetime import datetime
 import os
 import math
+import precomputed
 
 
 class AllInOut(bt.Sizer):
@@ -41,11 +42,17 @@ class DMIStrat(bt.Strategy):
                 trail_percent=0.05,
                 revert=True,
                 trend=True,
+                precomputed=False,
                 )
 
     def __init__(self):
-        self.dmi = bt.indicators.DMI(period=self.p.period)
-        self.plusDI_crossover_minusDI = bt.indicators.CrossOver(self.dmi.plusDI, self.dmi.minusDI)
+        if self.p.precomputed:
+            # 读取 precomputed.IndicatorData 中预先计算的DMI
+            self.dmi = precomputed.DMI(period=self.p.period)
+            self.plusDI_crossover_minusDI = precomputed.DMICrossOver(period=self.p.period)
+        else:
+            self.dmi = bt.indicators.DMI(period=self.p.period)
+            self.plusDI_crossover_minusDI = bt.indicators.CrossOver(self.dmi.plusDI, self.dmi.minusDI)
         self.plusDI_crossover_minusDI.plotinfo.plot = False
 
         self.stop_orders = []
@@ -64,7 +71,7 @@ class DMIStrat(bt.Strategy):
         if not self.position:
             if (self.p.revert and (self.dmi.plusDI[0] < self.p.plusDI_lower)) or (self.p.trend and ((self.dmi.adx[0] > self.p.ADX_threshold) and self.plusDI_crossover_minusDI)):
                 size = math.floor(
-                    (self.broker.getcash() / data.close[0] / 100)) * 100
+                    (self.broker.getcash() / self.data.close[0] / 100)) * 100
                 if (size > 0):
                     buy_order = self.buy(size=size)
                     stop_order = self.sell(size=size, exectype=bt.Order.StopTrail, trailpercent=self.p.trail_percent)
@@ -143,83 +150,84 @@ class DMIStrat(bt.Strategy):
             # )
 
 
-# Variable for our starting cash
-startcash = 10000
-
-# Create an instance of cerebro
-cerebro = bt.Cerebro()
-
-# Add our strategy
-cerebro.addstrategy(DMIStrat)
-
-data = bt.feeds.GenericCSVData(dataname=os.path.join('.','data','600079_SH.csv'),
-                               dtformat=('%Y-%m-%d'),
-                               datetime=0,
-                               open=1,
-                               high=2,
-                               low=3,
-                               close=4,
-                               volumn=5,
-                               openinterest=6)
-
-# Add the data to Cerebro
-cerebro.adddata(data)
-
-# Add a sizer
-cerebro.addsizer(AllInOut)
-
-# Set our desired cash start
-cerebro.broker.set_cash(startcash)
-
-# Add analyzers
-cerebro.addanalyzer(bt.analyzers.SharpeRatio_A)
-cerebro.addanalyzer(bt.analyzers.SharpeRatio)
-cerebro.addanalyzer(bt.analyzers.DrawDown)
-cerebro.addanalyzer(bt.analyzers.TradeAnalyzer)
-
-# Run over everything
-res = cerebro.run()
-res = res[0]
-
-# Get final portfolio Value
-portvalue = cerebro.broker.getvalue()
-pnl = portvalue - startcash
-
-# Print out the final result
-print('Final Portfolio Value: ${}'.format(round(portvalue, 2)))
-print('P/L: ${}'.format(round(pnl, 2)))
-
-# Analyzer results
-sharpe = res.analyzers.sharperatio_a.get_analysis()
-print('Sharpe Ratio: %.2f' % sharpe['sharperatio'])
-
-drawdown = res.analyzers.drawdown.get_analysis()
-print('Max drawdown percent: %.2f' % drawdown['max']['drawdown'])
-print('Max drawdown money: %.0f' % drawdown['max']['moneydown'])
-
-tradings = res.analyzers.tradeanalyzer.get_analysis()
-print('=================Trading Analysis=================')
-print('total trades: %.0f' % (tradings['won']['total'] + tradings['lost']['total']))
-print('========won=========')
-print('won ratio: %.2f' % (tradings['won']['total'] / float(tradings['won']['total'] + tradings['lost']['total'])))
-print('won hits: %.0f' % tradings['won']['total'])
-print('won pnl total: %.0f, avg: %.0f, max: %.0f' % 
-        (tradings['won']['pnl']['total'],
-        tradings['won']['pnl']['average'],
-        tradings['won']['pnl']['max']))
-
-print('========lost========')
-print('lost ratio: %.2f' % (tradings['lost']['total'] / float(tradings['won']['total'] + tradings['lost']['total'])))
-print('lost hits: %.0f' % tradings['lost']['total'])
-print('lost pnl total: %.0f, avg: %.0f, max: %.0f' % 
-        (tradings['lost']['pnl']['total'],
-        tradings['lost']['pnl']['average'],
-        tradings['lost']['pnl']['max']))
-
-
-# Finally plot the end results
-cerebro.plot(style='candlestick',
-             bardown='green',
-             barup='red',
-             barupfill=False,
-             bardownfill=True)
+if __name__ == '__main__':
+    # Variable for our starting cash
+    startcash = 10000
+
+    # Create an instance of cerebro
+    cerebro = bt.Cerebro()
+
+    # Add our strategy
+    cerebro.addstrategy(DMIStrat)
+
+    data = bt.feeds.GenericCSVData(dataname=os.path.join('.','data','600079_SH.csv'),
+                                   dtformat=('%Y-%m-%d'),
+                                   datetime=0,
+                                   open=1,
+                                   high=2,
+                                   low=3,
+                                   close=4,
+                                   volumn=5,
+                                   openinterest=6)
+
+    # Add the data to Cerebro
+    cerebro.adddata(data)
+
+    # Add a sizer
+    cerebro.addsizer(AllInOut)
+
+    # Set our desired cash start
+    cerebro.broker.set_cash(startcash)
+
+    # Add analyzers
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio_A)
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio)
+    cerebro.addanalyzer(bt.analyzers.DrawDown)
+    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer)
+
+    # Run over everything
+    res = cerebro.run()
+    res = res[0]
+
+    # Get final portfolio Value
+    portvalue = cerebro.broker.getvalue()
+    pnl = portvalue - startcash
+
+    # Print out the final result
+    print('Final Portfolio Value: ${}'.format(round(portvalue, 2)))
+    print('P/L: ${}'.format(round(pnl, 2)))
+
+    # Analyzer results
+    sharpe = res.analyzers.sharperatio_a.get_analysis()
+    print('Sharpe Ratio: %.2f' % sharpe['sharperatio'])
+
+    drawdown = res.analyzers.drawdown.get_analysis()
+    print('Max drawdown percent: %.2f' % drawdown['max']['drawdown'])
+    print('Max drawdown money: %.0f' % drawdown['max']['moneydown'])
+
+    tradings = res.analyzers.tradeanalyzer.get_analysis()
+    print('=================Trading Analysis=================')
+    print('total trades: %.0f' % (tradings['won']['total'] + tradings['lost']['total']))
+    print('========won=========')
+    print('won ratio: %.2f' % (tradings['won']['total'] / float(tradings['won']['total'] + tradings['lost']['total'])))
+    print('won hits: %.0f' % tradings['won']['total'])
+    print('won pnl total: %.0f, avg: %.0f, max: %.0f' % 
+            (tradings['won']['pnl']['total'],
+            tradings['won']['pnl']['average'],
+            tradings['won']['pnl']['max']))
+
+    print('========lost========')
+    print('lost ratio: %.2f' % (tradings['lost']['total'] / float(tradings['won']['total'] + tradings['lost']['total'])))
+    print('lost hits: %.0f' % tradings['lost']['total'])
+    print('lost pnl total: %.0f, avg: %.0f, max: %.0f' % 
+            (tradings['lost']['pnl']['total'],
+            tradings['lost']['pnl']['average'],
+            tradings['lost']['pnl']['max']))
+
+
+    # Finally plot the end results
+    cerebro.plot(style='candlestick',
+                 bardown='green',
+                 barup='red',
+                 barupfill=False,
+                 bardownfill=True)
@@ -0,0 +1,201 @@
+# -*-coding:utf-8 -*-
+
+'''
+向量化回测引擎
+对只依赖买入/卖出信号的策略, 用编译后的循环直接模拟成交, 不经过backtrader逐bar调用next()
+成交规则与backtrader默认的BackBroker一致:
+    * 收盘时产生信号, 下一根bar开盘价成交
+    * 买入数量按 AllInOut 计算: floor(cash_ratio * 现金 / 信号bar收盘价 / 100) * 100
+    * 跟踪止损与 bt.Order.StopTrail 相同: 初始止损价为信号bar收盘价*(1-trail_percent),
+      之后每根bar先检查是否触发(跳空低开按开盘价, 否则按止损价成交), 未触发则按收盘价上移止损价
+    * 手续费按成交金额的比例收取, 交易盈亏统计与 bt.analyzers.TradeAnalyzer 相同(净盈亏>=0计为盈利)
+安装numba时循环会被编译, 否则退化为纯Python循环
+
+Usage:
+    result = backtest(close, entries, exits, open=open, low=low, trail_percent=0.05, commission=0.00075)
+    result['trades']   # 交易明细
+    result['summary']  # 与backtest.py汇总表相同的字段
+    summary = backtest_panel(panel, entries, exits, trail_percent=0.05)  # 多个股票, 每个股票独立资金
+'''
+
+import math
+import numpy as np
+import pandas as pd
+
+from jit import compiled
+
+# 交易明细的字段
+TRADE_FIELDS = ['entry_idx', 'exit_idx', 'size', 'entry_price', 'exit_price', 'pnl', 'pnlcomm']
+
+# 汇总字段, 与backtest.py的汇总表一致
+SUMMARY_FIELDS = ['PnL', 'Trades', 'Wins', 'Win_Ratio', 'Losts', 'Lost_Ratio', 'Win_Value', 'Win_Avg', 'Win_Max', 'Lost_Value', 'Lost_Avg', 'Lost_Max']
+
+@compiled
+def _simulate(open_, low, close, entries, exits, trail_percent, cash, commission, lot, cash_ratio):
+    n = len(close)
+    trades = np.empty((n // 2 + 1, 7))
+    n_trades = 0
+
+    size = 0.0           # 持仓数量
+    entry_price = 0.0
+    entry_comm = 0.0
+    entry_idx = -1
+    stop = -np.inf       # 跟踪止损价
+    pending_buy = 0.0    # 下一根bar开盘买入的数量
+    pending_sell = False # 下一根bar开盘卖出
+
+    for i in range(n):
+        # 1. 开盘处理上一根bar收盘时产生的订单
+        if pending_buy > 0.0:
+            cost = pending_buy * open_[i]
+            comm = cost * commission
+            if cost + comm <= cash: # 资金不足时订单作废, 对应backtrader的Margin
+                cash -= cost + comm
+                size = pending_buy
+                entry_price = open_[i]
+                entry_comm = comm
+                entry_idx = i
+            else:
+                stop = -np.inf
+            pending_buy = 0.0
+
+        exit_price = np.nan
+        if size > 0.0 and pending_sell:
+            exit_price = open_[i]
+        elif size > 0.0 and trail_percent > 0.0:
+            # 2. 跟踪止损: 跳空低开按开盘价成交, 盘中跌破按止损价成交
+            if open_[i] <= stop:
+                exit_price = open_[i]
+            elif low[i] <= stop:
+                exit_price = stop
+        pending_sell = False
+
+        if not np.isnan(exit_price):
+            value = size * exit_price
+            comm = value * commission
+            cash += value - comm
+            pnl = size * (exit_price - entry_price)
+            trades[n_trades, 0] = entry_idx
+            trades[n_trades, 1] = i
+            trades[n_trades, 2] = size
+            trades[n_trades, 3] = entry_price
+            trades[n_trades, 4] = exit_price
+            trades[n_trades, 5] = pnl
+            trades[n_trades, 6] = pnl - entry_comm - comm
+            n_trades += 1
+            size = 0.0
+            stop = -np.inf
+        elif trail_percent > 0.0 and stop > -np.inf:
+            stop = max(stop, close[i] * (1.0 - trail_percent))
+
+        # 3. 收盘时根据信号下单, 下一根bar开盘成交
+        if size == 0.0:
+            if entries[i] and i + 1 < n:
+                pending_buy = float(math.floor(cash_ratio * cash / close[i] / lot)) * lot
+                if pending_buy > 0.0 and trail_percent > 0.0:
+                    stop = close[i] * (1.0 - trail_percent)
+        elif exits[i]:
+            pending_sell = True
+
+    value = cash + size * close[n - 1]
+    return trades[:n_trades], value
+
+# 按 TradeAnalyzer 的规则汇总交易
+def summarize(trades, pnl):
+    """
+    Arguments:
+        trades 	DataFrame 	Y 	交易明细
+        pnl 	float 	Y 	期末资产减去初始资金, 包含未平仓部分
+
+    Returns:
+        summary 	dict 	Y 	字段见 SUMMARY_FIELDS; 没有已平仓交易时Trades为0, 比例和盈亏统计都为0
+    """
+    pnlcomm = trades['pnlcomm'].to_numpy()
+    total = len(pnlcomm)
+    if total == 0:
+        # 没有已平仓交易, 明确返回0, 不产生0/0的NaN
+        summary = dict.fromkeys(SUMMARY_FIELDS, 0.0)
+        summary.update(PnL=pnl, Trades=0, Wins=0, Losts=0)
+        return summary
+
+    won = pnlcomm[pnlcomm >= 0.0]
+    lost = pnlcomm[pnlcomm < 0.0]
+    return dict(
+        PnL=pnl,
+        Trades=total,
+        Wins=len(won),
+        Win_Ratio=len(won) / float(total),
+        Losts=len(lost),
+        Lost_Ratio=len(lost) / float(total),
+        Win_Value=won.sum(),
+        Win_Avg=won.mean() if len(won) else 0.0,
+        Win_Max=won.max() if len(won) else 0.0,
+        Lost_Value=lost.sum(),
+        Lost_Avg=lost.mean() if len(lost) else 0.0,
+        Lost_Max=lost.min() if len(lost) else 0.0,
+    )
+
+# 单个股票的向量化回测
+def backtest(close, entries, exits=None, open=None, low=None, trail_percent=0.0, cash=10000.0, commission=0.00075, lot=100, cash_ratio=0.9, index=None):
+    """
+    Arguments:
+        close 	array 	Y 	收盘价
+        entries 	array 	Y 	买入信号, bool
+        exits 	array 	N 	卖出信号, bool, 默认没有
+        open 	array 	N 	开盘价, 默认使用收盘价
+        low 	array 	N 	最低价, 默认使用收盘价
+        trail_percent 	float 	N 	跟踪止损百分比, 0表示不设止损
+        cash 	float 	N 	初始资金
+        commission 	float 	N 	手续费率
+        lot 	int 	N 	每手股数
+        cash_ratio 	float 	N 	买入时使用的资金比例
+        index 	Index 	N 	交易明细中日期的索引, 如DatetimeIndex
+
+    Returns:
+        result 	dict 	Y 	trades 交易明细, value 期末资产, summary 汇总
+    """
+    close = np.asarray(close, dtype='float64')
+    open_ = close if open is None else np.asarray(open, dtype='float64')
+    low = close if low is None else np.asarray(low, dtype='float64')
+    entries = np.asarray(entries, dtype='bool')
+    exits = np.zeros(len(close), dtype='bool') if exits is None else np.asarray(exits, dtype='bool')
+
+    records, value = _simulate(open_, low, close, entries, exits, float(trail_percent), float(cash), float(commission), float(lot), float(cash_ratio))
+    trades = pd.DataFrame(records, columns=TRADE_FIELDS)
+    trades[['entry_idx', 'exit_idx']] = trades[['entry_idx', 'exit_idx']].astype('int64')
+    if index is not None:
+        trades['entry_date'] = np.asarray(index)[trades['entry_idx']]
+        trades['exit_date'] = np.asarray(index)[trades['exit_idx']]
+
+    return dict(trades=trades, value=value, summary=summarize(trades, value - cash))
+
+# 对面板中的每个股票独立回测
+def backtest_panel(panel, entries, exits=None, codes=None, keep_empty=False, **kwargs):
+    """
+    Arguments:
+        panel 	MarketPanel 	Y 	行情面板
+        entries 	ndarray 	Y 	买入信号, 形状为 (代码数, 日期数)
+        exits 	ndarray 	N 	卖出信号, 形状为 (代码数, 日期数)
+        codes 	list 	N 	需要回测的股票, 默认全部
+        keep_empty 	bool 	N 	是否保留没有已平仓交易的股票, 默认与backtest.py的汇总表一样不保留
+        kwargs 	 	N 	传给 backtest 的参数
+
+    Returns:
+        summary 	DataFrame 	Y 	以code为索引的汇总表
+    """
+    close, open_, low = panel.field('close'), panel.field('open'), panel.field('low')
+    rows = {}
+    for code in (panel.codes if codes is None else codes):
+        i = panel.code_loc(code)
+        # 只保留所有字段都有效的交易日, 与 MarketPanel.to_frame 构建的backtrader数据一致
+        mask = ~np.isnan(panel.symbol(code)).any(axis=1)
+        if not mask.any():
+            continue
+        result = backtest(close[i][mask], entries[i][mask], None if exits is None else exits[i][mask],
+                          open=open_[i][mask], low=low[i][mask], **kwargs)
+        if result['summary']['Trades'] or keep_empty:
+            rows[code] = result['summary']
+
+    summary = pd.DataFrame.from_dict(rows, orient='index', columns=SUMMARY_FIELDS)
+    summary.index.name = 'code'
+    return summary
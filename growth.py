@@ -0,0 +1,97 @@
+# -*-coding:utf-8 -*-
+
+'''
+复权对数价格矩阵
+把全部股票的后复权收盘价(收盘价×除权系数)取对数, 一次整理为 代码×交易日 的矩阵,
+任意两个交易日之间的涨幅为两列之差的指数, 多个区间可以一次按数组计算, 不再逐个区间读取CSV
+
+Usage:
+    prices = dataloader.get_log_prices_from_local(start_date='20210101', end_date='20221231', fp='./data/daily/')
+    growth = prices.growth(['20210104', '20210201'], ['20210301', '20210401'])   # 形状为 (区间数, 代码数)
+    frame = prices.growth_frame('20210104', '20210301')                          # 与 calc_growth_from_local 相同的列
+'''
+
+import os
+import numpy as np
+import pandas as pd
+import adjust
+
+class LogPrices(object):
+    """
+    Arguments:
+        codes 	array 	Y 	股票代码, 已排序
+        dates 	array 	Y 	交易日, str, 格式20211231, 已排序
+        values 	ndarray 	Y 	形状为 (代码数, 交易日数) 的后复权收盘价的对数, 缺失值为NaN
+    """
+    def __init__(self, codes, dates, values):
+        self.codes = pd.Index(np.asarray(codes).astype('str'))
+        self.dates = pd.Index(np.asarray(dates).astype('str'))
+        self.values = np.asarray(values, dtype='float64')
+
+    # 由Tushare每日行情和除权系数的长表构建
+    @classmethod
+    def from_frames(cls, datas, adj_factors):
+        codes = pd.Index(np.union1d(datas['ts_code'].unique(), adj_factors['ts_code'].unique()))
+        dates = pd.Index(np.sort(datas['trade_date'].unique()))
+        close, _, _ = adjust.to_dense(datas, ['close'], codes, dates)
+        factor, _, _ = adjust.to_dense(adj_factors, ['adj_factor'], codes, dates)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.log(close[:, :, 0] * factor[:, :, 0])
+        return cls(codes, dates, values)
+
+    def save(self, fname):
+        os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+        tmp = fname + '.tmp.npz'
+        np.savez(tmp, codes=self.codes.to_numpy(dtype='str'), dates=self.dates.to_numpy(dtype='str'), values=self.values)
+        os.replace(tmp, fname)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname, allow_pickle=False) as f:
+            return cls(f['codes'], f['dates'], f['values'])
+
+    # 区间 [start_date, end_date] 内第一个和最后一个交易日的列号, 区间内没有交易日或交易日不在矩阵中时为-1
+    def locate(self, start_dates, end_dates, calendar=None):
+        """
+        Arguments:
+            start_dates 	str/list 	Y 	开始日期
+            end_dates 	str/list 	Y 	结束日期
+            calendar 	array 	N 	交易日历中的交易日, 默认为矩阵中的交易日
+
+        Returns:
+            i, j 	ndarray 	Y 	开始和结束交易日的列号
+        """
+        calendar = self.dates if calendar is None else pd.Index(np.sort(np.asarray(calendar).astype('str')))
+        starts = np.atleast_1d(np.asarray(start_dates).astype('str'))
+        ends = np.atleast_1d(np.asarray(end_dates).astype('str'))
+        first = calendar.searchsorted(starts, side='left')
+        last = calendar.searchsorted(ends, side='right') - 1
+        empty = (first > last) | (first >= len(calendar)) | (last < 0)
+        i = self.dates.get_indexer(calendar[np.clip(first, 0, len(calendar) - 1)])
+        j = self.dates.get_indexer(calendar[np.clip(last, 0, len(calendar) - 1)])
+        missing = empty | (i < 0) | (j < 0)
+        return np.where(missing, -1, i), np.where(missing, -1, j)
+
+    # 按列号计算涨幅(结束价格/开始价格), 形状为 (区间数, 代码数), 列号为-1的区间为NaN
+    def growth_between(self, i, j):
+        i, j = np.asarray(i), np.asarray(j)
+        growth = np.exp(self.values[:, j] - self.values[:, i]).T
+        growth[(i < 0) | (j < 0)] = np.nan
+        return growth
+
+    # 多个区间的涨幅, 形状为 (区间数, 代码数)
+    def growth(self, start_dates, end_dates, calendar=None):
+        return self.growth_between(*self.locate(start_dates, end_dates, calendar))
+
+    # 单个区间的涨幅表, 列与 dataloader.calc_growth_from_local 相同(不含股票基本信息)
+    def growth_frame(self, start_date, end_date):
+        i, j = self.dates.get_loc(start_date), self.dates.get_loc(end_date)
+        delta_years = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days / 365.0
+        growth = pd.DataFrame({'ts_code': self.codes,
+                               'adj_price1': np.exp(self.values[:, i]),
+                               'adj_price2': np.exp(self.values[:, j])})
+        growth['total_growth'] = np.exp(self.values[:, j] - self.values[:, i])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            growth['annual_growth'] = np.round((np.power(10, np.log10(growth['total_growth']) / delta_years) - 1.0) * 100, 2)
+        growth = growth[growth['adj_price1'].notna()]
+        return growth.sort_values(by='annual_growth', ascending=False)
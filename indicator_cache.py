@@ -0,0 +1,176 @@
+# -*-coding:utf-8 -*-
+
+'''
+技术指标的磁盘缓存
+按 (代码, 指标, 参数) 保存pandas_ta的计算结果, 同时保存最后一个bar的日期和之前预热所需的行情
+    * 行情与缓存一致: 只计算新增的bar, 预热的行情取自缓存, 调用方只需传入最近一段行情(如每日扫描的90天)
+    * 重叠部分的行情发生变化(复权、数据修正): 全部重新计算
+预热的bar数按指标类型确定:
+    * 窗口类(sma, bbands): 窗口长度, 结果与全量计算相同
+    * 递归平滑类(atr, adx, macd): 更早数据的权重 (1-alpha)^n 小于 tolerance 所需的bar数, 多次平滑时累加
+
+Usage:
+    cache = IndicatorCache(cache_fp='./data/indicators/')
+    stock = cache.apply(code, stock, [{"kind": "sma", "length": 5}, {"kind": "adx", "length": 14}])
+'''
+
+import os, math
+import numpy as np
+import pandas as pd
+import pandas_ta as ta
+
+# pandas_ta的默认参数
+DEFAULTS = dict(
+            sma = dict(length=10),
+            bbands = dict(length=5),
+            atr = dict(length=14),
+            adx = dict(length=14),
+            macd = dict(fast=12, slow=26, signal=9),
+            )
+
+# 指数平滑的权重衰减到tolerance以下所需的bar数
+def ewm_bars(alpha, tolerance):
+    return int(math.ceil(math.log(tolerance) / math.log(1.0 - alpha)))
+
+# 指标的预热bar数
+def warmup(kind, params, tolerance=1e-8):
+    """
+    Arguments:
+        kind 	str 	Y 	pandas_ta指标名称
+        params 	dict 	Y 	指标参数
+        tolerance 	float 	N 	递归平滑类指标允许的相对误差
+
+    Returns:
+        bars 	int/None 	Y 	新增bar之前需要的历史bar数, 未知指标返回None(全量计算)
+    """
+    p = dict(DEFAULTS.get(kind, {}), **params)
+    if kind in ('sma', 'bbands'):
+        return p['length']
+    # RMA: alpha = 1/length, 真实波幅多用一个bar
+    if kind == 'atr':
+        return ewm_bars(1.0 / p['length'], tolerance) + 1
+    # +DM/-DM和ATR平滑一次, DX再平滑一次
+    if kind == 'adx':
+        return ewm_bars(1.0 / p['length'], tolerance) + ewm_bars(1.0 / p.get('lensig', p['length']), tolerance) + 1
+    # EMA: alpha = 2/(length+1), 慢线之后信号线再平滑一次
+    if kind == 'macd':
+        return ewm_bars(2.0 / (p['slow'] + 1), tolerance) + ewm_bars(2.0 / (p['signal'] + 1), tolerance)
+    return None
+
+# 用pandas_ta计算单个指标, 返回以stock的索引为索引的DataFrame
+def calculate(stock, kind, params):
+    result = getattr(stock.ta, kind)(**params)
+    return result.to_frame() if isinstance(result, pd.Series) else result
+
+class IndicatorCache(object):
+    """
+    Arguments:
+        cache_fp 	str 	Y 	缓存目录, 每个股票一个子目录, 每个 (指标, 参数) 一个npz文件
+        tolerance 	float 	N 	递归平滑类指标增量计算允许的相对误差
+    """
+    def __init__(self, cache_fp, tolerance=1e-8):
+        self.cache_fp = cache_fp
+        self.tolerance = tolerance
+        self.stats = dict(hit=0, extended=0, computed=0)
+
+    # 缓存文件名, 参数按名称排序
+    def path(self, code, kind, params):
+        name = '_'.join([kind] + ['%s%s' % (k, params[k]) for k in sorted(params)])
+        return os.path.join(self.cache_fp, code, name + '.npz')
+
+    def load(self, fname):
+        if not os.path.exists(fname):
+            return None
+        with np.load(fname, allow_pickle=False) as f:
+            cached = {k: f[k] for k in f.files}
+        return cached
+
+    def save(self, fname, frame, stock, bars):
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        # 同时保存最后bars个bar的行情, 下次增量计算时作为预热, 不依赖调用方传入的历史长度
+        tail = stock.iloc[-bars:] if bars else stock.iloc[:0]
+        # 先写临时文件再替换, 中断时不会留下写了一半的缓存
+        tmp = fname + '.tmp.npz'
+        np.savez(tmp,
+                 values=frame.to_numpy(dtype='float64'),
+                 index=np.asarray(frame.index.astype('str'), dtype='str'),
+                 columns=np.asarray(frame.columns, dtype='str'),
+                 last_date=np.asarray(str(stock.index[-1])),
+                 bars=tail.to_numpy(dtype='float64'),
+                 bar_index=np.asarray(tail.index.astype('str'), dtype='str'),
+                 bar_columns=np.asarray(tail.columns, dtype='str'))
+        os.replace(tmp, fname)
+
+    # 缓存的预热行情与当前行情重叠的部分是否相同, 相同时返回缓存的最后一个bar在stock中的位置, 否则返回None
+    def _match(self, cached, stock):
+        last_date = str(cached['last_date'])
+        index = stock.index.astype('str')
+        n = index.searchsorted(last_date) + 1
+        if not (0 < n <= len(stock) and index[n - 1] == last_date) or list(cached['bar_columns']) != list(stock.columns):
+            return None
+        bar_index = pd.Index(cached['bar_index'])
+        # 重叠区间 [max(两者的开始), last_date] 内的日期和行情必须完全相同
+        begin = max(bar_index[0], index[0]) if len(bar_index) else index[0]
+        mine = (bar_index >= begin)
+        theirs = (index >= begin) & (index <= last_date)
+        if list(bar_index[mine]) != list(index[theirs]) or \
+                not np.array_equal(cached['bars'][mine], stock[theirs].to_numpy(dtype='float64'), equal_nan=True):
+            return None
+        return n
+
+    # 单个指标, 优先使用缓存
+    def get(self, code, stock, kind, params):
+        """
+        Arguments:
+            code 	str 	Y 	股票代码
+            stock 	DataFrame 	Y 	单个股票的行情, 索引为已排序的日期
+            kind 	str 	Y 	pandas_ta指标名称
+            params 	dict 	Y 	指标参数
+
+        Returns:
+            frame 	DataFrame 	Y 	指标值, 索引与stock相同, 早于缓存和stock开始之前的bar为NaN
+        """
+        fname = self.path(code, kind, params)
+        cached = self.load(fname)
+        bars = warmup(kind, params, self.tolerance)
+
+        n = self._match(cached, stock) if (cached is not None and bars is not None) else None
+        if n is not None:
+            old = pd.DataFrame(cached['values'], index=cached['index'], columns=list(cached['columns']))
+            old = old.reindex(stock.index.astype('str')[:n])
+            old.index = stock.index[:n]
+            if n == len(stock):
+                self.stats['hit'] += 1
+                return old
+            # 只计算新增的bar, 前面带上缓存中保存的预热行情
+            warm = pd.DataFrame(cached['bars'], index=cached['bar_index'], columns=list(cached['bar_columns']))
+            warm = warm[warm.index < str(stock.index[0])]
+            warm.index = warm.index.astype(stock.index.dtype)
+            history = pd.concat([warm, stock])
+            tail = calculate(history.iloc[max(0, len(warm) + n - bars):], kind, params)
+            frame = pd.concat([old, tail.iloc[-(len(stock) - n):][old.columns]])
+            self.save(fname, frame, history, bars)
+            self.stats['extended'] += 1
+            return frame
+
+        frame = calculate(stock, kind, params)
+        self.save(fname, frame, stock, bars)
+        self.stats['computed'] += 1
+        return frame
+
+    # 计算一组指标并追加为stock的列, 与 stock.ta.strategy 的结果相同
+    def apply(self, code, stock, indicators):
+        """
+        Arguments:
+            code 	str 	Y 	股票代码
+            stock 	DataFrame 	Y 	单个股票的行情
+            indicators 	list 	Y 	指标列表, 格式同 ta.Strategy 的 ta 参数, 如 [{"kind": "sma", "length": 5}]
+
+        Returns:
+            stock 	DataFrame 	Y 	追加了指标列的行情
+        """
+        frames = [stock]
+        for indicator in indicators:
+            params = {k: v for k, v in indicator.items() if k != 'kind'}
+            frames.append(self.get(code, stock, indicator['kind'], params))
+        return pd.concat(frames, axis=1)
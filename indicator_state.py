@@ -0,0 +1,380 @@
+# -*-coding:utf-8 -*-
+
+'''
+截面指标的增量状态
+按交易日逐日更新全部股票的指标, 每个指标保存每个股票继续计算所需的状态:
+    * 窗口类(sma, bbands): 最近length个bar
+    * 递归平滑类(atr, adx, macd): pandas ewm的加权均值、权重和有效值个数, 递推公式与pandas相同
+新的交易日只用当天的bar更新状态, 结果与 indicators.strategy 在全部历史上计算的结果在浮点误差内相同
+每个股票最近K个bar的指标保存在环形缓冲区中, 状态和缓冲区一起保存到磁盘, 每天只追加新的交易日
+
+缓存记录每个股票最后一个bar的行情, 与当前面板不一致(复权、数据修正)或中间缺少bar的股票从面板的第一天重新计算
+
+Usage:
+    state = IndicatorState.load(cache_fp, indicators) or IndicatorState(indicators)
+    state.extend(panel)                            # 只计算缓存之后的交易日
+    state.save(cache_fp)
+    mask = state.buffer.evaluate(lambda bars: bars['DMP_14'][-1] < 10)
+'''
+
+import os, json, hashlib
+import numpy as np
+from barbuffer import BarBuffer
+from indicators import EPSILON
+
+# 指标需要的行情字段, 计算时每个bar必须齐全, 与 indicators.stack_bars 相同
+PRICE_FIELDS = ('high', 'low', 'close')
+
+# 按代码存放的状态数组, 添加代码和重置代码时统一处理
+class _Arrays(object):
+    def __init__(self, m):
+        self.m = m
+        self.arrays = {}
+        self.fills = {}
+
+    def new(self, name, fill=np.nan, dtype='float64', lead=()):
+        self.arrays[name] = np.full(tuple(lead) + (self.m,), fill, dtype=dtype)
+        self.fills[name] = fill
+        return name
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def add(self, n):
+        for name, values in self.arrays.items():
+            extra = np.full(values.shape[:-1] + (n,), self.fills[name], dtype=values.dtype)
+            self.arrays[name] = np.concatenate([values, extra], axis=-1)
+        self.m += n
+
+    def reset(self, rows):
+        for name, values in self.arrays.items():
+            values[..., rows] = self.fills[name]
+
+# 最近n个非NaN值
+class _Window(object):
+    def __init__(self, arrays, prefix, n):
+        self.a, self.n = arrays, n
+        self.ring = arrays.new(prefix + 'ring', lead=(n,))
+        self.count = arrays.new(prefix + 'count', 0, 'int64')
+
+    def push(self, x, rows):
+        ok = ~np.isnan(x)
+        rows, x = rows[ok], x[ok]
+        count = self.a[self.count]
+        self.a[self.ring][count[rows] % self.n, rows] = x
+        count[rows] += 1
+
+    # 已满n个值的股票的均值, 其余为NaN
+    def mean(self, rows):
+        full = self.a[self.count][rows] >= self.n
+        return np.where(full, self.a[self.ring][:, rows].sum(axis=0) / self.n, np.nan)
+
+    # 总体标准差, 窗口内的值全部相同时为0, 与pandas相同
+    def std(self, rows, ddof=0):
+        values = self.a[self.ring][:, rows]
+        full = self.a[self.count][rows] >= self.n
+        same = values.max(axis=0) == values.min(axis=0)
+        return np.where(full, np.where(same, 0.0, values.std(axis=0, ddof=ddof)), np.nan)
+
+# pandas ewm(...).mean() 的逐bar递推, ignore_na=False
+class _EWM(object):
+    def __init__(self, arrays, prefix, com, adjust=True, min_periods=0):
+        self.a = arrays
+        # pandas由com计算alpha, 保持相同的舍入
+        self.factor = 1.0 - 1.0 / (1.0 + com)
+        self.new_wt = 1.0 if adjust else 1.0 / (1.0 + com)
+        self.adjust = adjust
+        self.min_periods = max(int(min_periods), 1)
+        self.weighted = arrays.new(prefix + 'weighted')
+        self.old_wt = arrays.new(prefix + 'old_wt', 1.0)
+        self.nobs = arrays.new(prefix + 'nobs', 0, 'int64')
+
+    def step(self, x, rows):
+        weighted, old_wt = self.a[self.weighted][rows], self.a[self.old_wt][rows]
+        obs = ~np.isnan(x)
+        nobs = self.a[self.nobs][rows] + obs
+        started = ~np.isnan(weighted)
+        old_wt = np.where(started, old_wt * self.factor, old_wt)
+        with np.errstate(invalid='ignore'):
+            mixed = (old_wt * weighted + self.new_wt * x) / (old_wt + self.new_wt)
+        update = started & obs
+        weighted = np.where(update & (weighted != x), mixed, weighted)
+        old_wt = np.where(update, old_wt + self.new_wt if self.adjust else 1.0, old_wt)
+        weighted = np.where(~started & obs, x, weighted)
+        self.a[self.weighted][rows], self.a[self.old_wt][rows], self.a[self.nobs][rows] = weighted, old_wt, nobs
+        return np.where(nobs >= self.min_periods, weighted, np.nan)
+
+# 与 indicators.rma 相同
+def _rma(arrays, prefix, length):
+    return _EWM(arrays, prefix, 1.0 / (1.0 / length) - 1.0, min_periods=length)
+
+# 与 indicators.ema 相同: 前length个值的均值作为初值
+class _EMA(object):
+    def __init__(self, arrays, prefix, length):
+        self.window = _Window(arrays, prefix + 'seed_', length)
+        self.ewm = _EWM(arrays, prefix, (length - 1) / 2.0, adjust=False)
+        self.a, self.length = arrays, length
+
+    def step(self, x, rows):
+        self.window.push(x, rows)
+        count = self.a[self.window.count][rows]
+        values = np.where(count > self.length, x, np.nan)
+        values = np.where(count == self.length, self.window.mean(rows), values)
+        return self.ewm.step(values, rows)
+
+# high-low, 截至当前bar出现过等于0的值时加上EPSILON
+# pandas_ta按整列判断, 之后出现的0会让之前的值也加上EPSILON, 只有EPSILON量级的差异
+class _NonZeroRange(object):
+    def __init__(self, arrays, prefix):
+        self.a = arrays
+        self.zero = arrays.new(prefix + 'zero', False, 'bool')
+
+    def __call__(self, high, low, rows):
+        diff = high - low
+        self.a[self.zero][rows] |= diff == 0
+        return diff + EPSILON * self.a[self.zero][rows]
+
+def _true_range(nzr, high, low, close, prev_close, rows):
+    with np.errstate(invalid='ignore'):
+        ranges = np.fmax(np.fmax(np.abs(nzr(high, low, rows)), np.abs(high - prev_close)), np.abs(prev_close - low))
+    return np.where(np.isnan(prev_close), np.nan, ranges)
+
+class _SMA(object):
+    def __init__(self, arrays, prefix, length=10):
+        self.window = _Window(arrays, prefix, length)
+        self.name = 'SMA_%d' % length
+
+    def step(self, bars, prev, rows):
+        self.window.push(bars['close'], rows)
+        return {self.name: self.window.mean(rows)}
+
+class _BBands(object):
+    def __init__(self, arrays, prefix, length=5, std=2.0, ddof=0):
+        self.window = _Window(arrays, prefix, length)
+        self.std, self.ddof = float(std), ddof
+        self.ulr = _NonZeroRange(arrays, prefix + 'ulr_')
+        self.plr = _NonZeroRange(arrays, prefix + 'plr_')
+        self.props = '_%d_%s' % (length, self.std)
+
+    def step(self, bars, prev, rows):
+        close = bars['close']
+        self.window.push(close, rows)
+        mid = self.window.mean(rows)
+        deviations = self.std * self.window.std(rows, self.ddof)
+        lower, upper = mid - deviations, mid + deviations
+        ulr = self.ulr(upper, lower, rows)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {'BBL' + self.props: lower, 'BBM' + self.props: mid, 'BBU' + self.props: upper,
+                    'BBB' + self.props: 100 * ulr / mid, 'BBP' + self.props: self.plr(close, lower, rows) / ulr}
+
+class _ATR(object):
+    def __init__(self, arrays, prefix, length=14):
+        self.nzr = _NonZeroRange(arrays, prefix + 'hl_')
+        self.rma = _rma(arrays, prefix, length)
+        self.name = 'ATRr_%d' % length
+
+    def step(self, bars, prev, rows):
+        tr = _true_range(self.nzr, bars['high'], bars['low'], bars['close'], prev['close'], rows)
+        return {self.name: self.rma.step(tr, rows)}
+
+class _ADX(object):
+    def __init__(self, arrays, prefix, length=14, lensig=None, scalar=100):
+        lensig = lensig if lensig else length
+        self.nzr = _NonZeroRange(arrays, prefix + 'hl_')
+        self.atr = _rma(arrays, prefix + 'atr_', length)
+        self.pos = _rma(arrays, prefix + 'pos_', length)
+        self.neg = _rma(arrays, prefix + 'neg_', length)
+        self.adx = _rma(arrays, prefix + 'adx_', lensig)
+        self.scalar = scalar
+        self.names = ('ADX_%d' % lensig, 'DMP_%d' % length, 'DMN_%d' % length)
+
+    def step(self, bars, prev, rows):
+        high, low = bars['high'], bars['low']
+        atr = self.atr.step(_true_range(self.nzr, high, low, bars['close'], prev['close'], rows), rows)
+        up = high - prev['high']
+        dn = prev['low'] - low
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pos = ((up > dn) & (up > 0)) * up
+            neg = ((dn > up) & (dn > 0)) * dn
+            pos = np.where(np.abs(pos) < EPSILON, 0.0, pos)
+            neg = np.where(np.abs(neg) < EPSILON, 0.0, neg)
+            k = self.scalar / atr
+            dmp = k * self.pos.step(pos, rows)
+            dmn = k * self.neg.step(neg, rows)
+            dx = self.scalar * np.abs(dmp - dmn) / (dmp + dmn)
+        return dict(zip(self.names, (self.adx.step(dx, rows), dmp, dmn)))
+
+class _MACD(object):
+    def __init__(self, arrays, prefix, fast=12, slow=26, signal=9):
+        self.fast = _EMA(arrays, prefix + 'fast_', fast)
+        self.slow = _EMA(arrays, prefix + 'slow_', slow)
+        self.signal = _EMA(arrays, prefix + 'signal_', signal)
+        self.props = '_%d_%d_%d' % (fast, slow, signal)
+
+    def step(self, bars, prev, rows):
+        close = bars['close']
+        line = self.fast.step(close, rows) - self.slow.step(close, rows)
+        signalma = self.signal.step(line, rows)
+        return {'MACD' + self.props: line, 'MACDh' + self.props: line - signalma, 'MACDs' + self.props: signalma}
+
+INDICATORS = dict(sma=_SMA, bbands=_BBands, atr=_ATR, adx=_ADX, macd=_MACD)
+
+# 指标列表的标识, 参数不同的缓存不能混用
+def indicators_key(indicators):
+    return hashlib.sha1(json.dumps(list(indicators), sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+class IndicatorState(object):
+    """
+    Arguments:
+        indicators 	list 	Y 	指标列表, 格式同 ta.Strategy 的 ta 参数, 如 [{"kind": "sma", "length": 5}]
+        codes 	array 	N 	股票代码, 之后出现的新代码会自动添加
+        size 	int 	N 	环形缓冲区中每个股票保存的bar数K
+    """
+    def __init__(self, indicators, codes=(), size=2):
+        self.indicators = [dict(indicator) for indicator in indicators]
+        self.codes = np.asarray(codes, dtype='str')
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.arrays = _Arrays(len(self.codes))
+        # 每个股票最后一个bar的日期和行情, 用于检查历史行情是否变化
+        self.arrays.new('last_date', 0, 'int32')
+        for field in PRICE_FIELDS:
+            self.arrays.new('prev_' + field)
+        self.nodes = []
+        for i, indicator in enumerate(self.indicators):
+            params = {k: v for k, v in indicator.items() if k != 'kind'}
+            self.nodes.append(INDICATORS[indicator['kind']](self.arrays, 'i%d_' % i, **params))
+        self.fields = self._fields()
+        self.buffer = BarBuffer(self.codes, self.fields, size)
+        self.last_date = 0
+
+    # 输出的字段名, 与 indicators.strategy 的键顺序相同
+    def _fields(self):
+        arrays = _Arrays(1)
+        bars = {field: np.full(1, np.nan) for field in PRICE_FIELDS}
+        fields = []
+        for i, indicator in enumerate(self.indicators):
+            params = {k: v for k, v in indicator.items() if k != 'kind'}
+            fields += list(INDICATORS[indicator['kind']](arrays, 'i%d_' % i, **params).step(bars, bars, np.zeros(1, dtype='int64')))
+        return fields
+
+    def add_codes(self, codes):
+        codes = [code for code in np.asarray(codes, dtype='str') if code not in self.code_index]
+        if not codes:
+            return
+        self.codes = np.concatenate([self.codes, np.asarray(codes, dtype='str')])
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.arrays.add(len(codes))
+        self.buffer.add_codes(codes)
+
+    # 清空部分股票的状态, 之后从头计算
+    def reset(self, rows):
+        self.arrays.reset(rows)
+        self.buffer.clear(self.codes[rows])
+
+    # 用一个交易日的bar更新状态, 返回每个指标当天的值, 没有bar的股票为NaN
+    def update(self, date, bars, rows):
+        """
+        Arguments:
+            date 	int 	Y 	交易日, 格式20220128
+            bars 	dict 	Y 	high, low, close, 形状为 (len(rows),)
+            rows 	ndarray 	Y 	当天有bar的股票在 self.codes 中的位置
+
+        Returns:
+            result 	dict 	Y 	字段名到 (len(rows),) 数组的映射
+        """
+        prev = {field: self.arrays['prev_' + field][rows] for field in PRICE_FIELDS}
+        result = {}
+        for node in self.nodes:
+            result.update(node.step(bars, prev, rows))
+        for field in PRICE_FIELDS:
+            self.arrays['prev_' + field][rows] = bars[field]
+        self.arrays['last_date'][rows] = date
+        self.buffer.push(date, np.stack([result[field] for field in self.fields], axis=1),
+                         codes=self.codes[rows], valid=np.ones(len(rows), dtype='bool'))
+        return result
+
+    # 用面板中缓存之后的交易日更新状态
+    def extend(self, panel):
+        """
+        Arguments:
+            panel 	MarketPanel 	Y 	行情面板, 每个bar的全部字段有效时才参与计算, 与 indicators.stack_bars 相同
+
+        Returns:
+            stats 	dict 	Y 	新增的交易日数, 需要从头计算的股票数
+        """
+        dates = np.asarray(panel.dates)
+        # 缓存之后到面板开始之间缺少交易日, 或面板早于缓存, 全部重新计算
+        if self.last_date and len(dates) and (dates[0] > self.last_date or dates[-1] < self.last_date):
+            self.reset(np.arange(len(self.codes)))
+            self.last_date = 0
+        self.add_codes(panel.codes)
+        rows = np.array([self.code_index[code] for code in np.asarray(panel.codes, dtype='str')], dtype='int64')
+        values = np.asarray(panel.values)
+        valid = ~np.isnan(values).any(axis=2)
+        fields = [panel.field_loc(field) for field in PRICE_FIELDS]
+
+        # 需要从头计算的股票: 缓存中的最后一个bar与面板不一致, 或之后缺少bar
+        replay = self._stale(dates, rows, valid, values[:, :, fields])
+        if replay.any():
+            self.reset(rows[replay])
+        last_date = self.last_date
+        start = 0 if replay.any() else np.searchsorted(dates, last_date, side='right')
+        for j in range(start, len(dates)):
+            ok = valid[:, j] & (replay | (dates[j] > last_date))
+            if ok.any():
+                bars = {field: values[ok, j, k] for field, k in zip(PRICE_FIELDS, fields)}
+                self.update(int(dates[j]), bars, rows[ok])
+        if len(dates):
+            self.last_date = max(last_date, int(dates[-1]))
+        return dict(dates=int((dates > last_date).sum()), replayed=int(replay.sum()))
+
+    # 面板中每个股票是否需要从头计算
+    def _stale(self, dates, rows, valid, prices):
+        if not len(dates) or not self.last_date:
+            return np.zeros(len(rows), dtype='bool')
+        last = self.arrays['last_date'][rows]
+        j = np.searchsorted(dates, last)
+        inside = (last > 0) & (j < len(dates)) & (dates[np.minimum(j, len(dates) - 1)] == last)
+        seen = np.zeros(len(rows), dtype='bool')
+        jj = np.minimum(j, len(dates) - 1)
+        stored = np.stack([self.arrays['prev_' + field][rows] for field in PRICE_FIELDS], axis=1)
+        seen[inside] = valid[inside, jj[inside]] & (prices[inside, jj[inside]] == stored[inside]).all(axis=1)
+        # 最后一个bar之后、缓存结束之前还有bar, 说明缓存缺少数据
+        known = (dates <= self.last_date)
+        after = valid & known[None, :] & (dates[None, :] > last[:, None])
+        has_known = (valid & known[None, :]).any(axis=1)
+        return (has_known & ~seen) | after.any(axis=1)
+
+    def path(self, cache_fp):
+        return os.path.join(cache_fp, 'indicator_state_%s.npz' % indicators_key(self.indicators))
+
+    def save(self, cache_fp):
+        os.makedirs(cache_fp, exist_ok=True)
+        fname = self.path(cache_fp)
+        tmp = fname + '.tmp.npz'
+        buffer = self.buffer
+        np.savez(tmp, codes=self.codes, last_date=np.asarray(self.last_date),
+                 indicators=np.asarray(json.dumps(self.indicators, sort_keys=True)),
+                 buffer_values=buffer.values, buffer_dates=buffer.dates, buffer_pos=buffer.pos, buffer_count=buffer.count,
+                 **{'state_' + name: values for name, values in self.arrays.arrays.items()})
+        os.replace(tmp, fname)
+
+    # 读取缓存, 不存在或指标参数不同时返回None
+    @classmethod
+    def load(cls, cache_fp, indicators, size=2):
+        state = cls(indicators, size=size)
+        fname = state.path(cache_fp)
+        if not os.path.exists(fname):
+            return None
+        with np.load(fname, allow_pickle=False) as f:
+            if json.loads(str(f['indicators'])) != json.loads(json.dumps(state.indicators, sort_keys=True)) \
+                    or f['buffer_values'].shape[0] != size:
+                return None
+            state.add_codes(f['codes'])
+            for name in state.arrays.arrays:
+                state.arrays.arrays[name] = f['state_' + name]
+            buffer = state.buffer
+            buffer.values, buffer.dates, buffer.pos, buffer.count = \
+                f['buffer_values'], f['buffer_dates'], f['buffer_pos'], f['buffer_count']
+            state.last_date = int(f['last_date'])
+        return state
@@ -0,0 +1,142 @@
+# -*-coding:utf-8 -*-
+
+'''
+截面向量化的技术指标
+在 bar×代码 的宽表上一次计算全部股票的指标, 每列一个股票, rolling/ewm 按列同时计算
+公式与pandas_ta的pandas实现(talib=False)相同, 列名与pandas_ta相同, 如 SMA_5, ADX_14, DMP_14, DMN_14
+
+停牌日没有行情, 先用 stack_bars 把每个股票的有效bar靠下对齐(最后一行是每个股票最近的bar),
+与逐个股票 panel.to_frame 之后调用pandas_ta的结果一致
+
+Usage:
+    bars = stack_bars(panel)
+    result = strategy(bars, [{"kind": "sma", "length": 5}, {"kind": "adx", "length": 14}])
+    last = result['ADX_14'].iloc[-1]          # 每个股票最近一个bar的ADX
+'''
+
+import sys
+import numpy as np
+import pandas as pd
+
+EPSILON = sys.float_info.epsilon
+
+# 每个股票的有效bar靠下对齐, 返回每个字段的宽表
+def stack_bars(panel):
+    """
+    Arguments:
+        panel 	MarketPanel 	Y 	行情面板
+
+    Returns:
+        bars 	dict 	Y 	每个字段一个DataFrame, 行为倒数第n个bar, 列为code, 上方不足的部分为NaN
+                datetime 为每个bar的日期, int, 没有bar时为0
+    """
+    values = np.asarray(panel.values)
+    valid = ~np.isnan(values).any(axis=2)
+    counts = valid.sum(axis=1)
+    n = int(counts.max()) if len(counts) else 0
+
+    # np.nonzero按 (代码, 日期) 顺序返回, 每个股票的第k个有效bar放在第 n-counts+k 行
+    code_idx, date_idx = np.nonzero(valid)
+    rank = np.arange(len(code_idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+    row = n - counts[code_idx] + rank
+
+    columns = pd.Index(panel.codes, name='code')
+    bars = {}
+    for field in panel.fields:
+        out = np.full((n, len(columns)), np.nan)
+        out[row, code_idx] = values[code_idx, date_idx, panel.field_loc(field)]
+        bars[field] = pd.DataFrame(out, columns=columns)
+    dates = np.zeros((n, len(columns)), dtype='int32')
+    dates[row, code_idx] = panel.dates[date_idx]
+    bars['datetime'] = pd.DataFrame(dates, columns=columns)
+    return bars
+
+# 接近0的值置为0
+def _zero(frame):
+    return frame.mask(frame.abs() < EPSILON, 0.0)
+
+# high-low, 有等于0的值时整列加上EPSILON
+def _non_zero_range(high, low):
+    diff = high - low
+    return diff + EPSILON * diff.eq(0).any()
+
+# 以前length个值的均值为初值的EMA
+def ema(close, length=10):
+    count = close.notna().cumsum()
+    seed = close.rolling(length, min_periods=length).mean()
+    values = close.where(count > length).mask(count == length, seed)
+    return values.ewm(span=length, adjust=False).mean()
+
+# Wilder平滑
+def rma(close, length=10):
+    return close.ewm(alpha=1.0 / length, min_periods=length).mean()
+
+def sma(close, length=10):
+    return {'SMA_%d' % length: close.rolling(length, min_periods=length).mean()}
+
+# 布林线, 标准差为总体标准差
+def bbands(close, length=5, std=2.0, ddof=0):
+    std = float(std)
+    mid = close.rolling(length, min_periods=length).mean()
+    deviations = std * close.rolling(length, min_periods=length).std(ddof=ddof)
+    lower, upper = mid - deviations, mid + deviations
+    ulr = _non_zero_range(upper, lower)
+    props = '_%d_%s' % (length, std)
+    return {'BBL' + props: lower, 'BBM' + props: mid, 'BBU' + props: upper,
+            'BBB' + props: 100 * ulr / mid, 'BBP' + props: _non_zero_range(close, lower) / ulr}
+
+# 真实波幅, 每个股票的第一个bar为NaN
+def true_range(high, low, close):
+    prev_close = close.shift(1)
+    ranges = np.fmax(np.fmax(_non_zero_range(high, low).abs(), (high - prev_close).abs()), (prev_close - low).abs())
+    return ranges.where(prev_close.notna())
+
+def atr(high, low, close, length=14):
+    return {'ATRr_%d' % length: rma(true_range(high, low, close), length)}
+
+def adx(high, low, close, length=14, lensig=None, scalar=100):
+    lensig = lensig if lensig else length
+    atr_ = rma(true_range(high, low, close), length)
+
+    up = high - high.shift(1)
+    dn = low.shift(1) - low
+    pos = _zero(((up > dn) & (up > 0)) * up)
+    neg = _zero(((dn > up) & (dn > 0)) * dn)
+
+    k = scalar / atr_
+    dmp = k * rma(pos, length)
+    dmn = k * rma(neg, length)
+    dx = scalar * (dmp - dmn).abs() / (dmp + dmn)
+    return {'ADX_%d' % lensig: rma(dx, lensig), 'DMP_%d' % length: dmp, 'DMN_%d' % length: dmn}
+
+def macd(close, fast=12, slow=26, signal=9):
+    line = ema(close, fast) - ema(close, slow)
+    signalma = ema(line, signal)
+    props = '_%d_%d_%d' % (fast, slow, signal)
+    return {'MACD' + props: line, 'MACDh' + props: line - signalma, 'MACDs' + props: signalma}
+
+# 各指标需要的行情字段
+INDICATORS = dict(
+            sma = (sma, ('close',)),
+            bbands = (bbands, ('close',)),
+            atr = (atr, ('high', 'low', 'close')),
+            adx = (adx, ('high', 'low', 'close')),
+            macd = (macd, ('close',)),
+            )
+
+# 一次计算一组指标, 格式同 ta.Strategy 的 ta 参数
+def strategy(bars, indicators):
+    """
+    Arguments:
+        bars 	dict 	Y 	stack_bars 返回的宽表
+        indicators 	list 	Y 	指标列表, 如 [{"kind": "sma", "length": 5}, {"kind": "adx", "length": 14}]
+
+    Returns:
+        result 	dict 	Y 	以pandas_ta列名为键的宽表
+    """
+    result = {}
+    for indicator in indicators:
+        func, fields = INDICATORS[indicator['kind']]
+        params = {k: v for k, v in indicator.items() if k != 'kind'}
+        result.update(func(*[bars[field] for field in fields], **params))
+    return result
@@ -0,0 +1,37 @@
+# -*-coding:utf-8 -*-
+
+'''
+可选的numba编译
+安装numba时用 numba.njit(cache=True) 编译逐bar的循环, 否则使用纯Python循环或给定的NumPy实现
+各模块都通过这里编译, 不再各自处理numba是否安装
+
+Usage:
+    _smooth = compiled(_smooth_loop)                          # 没有numba时使用原函数
+    _exits = compiled(_exits_loop, fallback=_exits_numpy)     # 没有numba时使用按bar向量化的实现
+
+    @compiled
+    def _simulate(open_, low, close, ...):
+        ...
+'''
+
+try:
+    from numba import njit
+except ImportError: # 没有安装numba时不编译
+    njit = None
+
+# 是否安装了numba
+NUMBA = njit is not None
+
+# 编译循环函数
+def compiled(func, fallback=None):
+    """
+    Arguments:
+        func 	function 	Y 	numba可编译的循环
+        fallback 	function 	N 	没有numba时使用的实现, 默认为未编译的func
+
+    Returns:
+        func 	function 	Y 	编译后的函数或fallback
+    """
+    if njit is None:
+        return func if fallback is None else fallback
+    return njit(cache=True)(func)
@@ -0,0 +1,168 @@
+# -*-coding:utf-8 -*-
+
+'''
+稠密行情面板
+把dataloader返回的长表整理一次, 保存为连续的 代码×日期×字段 浮点数组,
+代码和日期用整数下标索引, 按股票或按日期切片都直接返回数组视图, 不经过pandas索引
+
+Usage:
+    datas = dataloader.get_daily_from_local(start_date='20210101', end_date='20211231', fp='./data/daily/')
+    panel = MarketPanel.from_frame(datas)
+    close = panel.symbol('600000.SH')[:, panel.field_loc('close')]   # 单个股票, 视图
+    today = panel.on('20211231')                                       # 单个交易日, 视图
+    stock = panel.to_frame('600000.SH')                                # 转为backtrader可用的DataFrame
+
+    panel.save('./data/cache/panel_20210101_20211231')                 # 保存为内存映射文件
+    panel = MarketPanel.load('./data/cache/panel_20210101_20211231')   # 只读映射, 多个进程共享同一份物理内存
+'''
+
+import os, json, shutil
+import numpy as np
+import pandas as pd
+import adjust
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+class MarketPanel(object):
+    """
+    Arguments:
+        codes 	array 	Y 	股票代码, 已排序
+        dates 	array 	Y 	交易日, int32, 格式20211231, 已排序
+        values 	ndarray 	Y 	形状为 (代码数, 日期数, 字段数), 缺失值为NaN
+        fields 	tuple 	N 	字段名
+    """
+    def __init__(self, codes, dates, values, fields=FIELDS):
+        self.codes = np.asarray(codes)
+        self.dates = np.asarray(dates, dtype='int32')
+        self.values = np.asanyarray(values)
+        self.fields = tuple(fields)
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.field_index = {field: i for i, field in enumerate(self.fields)}
+        self._datetimes = None
+        self.path = None
+
+    # 从dataloader的长表构建面板
+    @classmethod
+    def from_frame(cls, datas, fields=FIELDS, code_col='code', date_col='datetime', dtype='float64'):
+        code_idx, codes = pd.factorize(datas[code_col], sort=True)
+        date_idx, dates = pd.factorize(datas[date_col].astype('int32'), sort=True)
+        values = np.full((len(codes), len(dates), len(fields)), np.nan, dtype=dtype)
+        values[code_idx, date_idx] = datas[list(fields)].to_numpy(dtype=dtype)
+        return cls(np.asarray(codes), np.asarray(dates), values, fields)
+
+    # 从复权引擎的结果构建面板, 与 from_frame 相同, 只保留价格、成交量和除权系数都有效的bar, 去掉没有任何bar的代码和日期
+    @classmethod
+    def from_adjusted(cls, adjusted, how='qfq', fields=FIELDS):
+        values = np.concatenate([adjusted[how], adjusted['volume'][:, :, None]], axis=2)
+        values = values[:, :, [list(adjust.FIELDS + ['volume']).index(field) for field in fields]]
+        values[np.isnan(values).any(axis=2)] = np.nan
+        valid = ~np.isnan(values[:, :, 0])
+        rows, cols = valid.any(axis=1), valid.any(axis=0)
+        return cls(np.asarray(adjusted['codes'])[rows], np.asarray(adjusted['dates']).astype('int32')[cols],
+                   np.ascontiguousarray(values[rows][:, cols]), fields)
+
+    # 保存为目录: values.npy为原始数组, 可被多个进程以内存映射方式只读打开
+    def save(self, path):
+        tmp = path + '.tmp'
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, 'values.npy'), np.ascontiguousarray(self.values))
+        np.save(os.path.join(tmp, 'dates.npy'), self.dates)
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(dict(codes=[str(code) for code in self.codes], fields=list(self.fields)), f, ensure_ascii=False)
+        # 写完后整体替换, 其他进程不会读到写了一半的文件
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+
+    # 从目录加载, 默认以只读内存映射方式打开, 不复制数据
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        values = np.load(os.path.join(path, 'values.npy'), mmap_mode=mmap_mode)
+        dates = np.load(os.path.join(path, 'dates.npy'))
+        panel = cls(np.array(meta['codes']), dates, values, meta['fields'])
+        panel.path = path
+        return panel
+
+    # 内存映射的面板传给子进程时只传路径, 子进程重新映射同一个文件
+    def __reduce__(self):
+        if self.path is not None and isinstance(self.values, np.memmap):
+            return (MarketPanel.load, (self.path, self.values.mode))
+        return (MarketPanel, (self.codes, self.dates, np.asarray(self.values), self.fields))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.code_index
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    # 交易日对应的DatetimeIndex, 只在第一次使用时转换
+    @property
+    def datetimes(self):
+        if self._datetimes is None:
+            self._datetimes = pd.to_datetime(self.dates.astype('str'), format='%Y%m%d')
+        return self._datetimes
+
+    def code_loc(self, code):
+        return self.code_index[code]
+
+    def field_loc(self, field):
+        return self.field_index[field]
+
+    # 日期对应的下标, 二分查找, 不存在时抛出KeyError
+    def date_loc(self, date):
+        date = int(date)
+        i = np.searchsorted(self.dates, date)
+        if i >= len(self.dates) or self.dates[i] != date:
+            raise KeyError(date)
+        return i
+
+    # 单个股票的全部数据, 形状为 (日期数, 字段数) 的视图
+    def symbol(self, code):
+        return self.values[self.code_index[code]]
+
+    # 单个字段的全部数据, 形状为 (代码数, 日期数) 的视图
+    def field(self, field):
+        return self.values[:, :, self.field_index[field]]
+
+    # 单个字段的宽表, 以datetime为索引、code为列, 可直接用于vectorbt
+    def wide(self, field='close'):
+        frame = pd.DataFrame(self.field(field).T, index=self.datetimes, columns=pd.Index(self.codes, name='code'))
+        frame.index.name = 'datetime'
+        return frame
+
+    # 单个交易日的全部数据, 形状为 (代码数, 字段数) 的视图
+    def on(self, date):
+        return self.values[:, self.date_loc(date)]
+
+    # 日期区间 [start_date, end_date] 的切片, 共享同一块内存
+    def between(self, start_date, end_date):
+        i = np.searchsorted(self.dates, int(start_date), side='left')
+        j = np.searchsorted(self.dates, int(end_date), side='right')
+        return MarketPanel(self.codes, self.dates[i:j], self.values[:, i:j], self.fields)
+
+    # 选取部分股票, 返回新的面板
+    def select(self, codes):
+        rows = [self.code_index[code] for code in codes if code in self.code_index]
+        return MarketPanel(self.codes[rows], self.dates, self.values[rows], self.fields)
+
+    # 单个股票有行情的交易日
+    def valid(self, code, field='close'):
+        return ~np.isnan(self.values[self.code_index[code], :, self.field_index[field]])
+
+    # 单个股票转为以datetime为索引的DataFrame, 去掉没有行情的交易日, 可直接用于bt.feeds.PandasData
+    def to_frame(self, code, openinterest=True):
+        values = self.symbol(code)
+        mask = ~np.isnan(values).any(axis=1)
+        stock = pd.DataFrame(values[mask], index=self.datetimes[mask], columns=list(self.fields))
+        stock.index.name = 'datetime'
+        if openinterest:
+            stock['openinterest'] = 0.0
+        return stock
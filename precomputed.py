@@ -0,0 +1,238 @@
+# -*-coding:utf-8 -*-
+
+'''
+预先计算的指标
+按backtrader指标的公式对整个序列计算一次, 作为额外的列放进DataFrame, 由 IndicatorData 作为数据线传给backtrader
+策略设置 precomputed=True 时读取这些数据线, 不再在每次Cerebro运行中逐bar重新计算指标
+指标的值和开始有效的bar(minperiod)都与backtrader的指标相同, 回测结果与实时计算一致
+
+Usage:
+    stock = precompute(stock, boll=dict(period=20, devfactor=2.0), dmi=dict(period=14), sma=(5, 10), trend=True)
+    cerebro.adddata(IndicatorData(dataname=stock))
+    cerebro.addstrategy(BOLLStrat, precomputed=True)   # 策略参数需与precompute的参数一致
+'''
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import backtrader as bt
+
+from jit import compiled
+
+# IndicatorData 额外的数据线, DataFrame中没有的列为NaN
+INDICATOR_LINES = ('boll_mid', 'boll_top', 'boll_bot',
+                   'dmi_plus', 'dmi_minus', 'dmi_adx', 'dmi_cross',
+                   'sma_fast', 'sma_slow', 'sma_cross', 'sma_crossdown',
+                   'trend')
+
+class IndicatorData(bt.feeds.PandasData):
+    lines = INDICATOR_LINES
+    params = tuple((name, -1) for name in INDICATOR_LINES)
+
+# 两个浮点数的和及其舍入误差(TwoSum), 误差是精确的
+def _two_sum(a, b):
+    s = a + b
+    bb = s - a
+    return s, (a - (s - bb)) + (b - bb)
+
+# 与 bt.indicators.SMA 相同: backtrader每个窗口用math.fsum求和
+# 这里对所有窗口同时做补偿求和, 相当于以两倍精度累加后再舍入一次, 与fsum的结果逐位相同
+def moving_average(values, period):
+    values = np.asarray(values, dtype='float64')
+    out = np.full(len(values), np.nan)
+    start = np.argmax(~np.isnan(values)) if len(values) else 0
+    if len(values) - start < period:
+        return out
+    windows = sliding_window_view(values[start:], period)
+    total = windows[:, 0].copy()
+    error = np.zeros(len(windows))
+    for k in range(1, period):
+        total, e = _two_sum(total, windows[:, k])
+        error += e
+    out[start + period - 1:] = (total + error) / period
+    return out
+
+def _smooth_loop(out, values, start, alpha, alpha1):
+    prev = out[start]
+    for i in range(start + 1, len(values)):
+        prev = prev * alpha1 + values[i] * alpha
+        out[i] = prev
+    return out
+
+# 递推无法向量化, 安装numba时编译循环
+_smooth = compiled(_smooth_loop)
+
+# 与 bt.indicators.SmoothedMovingAverage 相同: 前period个值的均值作为初值, 之后 prev*(1-1/period) + x/period
+def smoothed_average(values, period):
+    values = np.asarray(values, dtype='float64')
+    out = moving_average(values, period)
+    valid = np.flatnonzero(~np.isnan(out))
+    if len(valid) == 0:
+        return out
+    alpha = 1.0 / period
+    return _smooth(out, values, valid[0], alpha, 1.0 - alpha)
+
+# 与 bt.indicators.CrossUp、CrossDown 相同, 返回上穿和下穿两个序列, 相等时沿用之前的差值方向
+def crossover(a, b):
+    a = np.asarray(a, dtype='float64')
+    b = np.asarray(b, dtype='float64')
+    n = len(a)
+    up = np.full(n, np.nan)
+    down = np.full(n, np.nan)
+    diff = a - b
+    valid = np.flatnonzero(~np.isnan(diff))
+    if len(valid) == 0:
+        return up, down
+    first = valid[0]
+    # 每个bar之前最后一个非零的差值(NaN也算非零), 从第一个有效bar开始, 之前全为零时为第一个有效bar的差值
+    index = np.where(diff[first:] != 0.0, np.arange(first, n), first)
+    prev = diff[np.maximum.accumulate(index)][:-1]
+    up[first + 1:] = (prev < 0.0) & (a[first + 1:] > b[first + 1:])
+    down[first + 1:] = (prev > 0.0) & (a[first + 1:] < b[first + 1:])
+    return up, down
+
+# 与 bt.indicators.BollingerBands 相同, 标准差为总体标准差
+def bollinger_bands(close, period=20, devfactor=2.0):
+    """
+    Arguments:
+        close 	array 	Y 	收盘价
+        period 	int 	N 	周期
+        devfactor 	float 	N 	标准差倍数
+
+    Returns:
+        mid, top, bot 	ndarray 	Y 	中轨、上轨、下轨
+    """
+    close = np.asarray(close, dtype='float64')
+    mid = moving_average(close, period)
+    meansq = moving_average(close ** 2, period)
+    # 逐个用Python浮点数计算, NumPy的平方与backtrader的pow在最后一位上可能不同
+    stddev = devfactor * np.array([abs(float(sq) - float(m) ** 2) ** 0.5 for sq, m in zip(meansq, mid)])
+    return mid, mid + stddev, mid - stddev
+
+# 与 bt.indicators.DMI 相同, 均线为Wilder平滑
+def directional_movement(high, low, close, period=14):
+    """
+    Arguments:
+        high, low, close 	array 	Y 	最高价、最低价、收盘价
+        period 	int 	N 	周期
+
+    Returns:
+        plusDI, minusDI, adx 	ndarray 	Y 	+DI, -DI, ADX
+    """
+    high = np.asarray(high, dtype='float64')
+    low = np.asarray(low, dtype='float64')
+    close = np.asarray(close, dtype='float64')
+    prev_close = np.concatenate([[np.nan], close[:-1]])
+    tr = np.fmax(high, prev_close) - np.fmin(low, prev_close)
+    tr[0] = np.nan
+    atr = smoothed_average(tr, period)
+
+    upmove = high - np.concatenate([[np.nan], high[:-1]])
+    downmove = np.concatenate([[np.nan], low[:-1]]) - low
+    plus_dm = np.where((upmove > downmove) & (upmove > 0.0), upmove, 0.0)
+    minus_dm = np.where((downmove > upmove) & (downmove > 0.0), downmove, 0.0)
+    plus_dm[0] = minus_dm[0] = np.nan
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        plus_di = 100.0 * smoothed_average(plus_dm, period) / atr
+        minus_di = 100.0 * smoothed_average(minus_dm, period) / atr
+        dx = np.abs(plus_di - minus_di) / (plus_di + minus_di)
+    adx = 100.0 * smoothed_average(dx, period)
+    return plus_di, minus_di, adx
+
+# 计算指标并追加为DataFrame的列
+def precompute(stock, boll=None, dmi=None, sma=None, trend=None):
+    """
+    Arguments:
+        stock 	DataFrame 	Y 	行情, 包含 high, low, close
+        boll 	dict 	N 	布林线参数, 如 dict(period=20, devfactor=2.0)
+        dmi 	dict 	N 	DMI参数, 如 dict(period=14)
+        sma 	tuple 	N 	快慢均线周期, 如 (5, 10)
+        trend 	bool/list 	N 	True或均线周期列表, 计算sma.TrendIndicator
+
+    Returns:
+        stock 	DataFrame 	Y 	追加了指标列的副本, 列名见 INDICATOR_LINES
+    """
+    stock = stock.copy()
+    close = stock['close'].to_numpy(dtype='float64')
+    if boll is not None:
+        stock['boll_mid'], stock['boll_top'], stock['boll_bot'] = bollinger_bands(close, **boll)
+    if dmi is not None:
+        plus_di, minus_di, adx = directional_movement(stock['high'], stock['low'], close, **dmi)
+        stock['dmi_plus'], stock['dmi_minus'], stock['dmi_adx'] = plus_di, minus_di, adx
+        up, down = crossover(plus_di, minus_di)
+        stock['dmi_cross'] = up - down
+    if sma is not None:
+        fast, slow = moving_average(close, sma[0]), moving_average(close, sma[1])
+        stock['sma_fast'], stock['sma_slow'] = fast, slow
+        up, down = crossover(fast, slow)
+        stock['sma_cross'], stock['sma_crossdown'] = up - down, down
+    if trend:
+        from sma import trend_indicator
+        stock['trend'] = trend_indicator(close) if trend is True else trend_indicator(close, trend)
+    return stock
+
+# 以下指标直接使用IndicatorData中预先计算的数据线, 参数只用于确定minperiod, 与对应的backtrader指标相同
+class BollingerBands(bt.Indicator):
+    lines = ('mid', 'top', 'bot')
+    params = (('period', 20), ('devfactor', 2.0))
+
+    def __init__(self):
+        self.lines.mid = self.data.lines.boll_mid
+        self.lines.top = self.data.lines.boll_top
+        self.lines.bot = self.data.lines.boll_bot
+        self.addminperiod(self.p.period)
+
+class DMI(bt.Indicator):
+    lines = ('adx', 'plusDI', 'minusDI')
+    params = (('period', 14),)
+
+    def __init__(self):
+        self.lines.adx = self.data.lines.dmi_adx
+        self.lines.plusDI = self.data.lines.dmi_plus
+        self.lines.minusDI = self.data.lines.dmi_minus
+        # ADX在DI之后再平滑一次
+        self.addminperiod(2 * self.p.period)
+
+# 与 bt.indicators.CrossOver(dmi.plusDI, dmi.minusDI) 相同
+class DMICrossOver(bt.Indicator):
+    lines = ('crossover',)
+    params = (('period', 14),)
+
+    def __init__(self):
+        self.lines.crossover = self.data.lines.dmi_cross
+        self.addminperiod(self.p.period + 2)
+
+class SMA(bt.Indicator):
+    lines = ('sma',)
+    params = (('period', 5), ('line', 'sma_fast'))
+
+    def __init__(self):
+        self.lines.sma = getattr(self.data.lines, self.p.line)
+        self.addminperiod(self.p.period)
+
+# 与 bt.indicators.CrossOver(sma_fast, sma_slow) 相同
+class SMACrossOver(bt.Indicator):
+    lines = ('crossover',)
+    params = (('fast', 5), ('slow', 10))
+
+    def __init__(self):
+        self.lines.crossover = self.data.lines.sma_cross
+        self.addminperiod(max(self.p.fast, self.p.slow) + 1)
+
+# 与 bt.indicators.CrossDown(sma_fast, sma_slow) 相同
+class SMACrossDown(bt.Indicator):
+    lines = ('crossdown',)
+    params = (('fast', 5), ('slow', 10))
+
+    def __init__(self):
+        self.lines.crossdown = self.data.lines.sma_crossdown
+        self.addminperiod(max(self.p.fast, self.p.slow) + 1)
+
+# 与 sma.TrendIndicator 相同
+class TrendIndicator(bt.Indicator):
+    lines = ('TrendIndicator',)
+    params = dict(ma_periods=(3, 5, 10, 20, 60), )
+
+    def __init__(self):
+        self.lines.TrendIndicator = self.data.lines.trend
+        self.addminperiod(max(self.p.ma_periods))
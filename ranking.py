@@ -0,0 +1,123 @@
+# -*-coding:utf-8 -*-
+
+'''
+截面排序选股
+每个日期(或每个区间)一行, 每个股票一列, 用 argpartition 一次选出全部日期涨幅最大或最小的N个股票, 不对整个截面排序
+    * NaN和不可选的股票排在最后, 可选股票不足N个时对应位置的 chosen 为False
+    * 值相同时按列的先后顺序选, 结果与稳定排序后取前N个相同
+    * 可以按行业等分组, 每组各选N个
+
+Usage:
+    order, chosen = top_n(growth, n=20, largest=False)              # growth 形状为 (日期数, 代码数), 每个日期跌幅最大的20个
+    labels, order, chosen = top_n_by_group(growth, industry, n=5)   # 每个行业涨幅最大的5个, 形状为 (日期数, 行业数, 5)
+    frame = top_frame(close.pct_change(), n=10)                     # 日期×名次 的股票代码表
+'''
+
+import numpy as np
+import pandas as pd
+
+# 每行前n个最小的key的列号, 值相同时列号小的在前
+def _smallest(key, n):
+    rows, cols = key.shape
+    if n == 0 or rows == 0:
+        return np.zeros((rows, n), dtype='int64')
+    part = np.argpartition(key, n - 1, axis=1)[:, :n]
+    # 第n小的值, 小于它的全部入选, 等于它的按列号先后补足n个
+    threshold = np.take_along_axis(key, part, axis=1).max(axis=1)[:, None]
+    below = key < threshold
+    equal = key == threshold
+    need = n - below.sum(axis=1)[:, None]
+    mask = below | (equal & (np.cumsum(equal, axis=1) <= need))
+    idx = np.nonzero(mask)[1].reshape(rows, n)
+    # 只对选出的n个排序
+    order = np.argsort(np.take_along_axis(key, idx, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(idx, order, axis=1)
+
+# 每行选出最大或最小的n个
+def top_n(values, n, largest=True, valid=None):
+    """
+    Arguments:
+        values 	ndarray 	Y 	形状为 (日期数, 代码数) 的排序依据, 一维时视为一个日期
+        n 	int 	Y 	每个日期选出的股票数
+        largest 	bool 	N 	True选最大的n个, False选最小的n个
+        valid 	ndarray 	N 	可以入选的股票, 形状与values相同或为 (代码数,), 默认为全部; NaN总是不入选
+
+    Returns:
+        order 	ndarray 	Y 	形状为 (日期数, m) 的列号, 按名次排列, m = min(n, 代码数)
+        chosen 	ndarray 	Y 	形状与order相同, 对应位置是否为可选股票(可选股票不足n个时为False)
+    """
+    values = np.asarray(values, dtype='float64')
+    squeeze = values.ndim == 1
+    values = np.atleast_2d(values)
+    ok = ~np.isnan(values)
+    if valid is not None:
+        ok &= np.broadcast_to(np.asarray(valid, dtype='bool'), values.shape)
+    key = np.where(ok, -values if largest else values, np.inf)
+
+    order = _smallest(key, min(n, values.shape[1]))
+    chosen = np.take_along_axis(ok, order, axis=1)
+    return (order[0], chosen[0]) if squeeze else (order, chosen)
+
+# 按分组每行各选最大或最小的n个
+def top_n_by_group(values, groups, n, largest=True, valid=None):
+    """
+    Arguments:
+        values 	ndarray 	Y 	形状为 (日期数, 代码数) 的排序依据
+        groups 	array 	Y 	每个代码的分组, 如申万行业, 缺失的代码不入选
+        n 	int 	Y 	每个日期每组选出的股票数
+        largest 	bool 	N 	True选最大的n个, False选最小的n个
+        valid 	ndarray 	N 	可以入选的股票, 同 top_n
+
+    Returns:
+        labels 	ndarray 	Y 	分组名称, 已排序
+        order 	ndarray 	Y 	形状为 (日期数, 分组数, n) 的列号, 组内股票不足n个的部分为-1
+        chosen 	ndarray 	Y 	形状与order相同, 对应位置是否为可选股票
+    """
+    values = np.atleast_2d(np.asarray(values, dtype='float64'))
+    groups = pd.Series(np.asarray(groups, dtype='object'))
+    present = groups.notna().to_numpy()
+    labels = np.sort(groups[present].unique())
+    valid = np.ones(values.shape, dtype='bool') if valid is None else np.broadcast_to(np.asarray(valid, dtype='bool'), values.shape)
+
+    order = np.full((values.shape[0], len(labels), n), -1, dtype='int64')
+    chosen = np.zeros(order.shape, dtype='bool')
+    for g, label in enumerate(labels):
+        cols = np.flatnonzero(present & (groups.to_numpy() == label))
+        o, c = top_n(values[:, cols], n, largest, valid[:, cols])
+        order[:, g, :o.shape[1]] = cols[o]
+        chosen[:, g, :o.shape[1]] = c
+    return labels, order, chosen
+
+# 宽表每行的前n名, 返回 日期×名次 的代码表, 可选股票不足n个的位置为None
+def top_frame(frame, n, largest=True, valid=None, groups=None):
+    """
+    Arguments:
+        frame 	DataFrame 	Y 	行为日期, 列为代码
+        n 	int 	Y 	每个日期(每组)选出的股票数
+        largest 	bool 	N 	True选最大的n个, False选最小的n个
+        valid 	DataFrame/array 	N 	可以入选的股票
+        groups 	Series/dict 	N 	代码到分组的映射, 指定时列为 (分组, 名次)
+
+    Returns:
+        codes 	DataFrame 	Y 	每个日期入选的代码
+    """
+    codes = np.asarray(frame.columns, dtype='object')
+    valid = valid.reindex(index=frame.index, columns=frame.columns).fillna(False).to_numpy(dtype='bool') \
+            if isinstance(valid, pd.DataFrame) else valid
+    if groups is None:
+        order, chosen = top_n(frame.to_numpy(dtype='float64'), n, largest, valid)
+        return pd.DataFrame(np.where(chosen, codes[order], None), index=frame.index, dtype='object')
+
+    groups = pd.Series(groups).reindex(frame.columns).to_numpy()
+    labels, order, chosen = top_n_by_group(frame.to_numpy(dtype='float64'), groups, n, largest, valid)
+    out = np.where(chosen, codes[np.maximum(order, 0)], None).reshape(len(frame), -1)
+    columns = pd.MultiIndex.from_product([labels, range(n)], names=['group', 'rank'])
+    return pd.DataFrame(out, index=frame.index, columns=columns, dtype='object')
+
+# DataFrame中某一列最大或最小的n行, 不对全表排序
+# 值相同的行按原来的先后顺序, NaN的行排在最后, 与 sort_values(column, ascending=not largest, kind='stable').head(n) 相同
+# (sort_values 默认的 quicksort 不稳定, 值相同时的顺序不确定)
+def top_rows(df, column, n, largest=True):
+    values = df[column].to_numpy(dtype='float64')
+    order, _ = top_n(values, n, largest)
+    return df.iloc[order]
@@ -4,12 +4,84 @@ from __future__ import (absolute_import, division, print_function,
 import datetime  # For datetime objects
 import os  # To manage paths
 import backtrader as bt
+import numpy as np
 import pandas as pd
 import math
+import precomputed
+
+# 均线排列的秩相关系数: 各均线的值与周期的Spearman相关系数, 空头排列接近1, 多头排列接近-1
+# 增量累加的均线与逐个求和的结果可能相差最后几位, 相对误差在此范围内视为相等
+TIE_TOL = 1e-9
+
+def _rank(values):
+    # 平均秩, 与pandas的spearman一致
+    ranks = []
+    for v in values:
+        tol = TIE_TOL * abs(v)
+        ranks.append(sum(1.0 for w in values if w < v - tol) + (sum(1.0 for w in values if abs(w - v) <= tol) + 1.0) / 2.0)
+    return ranks
+
+def spearman(x, y):
+    """
+    Arguments:
+        x 	list 	Y 	均线周期
+        y 	list 	Y 	均线的值
+
+    Returns:
+        corr 	float 	Y 	Spearman秩相关系数, y中有NaN或全部相等时为NaN
+    """
+    if any(math.isnan(v) for v in y):
+        return float('nan')
+    rx, ry = _rank(x), _rank(y)
+    mx, my = sum(rx) / len(rx), sum(ry) / len(ry)
+    sxy = sum((a - mx) * (b - my) for a, b in zip(rx, ry))
+    sxx = sum((a - mx) ** 2 for a in rx)
+    syy = sum((b - my) ** 2 for b in ry)
+    if sxx == 0.0 or syy == 0.0:
+        return float('nan')
+    return sxy / math.sqrt(sxx * syy)
+
+# 整个序列一次计算, 可在回测前按股票预先计算
+def trend_indicator(close, ma_periods=(3, 5, 10, 20, 60)):
+    """
+    Arguments:
+        close 	array/Series 	Y 	收盘价
+        ma_periods 	tuple 	N 	均线周期
+
+    Returns:
+        trend 	ndarray/Series 	Y 	每根bar的秩相关系数, 不足最长周期时为NaN
+    """
+    values = np.asarray(close, dtype='float64')
+    n, k = len(values), len(ma_periods)
+
+    # 用累计和计算所有均线, 形状为 (bar数, 均线数)
+    csum = np.concatenate([[0.0], np.cumsum(values)])
+    smas = np.full((n, k), np.nan)
+    for j, period in enumerate(ma_periods):
+        if period <= n:
+            smas[period - 1:, j] = (csum[period:] - csum[:-period]) / period
+
+    # 每行均线值的平均秩
+    tol = TIE_TOL * np.abs(smas[:, :, None])
+    less = (smas[:, None, :] < smas[:, :, None] - tol).sum(axis=2)
+    equal = (np.abs(smas[:, None, :] - smas[:, :, None]) <= tol).sum(axis=2)
+    ry = less + (equal + 1.0) / 2.0
+    rx = np.asarray(_rank(list(ma_periods)))
+
+    dx = rx - rx.mean()
+    dy = ry - ry.mean(axis=1, keepdims=True)
+    syy = (dy ** 2).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        trend = (dy * dx).sum(axis=1) / np.sqrt((dx ** 2).sum() * syy)
+    trend[np.isnan(smas).any(axis=1) | (syy == 0.0)] = np.nan
+
+    if isinstance(close, pd.Series):
+        return pd.Series(trend, index=close.index, name='TrendIndicator')
+    return trend
 
 class TrendIndicator(bt.Indicator):
     lines = ('TrendIndicator', )  
-    params = dict(ma_periods=[3, 5, 10, 20, 60], )
+    params = dict(ma_periods=(3, 5, 10, 20, 60), )
 
     plotinfo = dict(plot   =True,
                     subplot=True,
@@ -17,19 +89,39 @@ class TrendIndicator(bt.Indicator):
                )  
 
     def __init__(self, *args, **kwargs):
-        self.addminperiod = max(self.p.ma_periods) + 1
+        # 最长的均线需要的bar数
+        self.addminperiod(max(self.p.ma_periods))
         super().__init__(*args, **kwargs)
+        self._sums = [0.0] * len(self.p.ma_periods)
+        self._values = None
+
+    # 每根bar加上新的收盘价, 减去移出窗口的收盘价
+    def _update(self):
+        close = self.data.close
+        for k, period in enumerate(self.p.ma_periods):
+            self._sums[k] += close[0]
+            if len(self.data) > period:
+                self._sums[k] -= close[-period]
+
+    def prenext(self):
+        self._update()
 
     def next(self):
-        smas = []
-        for period in self.p.ma_periods:
-            smas.append(math.fsum(self.data.close.get(size=period)) / period)
-        df = pd.DataFrame(dict(x=self.p.ma_periods, y=smas))
-        corr = df.corr(method='spearman')
-        self.lines.TrendIndicator[0] = corr.iloc[0][1]
+        self._update()
+        smas = [s / period for s, period in zip(self._sums, self.p.ma_periods)]
+        self.lines.TrendIndicator[0] = spearman(self.p.ma_periods, smas)
+
+    # runonce模式下对整个序列一次计算
+    def once(self, start, end):
+        # 每个值只依赖之前的bar, 对预加载的全部数据计算一次
+        if self._values is None or len(self._values) < end:
+            self._values = trend_indicator(self.data.close.array, self.p.ma_periods)
+        dst = self.lines.TrendIndicator.array
+        for i in range(start, end):
+            dst[i] = self._values[i]
         
 class SMAStrategy(bt.Strategy):
-    params = dict(stake=10, )
+    params = dict(stake=10, precomputed=False, )
 
     def log(self, txt, dt=None):
         ''' Logging function fot this strategy'''
@@ -45,19 +137,26 @@ class SMAStrategy(bt.Strategy):
         self.buyprice = None
         self.buycomm = None
 
-        # Add MovingAverageSimple indicators
-        self.sma5 = bt.indicators.SimpleMovingAverage(self.datas[0], period=5)
-        self.sma10 = bt.indicators.SimpleMovingAverage(self.datas[0], period=10)
-        
-        self.trend_indicator = TrendIndicator(self.data)    
+        if self.p.precomputed:
+            # 读取 precomputed.IndicatorData 中预先计算的均线和交叉信号, 需要 precompute(stock, sma=(5, 10), trend=True)
+            self.sma5 = precomputed.SMA(self.datas[0], period=5, line='sma_fast')
+            self.sma10 = precomputed.SMA(self.datas[0], period=10, line='sma_slow')
+            self.trend_indicator = precomputed.TrendIndicator(self.data)
+            self.buy_signal = precomputed.SMACrossOver(self.datas[0], fast=5, slow=10)
+            self.sell_signal = precomputed.SMACrossDown(self.datas[0], fast=5, slow=10)
+        else:
+            # Add MovingAverageSimple indicators
+            self.sma5 = bt.indicators.SimpleMovingAverage(self.datas[0], period=5)
+            self.sma10 = bt.indicators.SimpleMovingAverage(self.datas[0], period=10)
+            self.trend_indicator = TrendIndicator(self.data)
+            self.buy_signal = bt.indicators.CrossOver(self.sma5, self.sma10)
+            self.sell_signal = bt.indicators.CrossDown(self.sma5, self.sma10)
 
         # self.smas = []
         # for period in self.p.ma_periods:
         #     self.smas.append(bt.indicators.SimpleMovingAverage(self.datas[0], period=period))
         
 
-        self.buy_signal = bt.indicators.CrossOver(self.sma5, self.sma10)
-        self.sell_signal = bt.indicators.CrossDown(self.sma5, self.sma10)
         self.buy_signal.plotinfo.plot = False
         self.sell_signal.plotinfo.plot = False
 
@@ -0,0 +1,158 @@
+# -*-coding:utf-8 -*-
+
+'''
+止损/止盈信号
+对 (bar数, 股票数) 的二维价格一次计算全部股票的跟踪止损价和卖出信号, 也接受一维的Series/数组
+安装numba时编译逐bar逐股票的循环, 否则按bar循环、每根bar对所有股票做向量运算
+
+参数与backtrader策略中的含义相同:
+    * stop_loss 	止损比例, 价格低于 买入价*stop_loss 时卖出, 如0.95
+    * take_profit 	止盈比例, 价格达到 买入价*take_profit 时卖出, 如2.0
+    * trail_percent 	跟踪止损百分比, 价格低于 买入后最高价*(1-trail_percent) 时卖出, 如0.05
+None或0表示不使用该条件
+
+Usage:
+    ts = trailing_stop(data['close'], entries, discount=0.95)
+    exits = data['close'] < ts
+    exits = generate_exits(close, entries, stop_loss=0.95, take_profit=2.0, trail_percent=0.05)
+'''
+
+import numpy as np
+import pandas as pd
+
+from jit import compiled
+
+# 转为 (bar数, 股票数) 的二维数组, 并返回把结果恢复为原类型的函数
+def _as_2d(x, dtype='float64'):
+    values = np.asarray(x, dtype=dtype)
+    ndim = values.ndim
+    if ndim == 1:
+        values = values[:, None]
+
+    def wrap(result):
+        if ndim == 1:
+            result = result[:, 0]
+        if isinstance(x, pd.DataFrame):
+            return pd.DataFrame(result, index=x.index, columns=x.columns)
+        if isinstance(x, pd.Series):
+            return pd.Series(result, index=x.index, name=x.name)
+        return result
+
+    return np.ascontiguousarray(values), wrap
+
+# 逐bar计算, 内层遍历股票以顺序访问内存: 买入信号处重置为当前价格, 否则取最高价
+def _trailing_max_loop(price, entries):
+    n, m = price.shape
+    out = np.empty_like(price)
+    out[0] = price[0]
+    for i in range(1, n):
+        for j in range(m):
+            p = price[i, j]
+            peak = out[i - 1, j]
+            if entries[i, j] or p > peak or np.isnan(peak):
+                peak = p
+            out[i, j] = peak
+    return out
+
+def _trailing_max_numpy(price, entries):
+    out = np.empty_like(price)
+    out[0] = price[0]
+    for i in range(1, len(price)):
+        out[i] = np.where(entries[i], price[i], np.fmax(out[i - 1], price[i]))
+    return out
+
+# 逐bar模拟每个股票的持仓, 满足任一止损/止盈条件时产生卖出信号
+def _exits_loop(price, entries, stop_loss, take_profit, trail_percent):
+    n, m = price.shape
+    exits = np.zeros((n, m), dtype=np.bool_)
+    holding = np.zeros(m, dtype=np.bool_)
+    entry = np.zeros(m)
+    peak = np.zeros(m)
+    for i in range(n):
+        for j in range(m):
+            p = price[i, j]
+            if np.isnan(p):
+                continue
+            if holding[j]:
+                peak[j] = max(peak[j], p)
+                if ((stop_loss > 0.0 and p < entry[j] * stop_loss) or
+                        (take_profit > 0.0 and p >= entry[j] * take_profit) or
+                        (trail_percent > 0.0 and p < peak[j] * (1.0 - trail_percent))):
+                    exits[i, j] = True
+                    holding[j] = False
+            elif entries[i, j]:
+                holding[j] = True
+                entry[j] = p
+                peak[j] = p
+    return exits
+
+def _exits_numpy(price, entries, stop_loss, take_profit, trail_percent):
+    n, m = price.shape
+    exits = np.zeros((n, m), dtype=np.bool_)
+    holding = np.zeros(m, dtype=np.bool_)
+    entry = np.zeros(m)
+    peak = np.zeros(m)
+    for i in range(n):
+        p = price[i]
+        valid = ~np.isnan(p)
+        held = holding & valid
+        peak = np.where(held, np.fmax(peak, p), peak)
+        hit = np.zeros(m, dtype=np.bool_)
+        if stop_loss > 0.0:
+            hit |= p < entry * stop_loss
+        if take_profit > 0.0:
+            hit |= p >= entry * take_profit
+        if trail_percent > 0.0:
+            hit |= p < peak * (1.0 - trail_percent)
+        exits[i] = held & hit
+        # 卖出的bar不再买入, 与逐列循环一致
+        enter = ~holding & valid & entries[i]
+        holding = (holding & ~exits[i]) | enter
+        entry = np.where(enter, p, entry)
+        peak = np.where(enter, p, peak)
+    return exits
+
+# 没有numba时使用按bar向量化的实现
+_trailing_max = compiled(_trailing_max_loop, fallback=_trailing_max_numpy)
+_exits = compiled(_exits_loop, fallback=_exits_numpy)
+
+# 跟踪止损价: 买入信号处重置为当前价格, 之后为区间最高价, 再乘以discount
+def trailing_stop(price, entries, discount=0.95):
+    """
+    Arguments:
+        price 	Series/DataFrame/ndarray 	Y 	价格, 一维或 (bar数, 股票数)
+        entries 	同price 	Y 	买入信号, bool
+        discount 	float 	N 	止损价相对最高价的比例
+
+    Returns:
+        ts 	同price 	Y 	跟踪止损价, 与price类型和索引相同; price和entries形状不同时抛出ValueError
+    """
+    if np.shape(price) != np.shape(entries):
+        raise ValueError('price and entries shape mismatch: %s != %s' % (np.shape(price), np.shape(entries)))
+
+    values, wrap = _as_2d(price)
+    signals, _ = _as_2d(entries, dtype='bool')
+    if len(values) == 0:
+        return wrap(values)
+    return wrap(_trailing_max(values, signals) * discount)
+
+# 根据买入信号和止损/止盈参数生成卖出信号, 持仓期间只在第一次触发时卖出
+def generate_exits(price, entries, stop_loss=None, take_profit=None, trail_percent=None):
+    """
+    Arguments:
+        price 	Series/DataFrame/ndarray 	Y 	价格, 一维或 (bar数, 股票数), NaN表示停牌
+        entries 	同price 	Y 	买入信号, bool, 持仓期间的买入信号被忽略
+        stop_loss 	float 	N 	止损比例, 如0.95
+        take_profit 	float 	N 	止盈比例, 如2.0
+        trail_percent 	float 	N 	跟踪止损百分比, 如0.05
+
+    Returns:
+        exits 	同price 	Y 	卖出信号, bool; price和entries形状不同时抛出ValueError
+    """
+    if np.shape(price) != np.shape(entries):
+        raise ValueError('price and entries shape mismatch: %s != %s' % (np.shape(price), np.shape(entries)))
+
+    values, wrap = _as_2d(price)
+    signals, _ = _as_2d(entries, dtype='bool')
+    exits = _exits(values, signals, float(stop_loss or 0.0), float(take_profit or 0.0), float(trail_percent or 0.0))
+    return wrap(exits)
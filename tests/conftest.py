@@ -0,0 +1,101 @@
+# -*-coding:utf-8 -*-
+
+import os, sys
+import threading
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 本地假Tushare接口, 工作日开市, 每个交易日两只股票
+class FakePro(object):
+    """
+    Arguments:
+        empty 	set 	N 	返回空数据的交易日, 模拟尚未发布的数据
+        fail 	dict 	N 	(接口名, 交易日) 到失败次数的映射, 前几次调用抛出异常
+    """
+    codes = ('000001.SZ', '600000.SH')
+
+    def __init__(self, empty=(), fail=None):
+        self.empty = set(empty)
+        self.fail = dict(fail or {})
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _call(self, name, trade_date=None):
+        with self.lock:
+            self.calls.append((name, trade_date))
+            if self.fail.get((name, trade_date), 0) > 0:
+                self.fail[(name, trade_date)] -= 1
+                raise IOError('%s %s 请求失败' % (name, trade_date))
+
+    def count(self, name, trade_date=None):
+        return sum(1 for call in self.calls if call == (name, trade_date))
+
+    def trade_cal(self, start_date, end_date, exchange='SSE', is_open=1, fields=None):
+        self._call('trade_cal')
+        dates = pd.date_range(start_date, end_date, freq='D')
+        return pd.DataFrame({'exchange': exchange, 'cal_date': dates.strftime('%Y%m%d'),
+                             'is_open': (dates.dayofweek < 5).astype(int), 'pretrade_date': None})
+
+    def _frame(self, name, trade_date, **columns):
+        self._call(name, trade_date)
+        if trade_date in self.empty:
+            return pd.DataFrame(columns=['ts_code', 'trade_date'] + list(columns))
+        return pd.DataFrame(dict(ts_code=list(self.codes), trade_date=trade_date, **columns))
+
+    def daily(self, trade_date):
+        return self._frame('daily', trade_date, open=10.0, high=11.0, low=9.0, close=10.5, vol=1000.0)
+
+    def adj_factor(self, trade_date):
+        return self._frame('adj_factor', trade_date, adj_factor=1.0)
+
+    def daily_basic(self, trade_date):
+        return self._frame('daily_basic', trade_date, turnover_rate=1.0, pe=20.0)
+
+    def stock_basic(self, **kwargs):
+        self._call('stock_basic')
+        return pd.DataFrame({'ts_code': list(self.codes), 'name': ['平安银行', '浦发银行'],
+                             'market': '主板', 'list_date': '19910403'})
+
+    def namechange(self, **kwargs):
+        self._call('namechange')
+        return pd.DataFrame(columns=['ts_code', 'name', 'start_date', 'end_date', 'ann_date', 'change_reason'])
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # 记录重试等待时间, 不真正等待
+    import dataloader
+    delays = []
+    monkeypatch.setattr(dataloader.time, 'sleep', delays.append)
+    return delays
+
+# 在fp下写入本地行情目录: 交易日历、每日行情、除权系数和股票基本信息
+# 有除权、停牌、晚上市、ST和次新股; 返回代码和交易日
+def write_market(fp, n=30, days=80, seed=0):
+    import numpy as np
+    from trade_calendar import TradeCalendar
+    rng = np.random.default_rng(seed)
+    codes = ['%06d.SZ' % (i + 1) for i in range(n)]
+    dates = list(pd.bdate_range('2021-01-04', periods=days).strftime('%Y%m%d'))
+    os.makedirs(fp, exist_ok=True)
+    TradeCalendar(dates, start='20210101', end=dates[-1]).save(fp)
+
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.03, (days, n)), axis=0))
+    factor = np.cumprod(np.where(rng.random((days, n)) < 0.02, rng.uniform(1.01, 1.2, (days, n)), 1.0), axis=0)
+    listed = np.ones((days, n), dtype='bool')
+    for i in range(0, n, 7):
+        listed[20 + i:26 + i, i] = False    # 停牌
+    listed[:30, n - 1] = False              # 晚上市
+    for k, date in enumerate(dates):
+        rows = listed[k]
+        pd.DataFrame(dict(ts_code=codes, trade_date=date, open=close[k], high=close[k] * 1.02, low=close[k] * 0.98,
+                          close=close[k], vol=1000.0))[rows].to_csv(os.path.join(fp, date + '.csv'), index=False)
+        pd.DataFrame(dict(ts_code=codes, trade_date=date, adj_factor=factor[k]))[rows].to_csv(os.path.join(fp, 'adj_factor_' + date + '.csv'), index=False)
+
+    pd.DataFrame({'ts_code': codes,
+                  'name': ['ST股票%d' % i if i % 9 == 4 else '股票%d' % i for i in range(n)],
+                  'market': ['创业板' if i % 11 == 5 else '主板' for i in range(n)],
+                  'list_date': ['20200901' if i % 8 == 3 else '20100104' for i in range(n - 1)] + ['20210215']
+                  }).to_csv(os.path.join(fp, 'stock_basic.csv'), index=False)
+    return codes, dates
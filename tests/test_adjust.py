@@ -0,0 +1,91 @@
+# -*-coding:utf-8 -*-
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import adjust
+import dataloader
+from trade_calendar import TradeCalendar
+
+CODES = ['000001.SZ', '000002.SZ', '600000.SH']
+
+# 本地行情目录: 30个交易日, 有除权、停牌和新上市的股票
+def write_daily(fp, seed=0, days=30):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2021-01-04', periods=days).strftime('%Y%m%d')
+    os.makedirs(fp, exist_ok=True)
+    TradeCalendar(dates, start='20210101', end=dates[-1]).save(fp)
+    factor = np.ones(len(CODES))
+    for i, date in enumerate(dates):
+        factor *= np.where(rng.random(len(CODES)) < 0.1, rng.uniform(1.01, 1.2, len(CODES)), 1.0)
+        listed = np.array([True, i % 7 != 3, i >= 10])    # 第二个股票停牌, 第三个股票第10天上市
+        close = rng.uniform(5, 20, len(CODES))
+        pd.DataFrame(dict(ts_code=CODES, trade_date=date, open=close * 0.99, high=close * 1.02, low=close * 0.97,
+                          close=close, vol=rng.uniform(1e3, 1e4, len(CODES))))[listed].to_csv(os.path.join(fp, date + '.csv'), index=False)
+        pd.DataFrame(dict(ts_code=CODES, trade_date=date, adj_factor=factor))[listed].to_csv(os.path.join(fp, 'adj_factor_' + date + '.csv'), index=False)
+    return list(dates)
+
+def load(fp, start_date, end_date, adjust_fp=None):
+    datas = dataloader.get_daily_from_local(start_date=start_date, end_date=end_date, fp=fp, combined=False, adjust_fp=adjust_fp)
+    return datas.sort_values(['datetime', 'code']).reset_index(drop=True)
+
+def assert_same(frame, expected):
+    assert list(frame['code']) == list(expected['code'])
+    assert list(frame['datetime']) == list(expected['datetime'])
+    for field in ('open', 'high', 'low', 'close', 'volume'):
+        np.testing.assert_allclose(frame[field], expected[field], rtol=1e-12)
+
+# AdjustEngine 的全量和增量结果都与逐行 adjust_frame 相同
+def test_engine_matches_adjust_frame(tmp_path):
+    fp = str(tmp_path / 'daily')
+    dates = write_daily(fp)
+    datas, adj_factors = dataloader._read_daily_frames(dates[0], dates[-1], fp)
+    engine = adjust.AdjustEngine()
+    first = engine.adjust(datas[datas['trade_date'] <= dates[14]], adj_factors[adj_factors['trade_date'] <= dates[14]])
+    updated = engine.update(datas[datas['trade_date'] > dates[14]], adj_factors[adj_factors['trade_date'] > dates[14]])
+    full = adjust.AdjustEngine().adjust(datas, adj_factors)
+    for key in ('raw', 'factor', 'qfq', 'hfq'):
+        np.testing.assert_allclose(updated[key], full[key], rtol=1e-12)
+    assert first['dates'][-1] == dates[14]
+
+    window = adjust.AdjustEngine.window(full, dates[5], dates[20])
+    inside = datas[(datas['trade_date'] >= dates[5]) & (datas['trade_date'] <= dates[20])]
+    expected = adjust.adjust_frame(inside, adj_factors[(adj_factors['trade_date'] >= dates[5]) & (adj_factors['trade_date'] <= dates[20])],
+                                   code_col='ts_code', date_col='trade_date')
+    ci = window['codes'].get_indexer(expected['ts_code'])
+    di = window['dates'].get_indexer(expected['trade_date'])
+    np.testing.assert_allclose(window['qfq'][ci, di], expected[adjust.FIELDS].to_numpy(), rtol=1e-12)
+
+# get_daily_from_local 使用缓存(首次、命中、增量)时与 _format_daily 的 adjust_frame 路径相同
+def test_cached_loader_matches_adjust_frame(tmp_path):
+    fp, adjust_fp = str(tmp_path / 'daily'), str(tmp_path / 'adjusted')
+    dates = write_daily(fp)
+    assert_same(load(fp, '20210101', dates[14], adjust_fp), load(fp, '20210101', dates[14]))
+    assert_same(load(fp, '20210101', dates[14], adjust_fp), load(fp, '20210101', dates[14]))
+    assert_same(load(fp, dates[3], dates[-1], adjust_fp), load(fp, dates[3], dates[-1]))
+    assert sorted(os.listdir(adjust_fp)) == ['adjusted_%s.npz' % dates[14], 'adjusted_%s.npz' % dates[-1]]
+
+# 其他目录的缓存或开始日期晚于区间的缓存不会被使用
+def test_cache_checks_source_and_range(tmp_path):
+    fp, other, adjust_fp = str(tmp_path / 'daily'), str(tmp_path / 'other'), str(tmp_path / 'adjusted')
+    dates = write_daily(fp)
+    write_daily(other, seed=1)
+    load(other, '20210101', dates[-1], adjust_fp)
+    assert_same(load(fp, '20210101', dates[-1], adjust_fp), load(fp, '20210101', dates[-1]))
+    # 截止日期相同的缓存被覆盖, 另一个目录不会读到它
+    assert adjust.AdjustEngine(cache_fp=adjust_fp, source=other).latest() is None
+
+    later = str(tmp_path / 'later')
+    load(fp, dates[10], dates[-1], later)
+    assert adjust.AdjustEngine(cache_fp=later, source=fp).latest()['start_date'] == dates[10]
+    assert_same(load(fp, dates[2], dates[-1], later), load(fp, dates[2], dates[-1]))
+    assert adjust.AdjustEngine(cache_fp=later, source=fp).latest()['start_date'] == dates[2]
+
+# 区间内没有本地行情时给出明确的错误
+def test_empty_range(tmp_path):
+    fp = str(tmp_path / 'daily')
+    write_daily(fp)
+    with pytest.raises(ValueError, match='20220101'):
+        dataloader.get_adjusted_from_local('20220101', '20220131', fp=fp, adjust_fp=str(tmp_path / 'adjusted'))
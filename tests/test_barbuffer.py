@@ -0,0 +1,52 @@
+# -*-coding:utf-8 -*-
+
+import numpy as np
+
+from barbuffer import BarBuffer
+
+def bars(buffer, field='close'):
+    window = buffer.window()
+    return window[field].T.tolist(), window['datetime'].T.tolist()
+
+def test_push_keeps_last_k():
+    buffer = BarBuffer(['a', 'b'], ['close'], size=2)
+    buffer.push(20220104, [[1.0], [10.0]])
+    buffer.push(20220105, [[2.0], [np.nan]])    # b停牌, 不写入
+    buffer.push(20220106, [[3.0], [11.0]])
+    values, dates = bars(buffer)
+    assert values == [[2.0, 3.0], [10.0, 11.0]]
+    assert dates == [[20220105, 20220106], [20220104, 20220106]]
+
+# 保存后读取, 下一个交易日只写入新的bar, 与一直在内存中更新相同
+def test_save_load_merge(tmp_path):
+    fname = str(tmp_path / 'buffer.npz')
+    buffer = BarBuffer(['a', 'b'], ['close'], size=2)
+    buffer.push(20220104, [[1.0], [10.0]])
+    buffer.push(20220105, [[2.0], [20.0]])
+    buffer.save(fname)
+
+    # 当天重新计算的最后两个bar: a有新的bar, b停牌, c新上市; a的前一个bar被修正
+    today = BarBuffer(['a', 'b', 'c'], ['close'], size=2)
+    today.push(20220105, [[2.5], [20.0], [np.nan]])
+    today.push(20220106, [[3.0], [np.nan], [5.0]])
+
+    buffer = BarBuffer.load(fname)
+    buffer.merge(today)
+    values, dates = bars(buffer)
+    assert list(buffer.codes) == ['a', 'b', 'c']
+    assert dates == [[20220105, 20220106], [20220104, 20220105], [0, 20220106]]
+    assert values[0] == [2.5, 3.0] and values[1] == [10.0, 20.0] and values[2][1] == 5.0
+    # 再合并一次不变
+    before = buffer.window()
+    buffer.merge(today)
+    after = buffer.window()
+    np.testing.assert_array_equal(after['close'], before['close'])
+    np.testing.assert_array_equal(after['datetime'], before['datetime'])
+
+def test_concat_skips_empty_chunks():
+    a = BarBuffer(['a'], ['close'], size=2)
+    a.push(20220104, [[1.0]])
+    buffer = BarBuffer.concat([None, a, None])
+    assert list(buffer.codes) == ['a']
+    empty = BarBuffer.concat([None, None], fields=['close'])
+    assert len(empty.codes) == 0 and empty.fields == ['close'] and len(empty.last()) == 0
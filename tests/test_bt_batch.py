@@ -0,0 +1,105 @@
+# -*-coding:utf-8 -*-
+
+import math
+import numpy as np
+import pandas as pd
+import pytest
+import backtrader as bt
+
+from bt_batch import BatchBroker, CashBucket, isolate
+
+# 按收盘价用全部现金买入, 次日高开时成交金额超过现金, 订单以Margin拒绝
+class AllIn(bt.Sizer):
+    def _getsizing(self, comminfo, cash, data, isbuy):
+        if isbuy:
+            return math.floor(cash / data.close[0] / 100) * 100
+        return self.broker.getposition(data).size
+
+# 连涨两天买入, 持有3个bar后卖出, 记录每个订单的结果
+class Momentum(bt.Strategy):
+    def __init__(self):
+        self.log = []
+        self.held = 0
+
+    def notify_order(self, order):
+        if order.status in (order.Submitted, order.Accepted):
+            return
+        self.log.append((self.data.datetime.date(0), order.getstatusname(), order.isbuy(),
+                         order.executed.size, round(order.executed.price, 6), round(order.executed.comm, 6)))
+
+    def next(self):
+        if self.position:
+            self.held += 1
+            if self.held >= 3:
+                self.sell()
+        elif len(self.data) > 2 and self.data.close[0] > self.data.close[-1] > self.data.close[-2]:
+            self.held = 0
+            self.buy()
+
+# 随机游走的行情, 每隔几天跳空高开, 部分股票有停牌和晚上市
+def make_stocks(n=6, days=160, seed=7):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2021-01-04', periods=days)
+    stocks = []
+    for i in range(n):
+        close = 10 * np.exp(np.cumsum(rng.normal(0.004, 0.02, days)))
+        gap = np.where(rng.random(days) < 0.25, 1.06, 1.0)
+        open_ = np.r_[close[0], close[:-1]] * gap
+        stock = pd.DataFrame(dict(open=open_, high=np.maximum(open_, close) * 1.01,
+                                  low=np.minimum(open_, close) * 0.99, close=close,
+                                  volume=1e6, openinterest=0.0), index=dates)
+        if i % 2:
+            stock = stock.drop(stock.index[40 + i:50 + 2 * i])     # 停牌
+        if i % 3 == 2:
+            stock = stock.iloc[20 * i:]                             # 晚上市
+        stocks.append(stock)
+    return stocks
+
+def setup(cerebro, filler):
+    cerebro.addsizer(AllIn)
+    cerebro.broker.setcommission(0.00075)
+    if filler:
+        cerebro.broker.set_filler(bt.fillers.FixedSize(size=300))
+    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer)
+
+def run_single(stock, cash, filler):
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.adddata(bt.feeds.PandasData(dataname=stock))
+    cerebro.addstrategy(Momentum)
+    setup(cerebro, filler)
+    cerebro.broker.setcash(cash)
+    strat = cerebro.run()[0]
+    return strat.log, cerebro.broker.getvalue()
+
+def run_batch(stocks, cash, filler):
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.broker = BatchBroker()
+    for i, stock in enumerate(stocks):
+        cerebro.adddata(bt.feeds.PandasData(dataname=stock), name=str(i))
+        cerebro.addstrategy(isolate(Momentum, i, cash=cash))
+    setup(cerebro, filler)
+    cerebro.broker.setcash(cash * len(stocks))
+    strats = cerebro.run()
+    return [(strat.log, strat.broker.getvalue()) for strat in strats], cerebro.broker.getvalue()
+
+# 批量回测与逐个回测的订单(包括Margin拒绝和部分成交)和最终资金完全一致
+@pytest.mark.parametrize('filler', [False, True])
+def test_batch_matches_single(filler):
+    stocks = make_stocks()
+    batch, total = run_batch(stocks, 10000, filler)
+    singles = [run_single(stock, 10000, filler) for stock in stocks]
+
+    statuses = set()
+    for (log, value), (expected_log, expected_value) in zip(batch, singles):
+        assert log == expected_log
+        assert value == pytest.approx(expected_value, rel=1e-12)
+        statuses.update(entry[1] for entry in log)
+    assert total == pytest.approx(sum(value for _, value in singles), rel=1e-12)
+    # 数据确实覆盖了高开导致的资金不足
+    assert 'Margin' in statuses
+    if filler:
+        assert 'Partial' in statuses
+
+def test_bucket_requires_batch_broker():
+    with pytest.raises(TypeError):
+        CashBucket(bt.brokers.BackBroker(), None, 10000)
@@ -0,0 +1,59 @@
+# -*-coding:utf-8 -*-
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import contrarian
+import dataloader
+from universe import Universe
+from conftest import write_market
+
+@pytest.fixture(scope='module')
+def market(tmp_path_factory):
+    root = tmp_path_factory.mktemp('market')
+    fp = str(root / 'data' / 'daily')
+    codes, dates = write_market(fp)
+    prices = dataloader.get_log_prices_from_local(start_date=dates[0], end_date=dates[-1], fp=fp)
+    stock_basic = pd.read_csv(os.path.join(fp, 'stock_basic.csv'), dtype={'list_date':'str'})
+    weeks = contrarian.mondays(dates[0], dates[-1])
+    calendar = dataloader.get_trade_dates_from_local(start_date=weeks[0], end_date=weeks[-1], fp=fp)
+    return str(root), fp, codes, dates, prices, stock_basic, weeks, calendar
+
+def test_mondays():
+    assert contrarian.mondays('20210101', '20210118') == ['20210104', '20210111', '20210118']
+    assert contrarian.WEEKS[0] == '20210104' and contrarian.WEEKS[-1] == '20221226'
+
+# 起点范围内的格子, 持有期有停牌的格子结果为NaN
+def cells(weeks):
+    return [(start, s, h) for start in range(8) for s in range(1, 4) for h in range(1, 4) if start + s + h < len(weeks)]
+
+# 对数价格矩阵上的批量计算与逐个格子读取CSV的 contrarian_strategy 相同
+@pytest.mark.parametrize('loser', [True, False])
+@pytest.mark.parametrize('namechange', [False, True])
+def test_grid_matches_strategy(market, monkeypatch, loser, namechange):
+    root, fp, codes, dates, prices, stock_basic, weeks, calendar = market
+    monkeypatch.chdir(root)
+    universe = None
+    if namechange:
+        # 第3只股票在第3周戴帽, 第6周摘帽; 当前名称为ST的第5只股票在第4周之前名称正常
+        changes = pd.DataFrame(dict(ts_code=[codes[2], codes[2], codes[4], codes[4]],
+                                    name=['*ST三', '三号', '五号', 'ST股票4'],
+                                    start_date=[weeks[2], weeks[5], '20200101', weeks[3]]))
+        universe = Universe.build(stock_basic, weeks, namechange=changes)
+
+    grid = cells(weeks)
+    result = contrarian.contrarian_grid(prices, stock_basic, grid, calendar=calendar, loser=loser, universe=universe, weeks=weeks)
+    expected = [contrarian.contrarian_strategy(*cell, loser=loser, universe=universe, weeks=weeks) for cell in grid]
+    np.testing.assert_allclose(result, expected, rtol=1e-12, equal_nan=True)
+    # 单个格子有对数价格矩阵时走批量计算
+    single = contrarian.contrarian_strategy(*grid[-1], loser=loser, prices=prices, stock_basic=stock_basic,
+                                            calendar=calendar, universe=universe, weeks=weeks)
+    np.testing.assert_allclose(single, expected[-1], rtol=1e-12, equal_nan=True)
+
+# 超出起点范围的格子为 missing
+def test_out_of_range(market):
+    root, fp, codes, dates, prices, stock_basic, weeks, calendar = market
+    result = contrarian.contrarian_grid(prices, stock_basic, [(0, len(weeks), 1), (0, 1, 1)], calendar=calendar, weeks=weeks)
+    assert result[0] == 1.0 and np.isfinite(result[1])
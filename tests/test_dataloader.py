@@ -0,0 +1,153 @@
+# -*-coding:utf-8 -*-
+
+import os
+import pytest
+
+import dataloader
+from conftest import FakePro
+
+START, END = '20210104', '20210108'
+DATES = ['20210104', '20210105', '20210106', '20210107', '20210108']
+
+# 失败次数用完前按指数退避重试
+def test_call_api_backoff(sleeps):
+    pro = FakePro(fail={('daily', '20210104'): 3})
+    data = dataloader.call_api(pro.daily, retries=5, backoff=0.5, trade_date='20210104')
+    assert len(data) == 2
+    assert pro.count('daily', '20210104') == 4
+    assert sleeps == [0.5, 1.0, 2.0]
+
+# 超过重试次数后抛出最后一次的异常
+def test_call_api_retry_limit(sleeps):
+    pro = FakePro(fail={('daily', '20210104'): 10})
+    with pytest.raises(IOError):
+        dataloader.call_api(pro.daily, retries=3, backoff=1.0, trade_date='20210104')
+    assert pro.count('daily', '20210104') == 4
+    assert sleeps == [1.0, 2.0, 4.0]
+
+# 每次请求前都经过限速器, 包括重试
+def test_call_api_limiter(sleeps):
+    class Limiter(object):
+        acquired = 0
+        def acquire(self):
+            self.acquired += 1
+    limiter = Limiter()
+    pro = FakePro(fail={('daily', '20210104'): 2})
+    dataloader.call_api(pro.daily, limiter, retries=5, backoff=1.0, trade_date='20210104')
+    assert limiter.acquired == 3
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_iter_daily_retries_in_order(tmp_path, sleeps, workers):
+    pro = FakePro(fail={('daily', '20210105'): 2, ('adj_factor', '20210107'): 1})
+    days = list(dataloader.iter_daily(START, END, fp=str(tmp_path), pro=pro, workers=workers, retries=2, backoff=1.0))
+
+    assert [d[0] for d in days] == DATES
+    assert all(len(frame) == 2 for d in days for frame in d[1:])
+    assert pro.count('daily', '20210105') == 3
+    assert pro.count('adj_factor', '20210107') == 2
+    assert sorted(sleeps) == [1.0, 1.0, 2.0]
+    for trade_date in DATES:
+        for prefix in ('', 'adj_factor_', 'basic_'):
+            assert os.path.exists(os.path.join(str(tmp_path), prefix+trade_date+'.csv'))
+    assert not [f for f in os.listdir(str(tmp_path)) if f.endswith('.tmp')]
+
+def test_iter_daily_retry_limit(tmp_path, sleeps):
+    pro = FakePro(fail={('daily_basic', '20210106'): 10})
+    with pytest.raises(IOError):
+        list(dataloader.iter_daily(START, END, fp=str(tmp_path), pro=pro, retries=2, backoff=0.5))
+    assert pro.count('daily_basic', '20210106') == 3
+    assert sleeps == [0.5, 1.0]
+    # 失败的交易日不写入本地
+    assert not os.path.exists(os.path.join(str(tmp_path), '20210106.csv'))
+
+def test_get_daily(tmp_path, sleeps):
+    pro = FakePro(fail={('stock_basic', None): 1})
+    data = dataloader.get_daily(START, END, fp=str(tmp_path), pro=pro, workers=2, backoff=1.0)
+    assert len(data) == 2 * len(DATES)
+    assert data['name'].notna().all()
+    assert pro.count('stock_basic') == 2
+    assert sleeps == [1.0]
+
+def sync(fp, pro, **kwargs):
+    return dataloader.sync_daily(START, END, fp=str(fp), pro=pro, retries=0, backoff=0, **kwargs)
+
+def fetched(pro):
+    return sorted(d for name, d in pro.calls if name == 'daily')
+
+# 没有清单和本地文件时下载全部交易日, 并写入清单和交易日历
+def test_sync_without_manifest(tmp_path):
+    pro = FakePro()
+    assert sync(tmp_path, pro) == DATES
+    assert fetched(pro) == DATES
+    manifest = dataloader.load_manifest(str(tmp_path))
+    assert sorted(manifest) == DATES
+    assert all(entry['rows'] == 2 for entry in manifest.values())
+    for name in ('manifest.json', 'trade_calendar.csv', 'stock_basic.csv', 'namechange.csv'):
+        assert os.path.exists(os.path.join(str(tmp_path), name))
+
+# 清单中已完整下载的交易日不再请求, 交易日历也不再下载
+def test_sync_skips_complete_days(tmp_path):
+    sync(tmp_path, FakePro())
+    pro = FakePro()
+    assert sync(tmp_path, pro) == []
+    assert fetched(pro) == []
+    assert pro.count('trade_cal') == 0
+
+# 没有清单时以目录中三个文件齐全的交易日初始化, 只缺部分文件的交易日重新下载
+def test_sync_bootstraps_manifest(tmp_path):
+    sync(tmp_path, FakePro())
+    os.remove(os.path.join(str(tmp_path), 'manifest.json'))
+    os.remove(os.path.join(str(tmp_path), 'basic_20210106.csv'))
+    pro = FakePro()
+    assert sync(tmp_path, pro) == ['20210106']
+    assert fetched(pro) == ['20210106']
+
+# 收盘数据发布前下载的交易日视为过期, 重新下载
+def test_sync_refetches_stale_days(tmp_path):
+    sync(tmp_path, FakePro())
+    manifest = dataloader.load_manifest(str(tmp_path))
+    manifest['20210107']['fetched_at'] = '20210107 15:30:00'
+    manifest['20210108']['fetched_at'] = '20210108 18:00:00'
+    dataloader.save_manifest(str(tmp_path), manifest)
+
+    pro = FakePro()
+    assert sync(tmp_path, pro, publish_hour=18) == ['20210107']
+    assert fetched(pro) == ['20210107']
+    assert dataloader.load_manifest(str(tmp_path))['20210107']['fetched_at'] > '20210107 18:00:00'
+
+# 中途失败的交易日不记入清单, 重新运行时只下载这些交易日
+def test_sync_resumes_after_failure(tmp_path):
+    pro = FakePro(fail={('adj_factor', '20210106'): 1})
+    assert sync(tmp_path, pro) == ['20210104', '20210105', '20210107', '20210108']
+    assert '20210106' not in dataloader.load_manifest(str(tmp_path))
+    assert not os.path.exists(os.path.join(str(tmp_path), '20210106.csv'))
+
+    pro = FakePro()
+    assert sync(tmp_path, pro) == ['20210106']
+    assert fetched(pro) == ['20210106']
+    assert sorted(dataloader.load_manifest(str(tmp_path))) == DATES
+
+# 进程在写完文件、更新清单前被终止: 文件已存在但不在清单中的交易日重新下载
+def test_sync_resumes_after_crash(tmp_path):
+    sync(tmp_path, FakePro())
+    manifest = dataloader.load_manifest(str(tmp_path))
+    del manifest['20210108']
+    dataloader.save_manifest(str(tmp_path), manifest)
+    # 写到一半的临时文件不影响重新下载
+    with open(os.path.join(str(tmp_path), '20210108.csv.tmp'), 'w') as f:
+        f.write('ts_code,trade_')
+
+    pro = FakePro()
+    assert sync(tmp_path, pro) == ['20210108']
+    assert fetched(pro) == ['20210108']
+    assert not os.path.exists(os.path.join(str(tmp_path), '20210108.csv.tmp'))
+
+# 数据尚未发布的交易日(返回空表)写入文件但不记入清单, 下次同步时重新下载
+def test_sync_empty_days(tmp_path):
+    pro = FakePro(empty={'20210108'})
+    assert sync(tmp_path, pro) == DATES[:-1]
+    assert '20210108' not in dataloader.load_manifest(str(tmp_path))
+
+    pro = FakePro()
+    assert sync(tmp_path, pro) == ['20210108']
+    assert fetched(pro) == ['20210108']
@@ -0,0 +1,95 @@
+# -*-coding:utf-8 -*-
+
+import sys, types
+import numpy as np
+import pandas as pd
+import backtrader as bt
+import pytest
+
+import fastbt
+from panel import MarketPanel
+
+# backtest.py 导入的默认策略模块不在仓库中, 这里只替换策略, 不影响 run_backtest 的其余设置
+if 'oversell' not in sys.modules:
+    try:
+        import oversell
+    except ImportError:
+        sys.modules['oversell'] = types.SimpleNamespace(OversellStrategy=bt.Strategy)
+import backtest
+
+# 按给定的信号交易, 与 fastbt 的成交规则相同: 收盘下单, 跟踪止损与买单同时提交
+class SignalStrategy(bt.Strategy):
+    signals = {}
+    trail_percent = 0.0
+
+    def next(self):
+        entry, exit_ = self.signals[self.data.datetime.date(0)]
+        if self.position:
+            if exit_:
+                self.close()
+        elif entry and not any(o.alive() for o in self.broker.get_orders_open()):
+            size = backtest.AllInOut()._getsizing(None, self.broker.getcash(), self.data, True)
+            if size > 0:
+                self.buy(size=size)
+                if self.trail_percent > 0.0:
+                    self.sell(size=size, exectype=bt.Order.StopTrail, trailpercent=self.trail_percent)
+
+# 三个股票的面板: 随机游走, 有停牌; 第二个股票有一天只缺开盘价, 第三个股票没有任何交易
+def make_panel(days=250, seed=3):
+    rng = np.random.default_rng(seed)
+    codes = np.array(['000001.SZ', '000002.SZ', '600000.SH'])
+    dates = np.array([int(d.strftime('%Y%m%d')) for d in pd.bdate_range('2021-01-04', periods=days)], dtype='int32')
+    values = np.full((len(codes), days, 5), np.nan)
+    for i in range(len(codes)):
+        close = 10 * np.exp(np.cumsum(rng.normal(0.001, 0.02, days)))
+        open_ = np.r_[close[0], close[:-1]] * rng.uniform(0.97, 1.03, days)
+        values[i, :, 0] = open_
+        values[i, :, 1] = np.maximum(open_, close) * 1.01
+        values[i, :, 2] = np.minimum(open_, close) * rng.uniform(0.96, 0.99, days)
+        values[i, :, 3] = close
+        values[i, :, 4] = 1e6
+    values[0, 100:110] = np.nan
+    values[1, 60, 0] = np.nan
+    entries = rng.random((len(codes), days)) < 0.08
+    exits = rng.random((len(codes), days)) < 0.1
+    entries[2] = False
+    return MarketPanel(codes, dates, values), entries, exits
+
+def run_reference(panel, code, entries, exits, trail_percent, monkeypatch):
+    i = panel.code_loc(code)
+    dates = pd.to_datetime(panel.dates.astype('str'), format='%Y%m%d').date
+    signals = dict(zip(dates, zip(entries[i], np.zeros_like(entries[i]) if exits is None else exits[i])))
+    strategy = type('SignalStrategy', (SignalStrategy,), dict(signals=signals, trail_percent=trail_percent))
+    monkeypatch.setattr(backtest, 'SignalStrategy', strategy, raising=False)
+    monkeypatch.setitem(backtest.strategy, 'classname', 'SignalStrategy')
+    return backtest.run_backtest(code, panel.to_frame(code))
+
+# backtest_panel 与 backtest.py 的 run_backtest 逐个股票的结果一致
+@pytest.mark.parametrize('trail_percent,use_exits', [(0.0, True), (0.05, False)])
+def test_panel_matches_run_backtest(trail_percent, use_exits, monkeypatch):
+    panel, entries, exits = make_panel()
+    exits = exits if use_exits else None
+    summary = fastbt.backtest_panel(panel, entries, exits, trail_percent=trail_percent)
+
+    for code in panel.codes:
+        result = run_reference(panel, code, entries, exits, trail_percent, monkeypatch)
+        if result['row'] is None:
+            assert code not in summary.index
+            continue
+        row = summary.loc[code]
+        for field in fastbt.SUMMARY_FIELDS:
+            assert row[field] == pytest.approx(result['row'][field][0], rel=1e-9, abs=1e-9), field
+    # 没有交易的股票不在汇总表中, 与 backtest.py 的汇总表相同
+    assert '600000.SH' not in summary.index and len(summary) == 2
+
+# 没有已平仓交易时汇总值明确为0, 不是NaN
+def test_summary_without_trades():
+    close = np.linspace(10, 11, 20)
+    result = fastbt.backtest(close, np.zeros(20, dtype='bool'))
+    summary = result['summary']
+    assert summary['Trades'] == 0 and summary['PnL'] == 0.0
+    assert not any(np.isnan(summary[field]) for field in fastbt.SUMMARY_FIELDS)
+
+    panel, entries, _ = make_panel()
+    kept = fastbt.backtest_panel(panel, entries, keep_empty=True)
+    assert kept.loc['600000.SH', 'Trades'] == 0 and kept.loc['600000.SH', 'Win_Ratio'] == 0.0
@@ -0,0 +1,69 @@
+# -*-coding:utf-8 -*-
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataloader
+from growth import LogPrices
+from conftest import write_market
+
+@pytest.fixture(scope='module')
+def market(tmp_path_factory):
+    root = tmp_path_factory.mktemp('market')
+    fp = str(root / 'data' / 'daily')
+    codes, dates = write_market(fp)
+    prices = dataloader.get_log_prices_from_local(start_date=dates[0], end_date=dates[-1], fp=fp)
+    return str(root), fp, codes, dates, prices
+
+def read_adjusted(fp, date):
+    daily = pd.read_csv(os.path.join(fp, date + '.csv'))
+    factor = pd.read_csv(os.path.join(fp, 'adj_factor_' + date + '.csv'))
+    merged = pd.merge(daily, factor, on='ts_code')
+    return pd.Series((merged['close'] * merged['adj_factor']).to_numpy(), index=merged['ts_code'])
+
+# 矩阵中的值为后复权收盘价的对数, 停牌和上市前为NaN
+def test_matrix_matches_files(market):
+    root, fp, codes, dates, prices = market
+    assert list(prices.codes) == codes and list(prices.dates) == dates
+    for k in (0, 25, len(dates) - 1):
+        expected = read_adjusted(fp, dates[k]).reindex(codes)
+        np.testing.assert_allclose(np.exp(prices.values[:, k]), expected.to_numpy(), rtol=1e-12)
+
+# 多个区间一次计算, 非交易日取区间内的第一个和最后一个交易日, 没有交易日的区间为NaN
+def test_growth_intervals(market):
+    root, fp, codes, dates, prices = market
+    starts = ['20210102', dates[10], '20210109', '20220101']
+    ends = [dates[30], dates[40], '20210110', '20220201']
+    growth = prices.growth(starts, ends)
+    assert growth.shape == (4, len(codes))
+    expected = read_adjusted(fp, dates[30]).reindex(codes) / read_adjusted(fp, dates[0]).reindex(codes)
+    np.testing.assert_allclose(growth[0], expected.to_numpy(), rtol=1e-12)
+    assert np.isnan(growth[2:]).all()
+
+    i, j = prices.locate(starts, ends)
+    assert list(i) == [0, 10, -1, -1] and list(j) == [30, 40, -1, -1]
+    # 日历中的交易日不在矩阵中时同样为-1
+    i, j = prices.locate(['20210101'], ['20210105'], calendar=['20210101'] + dates)
+    assert list(i) == [-1]
+
+# 有对数价格矩阵时 calc_growth_from_local 与逐个读取CSV的结果相同
+def test_growth_frame_matches_csv(market, monkeypatch):
+    root, fp, codes, dates, prices = market
+    monkeypatch.chdir(root)
+    for start, end in [(dates[0], dates[-1]), ('20210109', dates[33])]:
+        expected = dataloader.calc_growth_from_local(start, end).sort_values('ts_code').reset_index(drop=True)
+        result = dataloader.calc_growth_from_local(start, end, prices=prices).sort_values('ts_code').reset_index(drop=True)
+        assert list(result['ts_code']) == list(expected['ts_code'])
+        for column in ('adj_price1', 'adj_price2', 'total_growth'):
+            np.testing.assert_allclose(result[column], expected[column], rtol=1e-12)
+        np.testing.assert_allclose(result['annual_growth'], expected['annual_growth'], atol=0.011)
+
+def test_save_load(market, tmp_path):
+    prices = market[-1]
+    fname = str(tmp_path / 'log_prices.npz')
+    prices.save(fname)
+    loaded = LogPrices.load(fname)
+    assert loaded.codes.equals(prices.codes) and loaded.dates.equals(prices.dates)
+    np.testing.assert_array_equal(loaded.values, prices.values)
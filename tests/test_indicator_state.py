@@ -0,0 +1,89 @@
+# -*-coding:utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import indicators
+from barbuffer import BarBuffer
+from panel import MarketPanel
+from indicator_state import IndicatorState
+
+# 与 daily_scan 的 CustomStrategy 相同
+TA = [{"kind": "sma", "length": 5}, {"kind": "sma", "length": 10}, {"kind": "sma", "length": 20}, {"kind": "sma", "length": 60},
+      {"kind": "bbands", "length": 20, "std": 3}, {"kind": "adx", "length": 14}, {"kind": "atr", "length": 14},
+      {"kind": "macd", "fast": 8, "slow": 21}]
+
+# 随机行情: 部分股票有一段一字板(最高=最低), 随机停牌, 部分股票中途上市
+@pytest.fixture(scope='module')
+def panel():
+    rng = np.random.default_rng(0)
+    m, n = 40, 400
+    close = np.round(10 * np.exp(np.cumsum(rng.normal(0, 0.02, (m, n)), axis=1)), 2)
+    high = np.round(close * (1 + rng.uniform(0, 0.03, (m, n))), 2)
+    low = np.round(close * (1 - rng.uniform(0, 0.03, (m, n))), 2)
+    high[:5, 100:140] = low[:5, 100:140] = close[:5, 100:140] = close[:5, 100:101]
+    values = np.stack([close, high, low, close, np.full((m, n), 1000.0)], axis=2)
+    values[rng.random((m, n)) < 0.05] = np.nan
+    for i in range(10, 20):
+        values[i, :rng.integers(50, 380)] = np.nan
+    dates = pd.bdate_range('2020-01-01', periods=n).strftime('%Y%m%d').astype(int).to_numpy()
+    return MarketPanel(['%06d.SZ' % i for i in range(m)], dates, values, fields=('open', 'high', 'low', 'close', 'volumn'))
+
+def windows(buffer, codes):
+    rows = [list(buffer.codes).index(code) for code in codes]
+    return {field: values[:, rows] for field, values in buffer.window().items()}
+
+def built(panel):
+    state = IndicatorState(TA)
+    state.extend(panel)
+    return state
+
+# 逐日递推的结果与在宽表上一次计算的结果相同
+def test_matches_full_computation(panel):
+    bars = indicators.stack_bars(panel)
+    result = indicators.strategy(bars, TA)
+    expected = BarBuffer.from_frames(result, bars['datetime'], size=2).window()
+    state = built(panel)
+    assert state.fields == list(result)
+    actual = windows(state.buffer, panel.codes)
+    np.testing.assert_array_equal(actual['datetime'], expected['datetime'])
+    for field in result:
+        np.testing.assert_allclose(actual[field], expected[field], rtol=1e-9, atol=1e-9, err_msg=field)
+
+# 保存后只追加新的交易日, 与一次计算全部交易日逐位相同; 之后只传入最近90天的面板也相同
+@pytest.mark.parametrize('split', [1, 60, 299, 398])
+def test_extend_matches_recompute(panel, tmp_path, split):
+    state = IndicatorState(TA)
+    state.extend(panel.between(panel.dates[0], panel.dates[split]))
+    state.save(str(tmp_path))
+
+    state = IndicatorState.load(str(tmp_path), TA)
+    stats = state.extend(panel.between(panel.dates[max(0, split - 90)], panel.dates[-1]))
+    assert stats == dict(dates=len(panel.dates) - split - 1, replayed=0)
+
+    expected = windows(built(panel).buffer, panel.codes)
+    actual = windows(state.buffer, panel.codes)
+    for field in expected:
+        np.testing.assert_array_equal(actual[field], expected[field], err_msg=field)
+
+# 历史行情变化(如前复权重新计算)的股票从面板的第一天重新计算
+def test_changed_history_is_replayed(panel, tmp_path):
+    state = built(panel.between(panel.dates[0], panel.dates[299]))
+    state.save(str(tmp_path))
+    values = np.array(panel.values)
+    values[:3, :, :4] *= 0.9
+    changed = MarketPanel(panel.codes, panel.dates, values, panel.fields)
+
+    state = IndicatorState.load(str(tmp_path), TA)
+    assert state.extend(changed)['replayed'] == 3
+    expected = windows(built(changed).buffer, panel.codes)
+    actual = windows(state.buffer, panel.codes)
+    for field in expected:
+        np.testing.assert_array_equal(actual[field], expected[field], err_msg=field)
+
+# 指标参数不同的缓存不会被读取
+def test_load_other_indicators(panel, tmp_path):
+    built(panel).save(str(tmp_path))
+    assert IndicatorState.load(str(tmp_path), TA[:2]) is None
+    assert IndicatorState.load(str(tmp_path), TA).last_date == panel.dates[-1]
@@ -0,0 +1,55 @@
+# -*-coding:utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import backtrader as bt
+import pytest
+
+import precomputed
+
+# 随机行情, 中间有一段停牌(价格不变), 用于检查均线相等时的交叉
+def make_stock(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    close = np.round(10 * np.exp(np.cumsum(rng.normal(0, 0.02, n))), 2)
+    close[200:230] = close[200]
+    high = np.round(close * (1 + rng.uniform(0, 0.03, n)), 2)
+    low = np.round(close * (1 - rng.uniform(0, 0.03, n)), 2)
+    return pd.DataFrame(dict(open=close, high=high, low=low, close=close, volume=1000.0, openinterest=0.0),
+                        index=pd.bdate_range('2018-01-01', periods=n))
+
+# 记录backtrader指标每个bar的值
+class Record(bt.Strategy):
+    def __init__(self):
+        boll = bt.indicators.BollingerBands(self.data, period=20, devfactor=2.0)
+        dmi = bt.indicators.DMI(self.data, period=14)
+        fast, slow = bt.indicators.SMA(self.data, period=5), bt.indicators.SMA(self.data, period=10)
+        self.lines_ = dict(boll_mid=boll.mid, boll_top=boll.top, boll_bot=boll.bot,
+                           dmi_plus=dmi.plusDI, dmi_minus=dmi.minusDI, dmi_adx=dmi.adx,
+                           dmi_cross=bt.indicators.CrossOver(dmi.plusDI, dmi.minusDI),
+                           sma_fast=fast, sma_slow=slow, sma_cross=bt.indicators.CrossOver(fast, slow),
+                           sma_crossdown=bt.indicators.CrossDown(fast, slow))
+
+def run(stock, runonce):
+    cerebro = bt.Cerebro(runonce=runonce, stdstats=False)
+    cerebro.adddata(bt.feeds.PandasData(dataname=stock))
+    cerebro.addstrategy(Record)
+    strat = cerebro.run()[0]
+    return {name: np.array(line.array[:len(stock)]) for name, line in strat.lines_.items()}
+
+# 预先计算的指标与backtrader逐位相同, minperiod之前的值不比较
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('runonce', [True, False])
+def test_precompute_matches_backtrader(seed, runonce):
+    stock = make_stock(seed=seed)
+    expected = run(stock, runonce)
+    actual = precomputed.precompute(stock, boll=dict(period=20, devfactor=2.0), dmi=dict(period=14), sma=(5, 10))
+    minperiod = dict(boll=20, dmi=2 * 14, sma=11)
+    for name, values in expected.items():
+        start = minperiod[name.split('_')[0]]
+        np.testing.assert_array_equal(actual[name].to_numpy()[start:], values[start:], err_msg=name)
+
+def test_crossover_equal_values():
+    # 相等时沿用之前的差值方向: 开始时相等再变大不算上穿, 1到0再到-1算下穿, -1到0再到1算上穿
+    up, down = precomputed.crossover([1, 1, 2, 1, 0, 1, 2], [1, 1, 1, 1, 1, 1, 1])
+    np.testing.assert_array_equal(up, [np.nan, 0, 0, 0, 0, 0, 1])
+    np.testing.assert_array_equal(down, [np.nan, 0, 0, 0, 1, 0, 0])
@@ -0,0 +1,82 @@
+# -*-coding:utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ranking
+
+# 两位小数的随机截面, 有大量并列值和NaN
+def make_values(rows=40, cols=50, seed=0):
+    rng = np.random.default_rng(seed)
+    values = np.round(rng.normal(0, 0.02, (rows, cols)), 2)
+    values[rng.random((rows, cols)) < 0.2] = np.nan
+    values[-1, :] = np.nan
+    return values
+
+# 稳定排序后取前n个, NaN和不可选的排在最后
+def reference(row, n, largest, ok):
+    key = np.where(ok, -row if largest else row, np.inf)
+    order = np.argsort(key, kind='stable')[:min(n, len(row))]
+    return order, ok[order]
+
+@pytest.mark.parametrize('largest', [True, False])
+@pytest.mark.parametrize('n', [0, 1, 7, 50, 60])
+def test_top_n_matches_stable_sort(largest, n):
+    values = make_values()
+    valid = np.random.default_rng(1).random(values.shape) < 0.8
+    for mask in (None, valid, valid[0]):
+        order, chosen = ranking.top_n(values, n, largest, valid=mask)
+        ok = ~np.isnan(values) & (True if mask is None else np.broadcast_to(mask, values.shape))
+        for i, row in enumerate(values):
+            expected_order, expected_chosen = reference(row, n, largest, ok[i])
+            np.testing.assert_array_equal(order[i], expected_order)
+            np.testing.assert_array_equal(chosen[i], expected_chosen)
+    # 一维时视为一个日期
+    order, chosen = ranking.top_n(values[0], n, largest)
+    np.testing.assert_array_equal(order, reference(values[0], n, largest, ~np.isnan(values[0]))[0])
+
+# 值相同的行保持原来的顺序, NaN的行在最后
+@pytest.mark.parametrize('largest', [True, False])
+def test_top_rows_matches_stable_sort_values(largest):
+    values = make_values(rows=1, cols=200)[0]
+    values[:3] = np.nan
+    df = pd.DataFrame(dict(ts_code=['%06d.SZ' % i for i in range(len(values))], total_growth=values),
+                      index=np.arange(len(values))[::-1])
+    for n in (5, 20, len(values)):
+        expected = df.sort_values('total_growth', ascending=not largest, kind='stable').head(n)
+        pd.testing.assert_frame_equal(ranking.top_rows(df, 'total_growth', n, largest=largest), expected)
+
+def test_top_n_by_group():
+    values = make_values()
+    groups = np.array(['银行', '医药', None, '电子', '医药'] * 10, dtype='object')
+    groups[-1] = '化工'     # 只有一个股票的分组
+    labels, order, chosen = ranking.top_n_by_group(values, groups, 3, largest=False)
+    assert list(labels) == sorted({g for g in groups if g is not None})
+    for g, label in enumerate(labels):
+        cols = np.flatnonzero(groups == label)
+        for i, row in enumerate(values):
+            expected_order, expected_chosen = reference(row[cols], 3, False, ~np.isnan(row[cols]))
+            m = len(expected_order)
+            np.testing.assert_array_equal(order[i, g, :m], cols[expected_order])
+            np.testing.assert_array_equal(chosen[i, g, :m], expected_chosen)
+            assert (order[i, g, m:] == -1).all() and not chosen[i, g, m:].any()
+
+def test_top_frame():
+    values = make_values(rows=5, cols=8)
+    frame = pd.DataFrame(values, index=pd.bdate_range('2021-01-04', periods=5), columns=list('abcdefgh'))
+    valid = pd.DataFrame(True, index=frame.index, columns=frame.columns[:6])     # g、h不可选
+    codes = ranking.top_frame(frame, 3, valid=valid)
+    for date, row in frame.iterrows():
+        expected = row[row.index[:6]].dropna().sort_values(ascending=False, kind='stable').index[:3]
+        assert [c for c in codes.loc[date] if c is not None] == list(expected)
+        assert codes.loc[date].isna().sum() == 3 - len(expected)
+
+    groups = dict(a='x', b='x', c='y', d='y', e='y', f='x', g='y', h='x')
+    codes = ranking.top_frame(frame, 2, largest=False, groups=groups)
+    assert list(codes.columns) == [('x', 0), ('x', 1), ('y', 0), ('y', 1)]
+    for date, row in frame.iterrows():
+        for label in ('x', 'y'):
+            members = row[[c for c in frame.columns if groups[c] == label]].dropna()
+            expected = list(members.sort_values(kind='stable').index[:2])
+            assert [c for c in codes.loc[date, label] if c is not None] == expected
@@ -0,0 +1,70 @@
+# -*-coding:utf-8 -*-
+
+from fractions import Fraction
+import numpy as np
+import pandas as pd
+import backtrader as bt
+import pytest
+
+import sma
+
+PERIODS = (3, 5, 10, 20, 60)
+
+# 两位小数的随机行情, 有5-9天的平盘(3日和5日均线相等)和一段长停牌(全部均线相等)
+def make_stock(n=500, seed=1):
+    rng = np.random.default_rng(seed)
+    close = np.round(10 * np.exp(np.cumsum(rng.normal(0, 0.02, n))), 2)
+    for start in range(80, 400, 37):
+        close[start:start + 5 + start % 5] = close[start]
+    close[420:490] = close[420]
+    return pd.DataFrame(dict(open=close, high=close, low=close, close=close, volume=1000.0, openinterest=0.0),
+                        index=pd.bdate_range('2018-01-01', periods=n))
+
+# 原来的实现: 每根bar求各均线, 再用DataFrame的spearman相关系数; 均线用分数精确计算, 相等的均线就是并列
+def reference(close, periods=PERIODS):
+    values = [Fraction(v) for v in close]
+    out = np.full(len(close), np.nan)
+    for i in range(max(periods) - 1, len(close)):
+        smas = [float(sum(values[i - p + 1:i + 1]) / p) for p in periods]
+        out[i] = pd.DataFrame(dict(x=list(periods), y=smas)).corr(method='spearman').iloc[0, 1]
+    return out
+
+class Record(bt.Strategy):
+    def __init__(self):
+        self.trend = sma.TrendIndicator(self.data)
+
+    def stop(self):
+        self.values = np.array(self.trend.lines.TrendIndicator.array)
+
+@pytest.fixture(scope='module')
+def stock():
+    return make_stock()
+
+@pytest.fixture(scope='module')
+def expected(stock):
+    return reference(stock['close'].to_numpy())
+
+def assert_trend(values, expected):
+    ready = slice(max(PERIODS) - 1, None)
+    np.testing.assert_array_equal(np.isnan(values[ready]), np.isnan(expected[ready]))
+    np.testing.assert_allclose(values[ready], expected[ready], rtol=0, atol=1e-12)
+
+def test_fixture_has_ties(stock, expected):
+    close = stock['close'].to_numpy()
+    sma3 = pd.Series(close).rolling(3).mean().to_numpy()
+    sma5 = pd.Series(close).rolling(5).mean().to_numpy()
+    # 有并列的bar, 其中部分累加的均线只差最后几位, 也有全部均线相等(NaN)的bar
+    assert (np.abs(sma3 - sma5) <= sma.TIE_TOL * sma5)[60:].sum() > 10
+    assert np.isnan(expected[60:]).any()
+
+def test_vectorized_matches_reference(stock, expected):
+    assert_trend(sma.trend_indicator(stock['close']).to_numpy(), expected)
+    assert_trend(sma.trend_indicator(stock['close'].to_numpy(), list(PERIODS)), expected)
+
+@pytest.mark.parametrize('runonce', [True, False])
+def test_indicator_matches_reference(stock, expected, runonce):
+    cerebro = bt.Cerebro(runonce=runonce, stdstats=False)
+    cerebro.adddata(bt.feeds.PandasData(dataname=stock))
+    cerebro.addstrategy(Record)
+    strat = cerebro.run()[0]
+    assert_trend(strat.values, expected)
@@ -0,0 +1,41 @@
+# -*-coding:utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import stops
+
+def make_prices(n=300, m=8, seed=0):
+    rng = np.random.default_rng(seed)
+    price = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, (n, m)), axis=0))
+    price[50:60, m - 1] = np.nan    # 停牌
+    entries = rng.random((n, m)) < 0.05
+    return price, entries
+
+# 编译的逐股票循环与没有numba时的按bar向量化实现相同
+def test_loop_matches_numpy():
+    price, entries = make_prices()
+    np.testing.assert_array_equal(stops._trailing_max_loop(price, entries), stops._trailing_max_numpy(price, entries))
+    for params in [(0.95, 0.0, 0.0), (0.0, 1.2, 0.0), (0.0, 0.0, 0.05), (0.9, 1.5, 0.05)]:
+        np.testing.assert_array_equal(stops._exits_loop(price, entries, *params), stops._exits_numpy(price, entries, *params))
+        np.testing.assert_array_equal(stops._exits(price, entries, *params), stops._exits_numpy(price, entries, *params))
+
+def test_series_and_frame():
+    price, entries = make_prices(m=2)
+    index = pd.bdate_range('2021-01-04', periods=len(price))
+    close = pd.Series(price[:, 0], index=index, name='close')
+    ts = stops.trailing_stop(close, entries[:, 0], discount=0.95)
+    assert isinstance(ts, pd.Series) and ts.index.equals(index)
+    np.testing.assert_allclose(ts.to_numpy(), stops._trailing_max_numpy(price[:, :1], entries[:, :1])[:, 0] * 0.95)
+
+    frame = pd.DataFrame(price, index=index, columns=['a', 'b'])
+    exits = stops.generate_exits(frame, entries, trail_percent=0.05)
+    assert isinstance(exits, pd.DataFrame) and list(exits.columns) == ['a', 'b']
+
+def test_shape_mismatch():
+    price, entries = make_prices()
+    with pytest.raises(ValueError, match='shape mismatch'):
+        stops.trailing_stop(price, entries[1:])
+    with pytest.raises(ValueError, match='shape mismatch'):
+        stops.generate_exits(price[:, 0], entries, stop_loss=0.95)
@@ -0,0 +1,75 @@
+# -*-coding:utf-8 -*-
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataloader
+from trade_calendar import TradeCalendar
+
+# 2021-01-01 至 2021-01-10, 元旦和周末休市
+DATES = ['20210104', '20210105', '20210106', '20210107', '20210108']
+
+@pytest.fixture
+def calendar():
+    return TradeCalendar(DATES, start='20210101', end='20210110')
+
+def test_next_prev(calendar):
+    assert calendar.next('20210102') == '20210104'
+    assert calendar.prev('20210102') is None
+    assert calendar.prev('20210109') == '20210108'
+    assert calendar.next('20210109') is None
+    assert calendar.next('20210105', inclusive=False) == '20210106'
+    assert calendar.prev('20210105', inclusive=False) == '20210104'
+    assert list(calendar.next(['20210101', '2021-01-05', '20210110'])) == ['20210104', '20210105', None]
+
+def test_nearest(calendar):
+    assert calendar.nearest('20210103') is None
+    assert calendar.nearest('20210103', direction='foreward') == '20210104'
+    # 前后距离相同时取之前的交易日
+    assert calendar.nearest('20210103', direction='both') == '20210104'
+    assert calendar.nearest('20210110', direction='both') == '20210108'
+    assert calendar.nearest('20210110', direction='foreward') is None
+    assert TradeCalendar([]).nearest('20210104', direction='both') is None
+
+def test_offset_range_count(calendar):
+    assert calendar.offset('20210106', -2) == '20210104'
+    assert calendar.offset('20210109', 0) == '20210108'
+    assert calendar.offset('20210106', 5) is None
+    assert list(calendar.range('20210102', '20210106')) == DATES[:3]
+    assert len(calendar.range('20210109', '20210110')) == 0
+    assert calendar.count('20210101', '20210110') == 5
+    assert '20210105' in calendar and '20210109' not in calendar
+
+# 保存后读取的日历相同, 文件更新后重新读取
+def test_save_load(calendar, tmp_path):
+    fp = str(tmp_path)
+    calendar.save(fp)
+    frame = pd.read_csv(os.path.join(fp, 'trade_calendar.csv'), dtype={'cal_date':'str', 'pretrade_date':'str'})
+    assert len(frame) == 10 and frame['is_open'].sum() == 5
+    assert pd.isna(frame.set_index('cal_date').loc['20210104', 'pretrade_date'])
+
+    loaded = TradeCalendar.from_local(fp)
+    assert list(loaded.range()) == DATES and (loaded.start, loaded.end) == ('20210101', '20210110')
+    assert TradeCalendar.from_local(fp) is loaded
+
+    later = TradeCalendar(['20210111', '20210112'], start='20210111', end='20210117')
+    calendar.merge(later).save(fp)
+    reloaded = TradeCalendar.from_local(fp)
+    assert reloaded.last == '20210112' and reloaded.end == '20210117'
+    assert TradeCalendar.from_local(str(tmp_path / 'missing')) is None
+
+# 该方向没有交易日时给出带日期的错误, 而不是 strptime(None) 的TypeError
+def test_nearest_date_out_of_range(calendar):
+    assert dataloader.nearest_date(calendar, '20210103', direction='foreward') == '20210104'
+    assert dataloader.nearest_date(DATES, '2021-01-09', date_format='%Y-%m-%d') == '2021-01-08'
+    with pytest.raises(ValueError, match='20210103'):
+        dataloader.nearest_date(calendar, '20210103')
+    with pytest.raises(ValueError, match='20210110'):
+        dataloader.nearest_date(calendar, '20210110', direction='foreward')
+
+def test_calc_growth_without_calendar(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(FileNotFoundError, match='trade_calendar.csv'):
+        dataloader.calc_growth_from_local('20210101', '20210110')
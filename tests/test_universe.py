@@ -0,0 +1,111 @@
+# -*-coding:utf-8 -*-
+
+import os
+import numpy as np
+import pandas as pd
+
+import dataloader
+from universe import Universe
+
+# 2021-01-04 起的工作日, 其中 20210106 休市
+DATES = [d for d in pd.bdate_range('2021-01-04', periods=12).strftime('%Y%m%d') if d != '20210106']
+
+STOCK_BASIC = pd.DataFrame(dict(
+    ts_code=['000001.SZ', '000002.SZ', '300001.SZ', '600000.SH', '600001.SH'],
+    name=['平安银行', 'ST万科', '特锐德', '浦发银行', '*ST邯钢'],
+    market=['主板', '主板', '创业板', '主板', '主板'],
+    list_date=['19910403', '20200107', '20091030', '20200104', None],
+))
+
+# 更名历史: 000001.SZ 在休市日戴帽、之后摘帽; 000002.SZ 在第一个交易日之前已是ST, 之后摘帽;
+# 600001.SH 同一天有两条记录; 300001.SZ 和 600000.SH 没有记录, 按当前名称
+NAMECHANGE = pd.DataFrame(dict(
+    ts_code=['000001.SZ', '000001.SZ', '000002.SZ', '000002.SZ', '600001.SH', '600001.SH', '999999.SZ'],
+    name=['ST平安', '平安银行', 'ST万科', '万科A', '邯郸钢铁', '*ST邯钢', 'ST其他'],
+    start_date=['20210106', '20210112', '20150101', '20210108', '20210111', '20210111', '20210105'],
+))
+
+# 逐个交易日按当天已知的信息判断
+def reference(date):
+    result = {}
+    for _, row in STOCK_BASIC.iterrows():
+        known = NAMECHANGE[(NAMECHANGE['ts_code'] == row['ts_code']) & (NAMECHANGE['start_date'] <= date)]
+        name = known['name'].iloc[-1] if len(known) else row['name']
+        cutoff = (pd.Timestamp(date) - pd.Timedelta(days=365)).strftime('%Y%m%d')
+        ipo = pd.notna(row['list_date']) and row['list_date'] < cutoff
+        result[row['ts_code']] = dict(main='主板' in row['market'], st='ST' not in name, ipo=ipo)
+    return result
+
+def test_masks_are_point_in_time():
+    universe = Universe.build(STOCK_BASIC, DATES, namechange=NAMECHANGE)
+    assert list(universe.codes) == sorted(STOCK_BASIC['ts_code'])
+    for j, date in enumerate(DATES):
+        expected = reference(date)
+        for rule in ('main', 'st', 'ipo'):
+            assert universe.masks[rule][:, j].tolist() == [expected[code][rule] for code in universe.codes], (date, rule)
+        assert universe.mask()[:, j].tolist() == [all(expected[code].values()) for code in universe.codes]
+
+def test_st_cases():
+    universe = Universe.build(STOCK_BASIC, DATES, namechange=NAMECHANGE)
+    st = pd.DataFrame(~universe.masks['st'], index=universe.codes, columns=universe.dates)
+    # 休市日的更名从下一个交易日生效
+    assert list(st.loc['000001.SZ', ['20210105', '20210107', '20210111', '20210112']]) == [False, True, True, False]
+    # 早于第一个交易日的更名记在第一个交易日
+    assert list(st.loc['000002.SZ', ['20210104', '20210107', '20210108']]) == [True, True, False]
+    # 同一天的多条记录保留最后一条
+    assert list(st.loc['600001.SH', ['20210108', '20210111']]) == [True, True]
+    assert not st.loc['600000.SH'].any() and not st.loc['300001.SZ'].any()
+
+    # 没有更名历史时全部按当前名称
+    current = Universe.build(STOCK_BASIC, DATES)
+    assert (~current.masks['st']).sum(axis=1).tolist() == [0, len(DATES), 0, 0, len(DATES)]
+
+# 上市日期恰好为 date - ipo_days 时不满足, 早一天时满足
+def test_ipo_cutoff():
+    # 20210104 - 365天 = 20200105 (2020年为闰年)
+    dates = ['20210104']
+    exact = Universe.build(STOCK_BASIC.assign(list_date=['20200105', '20200104', '20200106', '20200103', None]), dates)
+    assert exact.masks['ipo'][:, 0].tolist() == [False, True, False, True, False]
+    # 000002.SZ 20200107 上市, 20210106(休市, 恰好365天)之后的第一个交易日开始满足
+    universe = Universe.build(STOCK_BASIC, DATES)
+    ipo = pd.DataFrame(universe.masks['ipo'], index=universe.codes, columns=universe.dates)
+    assert list(ipo.loc['000002.SZ', ['20210104', '20210105', '20210107']]) == [False, False, True]
+    assert ipo.loc['600000.SH'].all() and not ipo.loc['600001.SH'].any()
+    # ipo_days 可以调整
+    assert not Universe.build(STOCK_BASIC, DATES, ipo_days=400).masks['ipo'][1].any()
+
+def test_at_and_members():
+    universe = Universe.build(STOCK_BASIC, DATES, namechange=NAMECHANGE)
+    full = universe.mask()
+    # 非交易日使用之前最近一个交易日, 第一个交易日之前和不在股票池中的代码为False
+    np.testing.assert_array_equal(universe.at('20210106'), full[:, DATES.index('20210105')])
+    np.testing.assert_array_equal(universe.at('20210109'), full[:, DATES.index('20210108')])
+    assert not universe.at('20210101').any()
+    codes = ['600000.SH', '999999.SZ', '000001.SZ']
+    mask = universe.at(['20210105', '20210112'], codes)
+    assert mask.shape == (2, 3)
+    assert mask.tolist() == [[True, False, True], [True, False, True]]
+    assert universe.at('20210107', codes, rules=('main',)).tolist() == [True, False, True]
+
+    assert list(universe.members('20210107')) == ['600000.SH']
+    assert list(universe.members('20210112')) == ['000001.SZ', '000002.SZ', '600000.SH']
+
+def test_save_load_and_local(tmp_path):
+    universe = Universe.build(STOCK_BASIC, DATES, namechange=NAMECHANGE)
+    fname = str(tmp_path / 'cache' / 'universe.npz')
+    universe.save(fname)
+    loaded = Universe.load(fname)
+    assert loaded.codes.equals(universe.codes) and loaded.dates.equals(universe.dates)
+    for rule in universe.masks:
+        np.testing.assert_array_equal(loaded.masks[rule], universe.masks[rule])
+
+    # 由本地的交易日历、股票基本信息和 namechange.csv 构建, 结果相同
+    from trade_calendar import TradeCalendar
+    fp = str(tmp_path / 'daily')
+    os.makedirs(fp)
+    TradeCalendar(DATES, start='20210101', end=DATES[-1]).save(fp)
+    STOCK_BASIC.to_csv(os.path.join(fp, 'stock_basic.csv'), index=False)
+    NAMECHANGE.to_csv(os.path.join(fp, 'namechange.csv'), index=False)
+    local = dataloader.get_universe_from_local(start_date=DATES[0], end_date=DATES[-1], fp=fp)
+    for rule in universe.masks:
+        np.testing.assert_array_equal(local.masks[rule], universe.masks[rule])
@@ -0,0 +1,42 @@
+# -*-coding:utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+vbt = pytest.importorskip('vectorbt')
+pytest.importorskip('pandas_ta')
+
+import vbt_sweep
+from stops import trailing_stop
+
+# 两个股票的宽表行情
+def make_prices(n=250, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range('2021-01-04', periods=n, name='datetime')
+    columns = pd.Index(['000001.SZ', '600000.SH'], name='code')
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, (n, 2)), axis=0))
+    high = close * (1 + rng.uniform(0, 0.03, (n, 2)))
+    low = close * (1 - rng.uniform(0, 0.03, (n, 2)))
+    return {field: pd.DataFrame(values, index=index, columns=columns) for field, values in (('high', high), ('low', low), ('close', close))}
+
+# 参数扫描中 length=14, ADX>25, DMP<10 的列与 vbt_dmi.py 对单个股票的回测相同
+def test_dmi_column_matches_vbt_dmi():
+    prices = make_prices()
+    grid = dict(lengths=[7, 14], adx_levels=[20.0, 25.0], dmp_levels=[10.0])
+    _, entries, exits = vbt_sweep.dmi_signals(prices, **grid)
+    result = vbt_sweep.sweep(prices, 'dmi', grid, memory=1024)
+    assert len(result) == 2 * 2 * 2
+
+    for code in prices['close'].columns:
+        data = {field: frame[code] for field, frame in prices.items()}
+        adx = vbt.IndicatorFactory.from_pandas_ta('ADX').run(low=data['low'], high=data['high'], close=data['close'])
+        expected = (adx.dmp_below(10.0)) | (adx.adx_above(25.0) & adx.dmp_crossed_above(adx.dmn))
+        expected_exits = data['close'] < trailing_stop(data['close'], expected, discount=0.95)
+        pf = vbt.Portfolio.from_signals(data['close'], expected, expected_exits, **vbt_sweep.PF_KWARGS)
+
+        column = (14, 25.0, 10.0, code)
+        np.testing.assert_array_equal(entries[column].to_numpy(), expected.to_numpy())
+        np.testing.assert_array_equal(exits[column].to_numpy(), expected_exits.to_numpy())
+        assert result.loc[column, 'total_return'] == pytest.approx(pf.total_return())
+        assert result.loc[column, 'trades'] == pf.trades.count()
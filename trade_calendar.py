@@ -0,0 +1,178 @@
+# -*-coding:utf-8 -*-
+
+'''
+交易日历
+交易日保存为已排序的int数组(格式20211231), 前后最近的交易日、向前向后第N个交易日、区间内的交易日都用二分查找, 不再转换日期或逐个比较
+本地的 trade_calendar.csv 每个进程只读取一次, 文件更新后自动重新读取
+日历记录已覆盖的自然日区间(start, end), 更新时只需下载区间之外的部分, 见 dataloader.get_trade_calendar
+
+Usage:
+    calendar = TradeCalendar.from_local('./data/daily/')
+    calendar.next('20210102')                      # 当天或之后的第一个交易日, '20210104'
+    calendar.prev('20210102')                      # 当天或之前的最后一个交易日, '20201231'
+    calendar.nearest('20210102', direction='both')
+    calendar.offset('20210104', -5)                # 向前第5个交易日
+    calendar.range('20210101', '20211231')         # 区间内的全部交易日
+'''
+
+import os
+import numpy as np
+import pandas as pd
+
+# 每个文件读取一次, 以 (修改时间, 大小) 判断是否需要重新读取
+_LOCAL = {}
+
+# 日期转为int, 支持str, int, datetime和数组
+def to_int(dates):
+    if isinstance(dates, (pd.Timestamp, np.datetime64)) or hasattr(dates, 'strftime'):
+        return int(pd.Timestamp(dates).strftime('%Y%m%d'))
+    values = np.asarray(dates)
+    if values.size == 0:
+        return np.zeros(values.shape, dtype='int32')
+    if np.issubdtype(values.dtype, np.datetime64):
+        return pd.DatetimeIndex(values.ravel()).strftime('%Y%m%d').astype('int32').to_numpy().reshape(values.shape)
+    if values.dtype.kind in 'iu':
+        return values.astype('int32')
+    # 字符串可以是 20211231 或 2021-12-31
+    return np.char.replace(values.astype('str'), '-', '').astype('int32')
+
+# int日期转为自然日序号
+def to_days(dates):
+    dates = np.asarray(dates)
+    days = pd.to_datetime(dates.ravel().astype('str'), format='%Y%m%d').to_numpy().astype('datetime64[D]').astype('int64')
+    return days.reshape(dates.shape)
+
+class TradeCalendar(object):
+    """
+    Arguments:
+        dates 	array 	Y 	交易日, str或int, 格式20211231
+        start 	str 	N 	已覆盖的第一个自然日, 默认为第一个交易日
+        end 	str 	N 	已覆盖的最后一个自然日, 默认为最后一个交易日
+    """
+    def __init__(self, dates, start=None, end=None):
+        self.dates = np.unique(to_int(np.asarray(dates).ravel())).astype('int32')
+        self.start = str(start) if start is not None else self.first
+        self.end = str(end) if end is not None else self.last
+        # 自然日序号, 只在 nearest(direction='both') 比较前后距离时使用
+        self.days = to_days(self.dates)
+
+    # 由 get_trade_cal 返回的DataFrame构建, 只保留开市的日期, 包含休市日时覆盖区间为全部日期的范围
+    @classmethod
+    def from_frame(cls, trade_cal):
+        cal_dates = trade_cal['cal_date'].astype('str')
+        if not len(cal_dates):
+            return cls([])
+        if 'is_open' in trade_cal.columns:
+            opened = cal_dates[trade_cal['is_open'].astype(int) == 1]
+        else:
+            opened = cal_dates
+        return cls(opened.to_numpy(), start=cal_dates.min(), end=cal_dates.max())
+
+    # 读取本地的 trade_calendar.csv, 同一个文件只读取一次, 文件不存在时返回None
+    @classmethod
+    def from_local(cls, fp, fname='trade_calendar.csv'):
+        path = os.path.abspath(os.path.join(fp, fname))
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = _LOCAL.get(path)
+        if cached is None or cached[0] != key:
+            cached = _LOCAL[path] = (key, cls.from_frame(pd.read_csv(path, dtype={'cal_date':'str'})))
+        return cached[1]
+
+    # 保存为与 get_trade_cal 相同列的CSV, 覆盖区间内的每个自然日一行
+    def save(self, fp, fname='trade_calendar.csv', exchange='SSE'):
+        cal_dates = to_int(pd.date_range(self.start, self.end, freq='D').strftime('%Y%m%d').to_numpy()) \
+                    if self.start is not None else np.zeros(0, dtype='int32')
+        pretrade = np.searchsorted(self.dates, cal_dates, side='left') - 1
+        frame = pd.DataFrame({'exchange': exchange, 'cal_date': self.strings(cal_dates),
+                              'is_open': np.isin(cal_dates, self.dates).astype(int),
+                              'pretrade_date': self._at(pretrade)})
+        path = os.path.join(fp, fname)
+        tmp = path + '.tmp'
+        frame.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+
+    # 合并相邻或重叠的另一个日历
+    def merge(self, other):
+        bounds = [b for b in (self.start, self.end, other.start, other.end) if b is not None]
+        return TradeCalendar(np.concatenate([self.dates, other.dates]),
+                             start=min(bounds) if bounds else None, end=max(bounds) if bounds else None)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __contains__(self, date):
+        i = np.searchsorted(self.dates, to_int(date))
+        return bool(i < len(self.dates) and self.dates[i] == to_int(date))
+
+    @property
+    def first(self):
+        return self.strings(self.dates[0]) if len(self.dates) else None
+
+    @property
+    def last(self):
+        return self.strings(self.dates[-1]) if len(self.dates) else None
+
+    # int转为str, 标量返回str, 数组返回str数组; 超出日历范围的位置为None
+    @staticmethod
+    def strings(values, missing=None):
+        values = np.asarray(values)
+        if values.ndim == 0:
+            return None if (missing is not None and bool(missing)) else str(int(values))
+        out = values.astype('str').astype('object')
+        if missing is not None:
+            out[missing] = None
+        return out
+
+    # 按位置取交易日, 超出范围的位置为None
+    def _at(self, i):
+        i = np.asarray(i)
+        missing = (i < 0) | (i >= len(self.dates))
+        if not len(self.dates):
+            return None if i.ndim == 0 else np.full(i.shape, None, dtype='object')
+        return self.strings(self.dates[np.clip(i, 0, len(self.dates) - 1)], missing)
+
+    # 当天或之前的最后一个交易日的位置, 早于第一个交易日时为-1
+    def loc(self, dates):
+        return np.searchsorted(self.dates, to_int(dates), side='right') - 1
+
+    # 当天或之后的第一个交易日, inclusive=False 时为之后的第一个交易日
+    def next(self, dates, inclusive=True):
+        return self._at(np.searchsorted(self.dates, to_int(dates), side='left' if inclusive else 'right'))
+
+    # 当天或之前的最后一个交易日, inclusive=False 时为之前的最后一个交易日
+    def prev(self, dates, inclusive=True):
+        return self._at(np.searchsorted(self.dates, to_int(dates), side='right' if inclusive else 'left') - 1)
+
+    # 最近的交易日, direction 为 backward(之前), foreward(之后) 或 both(前后距离较近的一个, 相同时取之前)
+    def nearest(self, dates, direction='backward'):
+        if direction == 'backward':
+            return self.prev(dates)
+        if direction == 'foreward':
+            return self.next(dates)
+        value = to_int(dates)
+        i = np.searchsorted(self.dates, value, side='right') - 1
+        if not len(self.dates):
+            return self._at(i)
+        j = np.searchsorted(self.dates, value, side='left')
+        pivot = to_days(value)
+        last = len(self.dates) - 1
+        before = np.where(i >= 0, pivot - self.days[np.clip(i, 0, last)], np.inf)
+        after = np.where(j < len(self.dates), self.days[np.clip(j, 0, last)] - pivot, np.inf)
+        return self._at(np.where(before <= after, i, j))
+
+    # 从当天(非交易日时为之前的最后一个交易日)起向后第n个交易日, n为负数时向前
+    def offset(self, dates, n):
+        return self._at(self.loc(dates) + np.asarray(n))
+
+    # 区间 [start_date, end_date] 内的交易日, str数组
+    def range(self, start_date=None, end_date=None):
+        i = 0 if start_date is None else np.searchsorted(self.dates, to_int(start_date), side='left')
+        j = len(self.dates) if end_date is None else np.searchsorted(self.dates, to_int(end_date), side='right')
+        return self.strings(self.dates[i:j])
+
+    # 区间内的交易日数
+    def count(self, start_date, end_date):
+        return int(np.searchsorted(self.dates, to_int(end_date), side='right') - np.searchsorted(self.dates, to_int(start_date), side='left'))
@@ -0,0 +1,132 @@
+# -*-coding:utf-8 -*-
+
+'''
+按日期的股票池
+在 代码×交易日 上预先计算每条筛选规则的布尔矩阵, 每个交易日按当天已知的信息判断, 回测和选股时直接查表, 不复制行情
+    * main: 主板股票
+    * st: 当天的名称不含ST, 按Tushare更名历史(namechange)确定每个交易日使用的名称, 没有更名记录时使用当前名称
+    * ipo: 截至当天已上市超过 ipo_days 个自然日
+
+Usage:
+    universe = Universe.build(stock_basic, trade_dates, namechange=namechange, ipo_days=365)
+    mask = universe.at('20210104', codes)                   # 单个交易日, 形状为 (代码数,)
+    mask = universe.at(['20210104', '20210201'], codes)      # 多个交易日, 形状为 (日期数, 代码数)
+    members = universe.members('20210104')
+    universe.save('./data/cache/universe.npz')
+'''
+
+import os
+import numpy as np
+import pandas as pd
+
+RULES = ('main', 'st', 'ipo')
+
+class Universe(object):
+    """
+    Arguments:
+        codes 	array 	Y 	股票代码, 已排序
+        dates 	array 	Y 	交易日, str, 格式20211231, 已排序
+        masks 	dict 	Y 	规则名到形状为 (代码数, 交易日数) 的布尔矩阵的映射, True为可以入选
+    """
+    def __init__(self, codes, dates, masks):
+        self.codes = pd.Index(np.asarray(codes).astype('str'))
+        self.dates = pd.Index(np.asarray(dates).astype('str'))
+        self.masks = {rule: np.asarray(mask, dtype='bool') for rule, mask in masks.items()}
+
+    # 由股票基本信息和更名历史构建
+    @classmethod
+    def build(cls, stock_basic, dates, namechange=None, ipo_days=365, market='主板'):
+        """
+        Arguments:
+            stock_basic 	DataFrame 	Y 	股票基本信息, 包含 ts_code(或code), name, market, list_date
+            dates 	array 	Y 	交易日
+            namechange 	DataFrame 	N 	Tushare更名历史, 包含 ts_code, name, start_date
+            ipo_days 	int 	N 	上市超过的自然日数
+            market 	str 	N 	板块名称包含的字符串
+
+        Returns:
+            universe 	Universe 	Y 	股票池
+        """
+        basic = stock_basic.rename(columns={'code': 'ts_code'}).drop_duplicates('ts_code')
+        basic = basic.sort_values('ts_code').reset_index(drop=True)
+        codes = pd.Index(basic['ts_code'].astype('str'))
+        dates = pd.Index(np.sort(np.asarray(dates).astype('str')))
+        shape = (len(codes), len(dates))
+
+        main = basic['market'].astype('str').str.contains(market, na=False).to_numpy()
+
+        # 截至每个交易日的上市日期上限, 字符串按字典序比较
+        # 缺失的上市日期先填空串, 含NaN的str列转为numpy字符串时会被截断为一个字符
+        cutoff = (pd.to_datetime(dates, format='%Y%m%d') - pd.Timedelta(days=ipo_days)).strftime('%Y%m%d').to_numpy(dtype='str')
+        list_date = basic['list_date'].fillna('').astype('str').to_numpy(dtype='str')
+        ipo = basic['list_date'].notna().to_numpy()[:, None] & (list_date[:, None] < cutoff[None, :])
+
+        masks = dict(main=np.broadcast_to(main[:, None], shape).copy(),
+                     st=~cls._st(basic, codes, dates, namechange),
+                     ipo=ipo)
+        return cls(codes, dates, masks)
+
+    # 每个交易日名称是否含ST, 形状为 (代码数, 交易日数)
+    @staticmethod
+    def _st(basic, codes, dates, namechange):
+        current = basic['name'].astype('str').str.contains('ST', na=False).to_numpy()
+        state = np.full((len(codes), len(dates)), np.nan)
+        if namechange is not None and len(namechange):
+            changes = namechange[['ts_code', 'name', 'start_date']].dropna()
+            changes = changes.assign(start_date=changes['start_date'].astype('str').str[:8]).sort_values(['ts_code', 'start_date'])
+            rows = codes.get_indexer(changes['ts_code'].astype('str'))
+            # 更名在非交易日生效时从之后的第一个交易日开始使用; 早于第一个交易日的更名记在第一个交易日
+            cols = dates.searchsorted(changes['start_date'].to_numpy(dtype='str'), side='left')
+            is_st = changes['name'].astype('str').str.contains('ST', na=False).to_numpy()
+            # 同一交易日有多条记录时保留最后一条
+            events = pd.DataFrame({'row': rows, 'col': cols, 'st': is_st})
+            events = events[(events['row'] >= 0) & (events['col'] < len(dates))].drop_duplicates(['row', 'col'], keep='last')
+            state[events['row'].to_numpy(), events['col'].to_numpy()] = events['st'].to_numpy()
+            state = pd.DataFrame(state.T).ffill().to_numpy().T
+        # 没有更名记录的部分使用当前名称
+        return np.where(np.isnan(state), current[:, None], state == 1.0)
+
+    # 多条规则同时满足的矩阵, 形状为 (代码数, 交易日数)
+    def mask(self, rules=RULES):
+        result = np.ones((len(self.codes), len(self.dates)), dtype='bool')
+        for rule in rules:
+            result &= self.masks[rule]
+        return result
+
+    # 按日期查表, 非交易日使用之前最近一个交易日的结果, 不在股票池中的代码为False
+    def at(self, dates, codes=None, rules=RULES):
+        """
+        Arguments:
+            dates 	str/list 	Y 	日期, 格式20211231
+            codes 	array 	N 	股票代码, 默认为全部代码
+            rules 	tuple 	N 	需要满足的规则, 默认为全部规则
+
+        Returns:
+            mask 	ndarray 	Y 	形状为 (日期数, 代码数), dates为单个日期时为 (代码数,)
+        """
+        squeeze = np.ndim(dates) == 0
+        cols = self.dates.searchsorted(np.atleast_1d(np.asarray(dates).astype('str')), side='right') - 1
+        rows = np.arange(len(self.codes)) if codes is None else self.codes.get_indexer(np.asarray(codes).astype('str'))
+        # 只取需要的行和列, 不计算整个矩阵
+        result = np.ones((len(cols), len(rows)), dtype='bool')
+        for rule in rules:
+            result &= self.masks[rule][np.maximum(rows, 0)[None, :], np.maximum(cols, 0)[:, None]]
+        result &= (rows >= 0)[None, :] & (cols >= 0)[:, None]
+        return result[0] if squeeze else result
+
+    # 某一日期可以入选的代码
+    def members(self, date, rules=RULES):
+        return self.codes[self.at(date, rules=rules)].to_numpy()
+
+    def save(self, fname):
+        os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+        tmp = fname + '.tmp.npz'
+        np.savez(tmp, codes=self.codes.to_numpy(dtype='str'), dates=self.dates.to_numpy(dtype='str'),
+                 **{'mask_' + rule: mask for rule, mask in self.masks.items()})
+        os.replace(tmp, fname)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname, allow_pickle=False) as f:
+            masks = {k[len('mask_'):]: f[k] for k in f.files if k.startswith('mask_')}
+            return cls(f['codes'], f['dates'], masks)
@@ -3,20 +3,7 @@ import pandas as pd
 import pandas_ta as ta 
 import vectorbt as vbt
 import os
-
-def trailing_stop(price, entries, discount=0.95):
-    
-    if len(price) != len(entries): 
-        print('price and entries length mismatch')
-        return 0
-    
-    ts = price.copy(deep=True)
-    for i in range(1, len(price)):
-        if entries.iloc[i] == True:
-            ts.iloc[i] = price.iloc[i]
-        else: 
-            ts.iloc[i] = max(ts.iloc[i-1], price.iloc[i])
-    return ts * discount
+from stops import trailing_stop
 
 def combine_stats(pf: vbt.portfolio.base.Portfolio, ticker: str, strategy: str, mode: int = 0):
     header = pd.Series({
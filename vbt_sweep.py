@@ -0,0 +1,186 @@
+# -*-coding:utf-8 -*-
+
+'''
+vectorbt参数扫描
+对整个股票池的宽表行情和指标参数网格, 每批股票只调用一次 Portfolio.from_signals,
+所有 参数组合×股票 作为不同的列一起回测; 按内存预算把股票分批, 每批的列数不超过预算
+    * boll: BBANDS 的 window 和 alpha(标准差倍数), 收盘价上穿下轨买入, 下穿上轨卖出, 与vbt_bollinger.py相同
+    * dmi: ADX 的 length 以及 ADX/DMP 阈值, 买入条件与vbt_dmi.py相同, 卖出使用跟踪止损
+
+Usage:
+    python vbt_sweep.py --indicator boll --windows 10,20,30 --alphas 1.5,2,2.5
+    python vbt_sweep.py --indicator dmi --lengths 7,14,21 --adx_levels 20,25,30 --dmp_levels 5,10 --memory 2048
+'''
+
+import argparse, itertools, os, time
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+import dataloader
+from stops import trailing_stop
+
+ADX = vbt.IndicatorFactory.from_pandas_ta('ADX')
+
+# 回测时每个 (bar, 列) 大约占用的字节数, 包括价格、信号以及vectorbt的中间数组
+BYTES_PER_CELL = 64
+
+PF_KWARGS = dict(size=np.inf, fees=0.001, freq='1D')
+
+# 读取宽表行情, 停牌日沿用前一日价格
+def load_prices(start_date, end_date, fp, codes=None, cache_fp=None, adjust_fp=None):
+    """
+    Arguments:
+        start_date 	str 	Y 	开始日期
+        end_date 	str 	Y 	结束日期
+        fp 	str 	Y 	每日行情的目录
+        codes 	list 	N 	股票代码, 默认全部
+        cache_fp 	str 	N 	行情面板的缓存目录
+        adjust_fp 	str 	N 	复权结果的缓存目录
+
+    Returns:
+        prices 	dict 	Y 	high, low, close 三个以datetime为索引、code为列的宽表
+    """
+    panel = dataloader.get_panel_from_local(start_date=start_date, end_date=end_date, fp=fp, cache_fp=cache_fp, adjust_fp=adjust_fp)
+    if codes is not None:
+        panel = panel.select(codes)
+    return {field: panel.wide(field).ffill() for field in ('high', 'low', 'close')}
+
+# 在内存预算内每批可以回测的股票数
+def chunk_size(n_bars, n_params, memory):
+    return max(1, int(memory * 1024 * 1024 // (n_bars * n_params * BYTES_PER_CELL)))
+
+# 布林线参数网格的买卖信号, 列为 (bb_window, bb_alpha, code)
+def boll_signals(prices, windows, alphas):
+    close = prices['close']
+    boll = vbt.BBANDS.run(close, window=windows, alpha=alphas, param_product=True)
+    entries = boll.close_crossed_above(boll.lower)
+    exits = boll.close_crossed_below(boll.upper)
+    return close, entries, exits
+
+# DMI参数网格的买卖信号, 列为 (adx_length, adx_level, dmp_level, code)
+def dmi_signals(prices, lengths, adx_levels, dmp_levels, discount=0.95):
+    close = prices['close']
+    values = close.to_numpy()
+
+    # 每个length单独运行一次指标, 结果的列与close相同, 不依赖vectorbt生成的参数层名称
+    entry_blocks, exit_blocks, params = [], [], []
+    for length in lengths:
+        adx = ADX.run(prices['high'], prices['low'], close, length=length)
+        adx_value = adx.adx.to_numpy()
+        dmp = adx.dmp.to_numpy()
+        crossed = adx.dmp_crossed_above(adx.dmn).to_numpy()
+        for adx_level, dmp_level in itertools.product(adx_levels, dmp_levels):
+            entries = (dmp < dmp_level) | ((adx_value > adx_level) & crossed)
+            # 跟踪止损在同一份收盘价上按参数组合计算, 不复制收盘价
+            entry_blocks.append(entries)
+            exit_blocks.append(values < trailing_stop(values, entries, discount=discount))
+            params.append((length, adx_level, dmp_level))
+
+    columns = pd.MultiIndex.from_tuples([param + (code,) for param in params for code in close.columns],
+                                        names=['adx_length', 'adx_level', 'dmp_level', 'code'])
+    entries = pd.DataFrame(np.concatenate(entry_blocks, axis=1), index=close.index, columns=columns)
+    exits = pd.DataFrame(np.concatenate(exit_blocks, axis=1), index=close.index, columns=columns)
+    # 收盘价保持每个股票一列, 与boll_signals相同, 由from_signals按code广播到全部参数组合
+    return close, entries, exits
+
+SIGNALS = dict(boll=boll_signals, dmi=dmi_signals)
+
+# 分批回测全部股票和参数组合
+def sweep(prices, indicator, grid, memory=1024):
+    """
+    Arguments:
+        prices 	dict 	Y 	load_prices 返回的宽表
+        indicator 	str 	Y 	boll 或 dmi
+        grid 	dict 	Y 	参数网格, 如 dict(windows=[10, 20], alphas=[2.0])
+        memory 	float 	N 	每批回测的内存预算, MB
+
+    Returns:
+        result 	DataFrame 	Y 	以 参数×code 为索引的 total_return, sharpe_ratio, max_drawdown, trades
+    """
+    codes = prices['close'].columns
+    n_params = int(np.prod([len(values) for values in grid.values()]))
+    step = chunk_size(len(prices['close']), n_params, memory)
+
+    results = []
+    for i in range(0, len(codes), step):
+        chunk = {field: frame.iloc[:, i:i + step] for field, frame in prices.items()}
+        close, entries, exits = SIGNALS[indicator](chunk, **grid)
+        pf = vbt.Portfolio.from_signals(close, entries, exits, **PF_KWARGS)
+        results.append(pd.DataFrame(dict(
+                            total_return=pf.total_return(),
+                            sharpe_ratio=pf.sharpe_ratio(),
+                            max_drawdown=pf.max_drawdown(),
+                            trades=pf.trades.count())))
+        dataloader.progress_bar(min(i + step, len(codes)), len(codes), prefix='Progress:', suffix='Complete', barLength=50)
+
+    return pd.concat(results)
+
+# 按参数组合汇总所有股票的结果
+def summarize(result):
+    levels = [name for name in result.index.names if name != 'code']
+    return result.groupby(level=levels).agg(['mean', 'median'])
+
+def parse_list(value, dtype=float):
+    return [dtype(v) for v in value.split(',')]
+
+def get_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--indicator', help='Indicator to sweep: boll or dmi')
+    parser.add_argument('--start_date', help='Start Date, example:20200301')
+    parser.add_argument('--end_date', help='End Date, example:20201231')
+    parser.add_argument('--fp', help='File Path Prefix for daily prices')
+    parser.add_argument('--scope', help='Back test data scope: RANDOM, HS300, ZZ500, ZZ1000, ALL')
+    parser.add_argument('--panel_cache', help='Directory to cache the adjusted market panel as a memory-mapped file')
+    parser.add_argument('--adjust_cache', help='Directory to cache forward-adjusted prices by end date, extended incrementally')
+    parser.add_argument('--memory', type=float, help='Memory budget in MB for each from_signals call')
+    parser.add_argument('--windows', help='BBANDS windows, example:10,20,30')
+    parser.add_argument('--alphas', help='BBANDS std multipliers, example:1.5,2,2.5')
+    parser.add_argument('--lengths', help='ADX lengths, example:7,14,21')
+    parser.add_argument('--adx_levels', help='ADX thresholds, example:20,25,30')
+    parser.add_argument('--dmp_levels', help='DMP thresholds, example:5,10')
+    parser.add_argument('--plot', help='Plot the heatmap: True or False')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+
+    t1 = time.time()
+
+    indicator = args.indicator if args.indicator else 'boll'
+    start_date = args.start_date if args.start_date else '20210101'
+    end_date = args.end_date if args.end_date else '20220128'
+    fp = args.fp if args.fp else './data/daily/'
+    method = args.scope if args.scope else 'ALL'
+    memory = args.memory if args.memory else 1024
+
+    stock_basic = pd.read_csv(os.path.join(fp, 'stock_basic.csv'), dtype={'list_date':'str'}).rename(columns={'ts_code':'code'})
+    # 主板、非ST、上市满一年按第一个交易日查表, ST以当天的名称判断; filter_stock只负责按范围抽样
+    universe = dataloader.get_universe_from_local(start_date=start_date, end_date=end_date, fp=fp, cache_fp=args.panel_cache)
+    stock_basic = stock_basic[stock_basic['code'].isin(universe.members(universe.dates[0]))]
+    selected = dataloader.filter_stock(dataset=stock_basic, method=method, n=100, ignore_ST=False, ignore_IPO=False, market=None)
+    prices = load_prices(start_date, end_date, fp, codes=np.sort(selected['code'].dropna().unique()), cache_fp=args.panel_cache, adjust_fp=args.adjust_cache)
+
+    if indicator == 'boll':
+        grid = dict(windows=parse_list(args.windows, int) if args.windows else [10, 20, 30],
+                    alphas=parse_list(args.alphas) if args.alphas else [1.5, 2.0, 2.5])
+        x_level, y_level, slider_level = 'bb_window', 'bb_alpha', None
+    else:
+        grid = dict(lengths=parse_list(args.lengths, int) if args.lengths else [7, 14, 21],
+                    adx_levels=parse_list(args.adx_levels) if args.adx_levels else [20.0, 25.0, 30.0],
+                    dmp_levels=parse_list(args.dmp_levels) if args.dmp_levels else [10.0])
+        x_level, y_level, slider_level = 'adx_length', 'adx_level', 'dmp_level'
+
+    result = sweep(prices, indicator, grid, memory=memory)
+    summary = summarize(result)
+    print(np.round(summary, 4))
+
+    t2 = time.time()
+    print('共处理%.0f个股票, %.0f组参数，总计耗时:%.2f 秒' % (prices['close'].shape[1], len(summary), (t2 - t1)))
+
+    if args.plot:
+        fig = summary[('total_return', 'mean')].vbt.heatmap(
+            x_level=x_level, y_level=y_level, slider_level=slider_level, symmetric=True,
+            trace_kwargs=dict(colorbar=dict(title='Mean total return', tickformat='%')))
+        fig.show()